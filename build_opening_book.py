@@ -0,0 +1,86 @@
+import argparse
+import time
+
+from computer_opponent import ComputerOpponent, ParallelSearch
+from shax_engine.board_manager import BoardManager, GameState
+from shax_engine.opening_book import MAX_PLIES, OpeningBook, canonical_hash
+
+# Builds the opening book the CPU opponent plays its first placements from
+# Finds every position with fewer than --plies pieces placed (one of each set of positions that are rotations or
+# reflections of each other), searches each of them to --depth in deterministic mode and saves the best moves.
+# --plies can't be more than MAX_PLIES, since positions with a jare in them aren't the same as their turned versions.
+#
+# Example: python build_opening_book.py opening_book.npy --plies 4 --depth 6 --workers 8
+
+
+# Returns a position (from BoardManager.export_position()) for each set of symmetric positions
+# with fewer than plies pieces placed
+def get_positions(plies: int, min_pieces: int, max_pieces: int):
+    board_manager = BoardManager(min_pieces, max_pieces)
+    board_manager.start_game()
+
+    positions = []
+    level = {canonical_hash(board_manager)[0]: board_manager.export_position()}
+    for _ in range(plies):
+        positions.extend(level.values())
+
+        # Symmetric positions have symmetric moves, so only one of them needs to be played out
+        next_level = {}
+        for position in level.values():
+            board_manager = BoardManager.from_position(position)
+            for move in board_manager.legal_moves():
+                board_manager.apply(move)
+                if board_manager.game_state == GameState.PLACEMENT:
+                    next_level.setdefault(canonical_hash(board_manager)[0], board_manager.export_position())
+                board_manager.undo()
+
+        level = next_level
+
+    return positions
+
+
+def main(args):
+    start_time = time.perf_counter()
+    positions = get_positions(args.plies, args.min_pieces, args.max_pieces)
+    print(f"Searching {len(positions)} positions to depth {args.depth}", flush=True)
+
+    if args.workers > 1:
+        cpu = ParallelSearch(args.workers, memory_budget=args.memory, max_depth=args.depth, deterministic=True)
+    else:
+        cpu = ComputerOpponent(memory_budget=args.memory, max_depth=args.depth, deterministic=True)
+
+    # The book is for games with the piece limits the board manager ends up with
+    limits = BoardManager(args.min_pieces, args.max_pieces)
+    book = OpeningBook(limits.MIN_PIECES, limits.MAX_PIECES)
+    try:
+        for i, position in enumerate(positions):
+            board_manager = BoardManager.from_position(position)
+            book.add(board_manager, cpu.make_move(board_manager))
+
+            if (i + 1) % 100 == 0:
+                print(f"[{time.perf_counter() - start_time:8.1f}s] {i + 1}/{len(positions)} positions", flush=True)
+    finally:
+        if isinstance(cpu, ParallelSearch):
+            cpu.close()
+
+    book.save(args.path)
+    print(f"[{time.perf_counter() - start_time:8.1f}s] Wrote {len(book)} positions to {args.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Searches the first placements deeply and saves the best moves")
+    parser.add_argument("path", help="file (.npy) the book is written to")
+    parser.add_argument("--plies", type=int, default=4,
+                        help=f"positions with fewer pieces placed are in the book (at most {MAX_PLIES})")
+    parser.add_argument("--depth", type=int, default=5, help="depth every position is searched to")
+    parser.add_argument("--workers", type=int, default=1, help="processes each search is split between")
+    parser.add_argument("--memory", type=int, default=16 * 2**20, help="transposition table bytes per process")
+
+    parser.add_argument("--min-pieces", type=int, default=2)
+    parser.add_argument("--max-pieces", type=int, default=12)
+
+    args = parser.parse_args()
+    if args.plies > MAX_PLIES:
+        parser.error(f"--plies can't be more than {MAX_PLIES}")
+
+    main(args)
@@ -0,0 +1,35 @@
+import argparse
+import time
+
+from shax_engine.tablebase import build_tables, write_tablebase
+
+# Builds the endgame tablebase the CPU opponent probes in the movement stage
+# Solves every position where both players have more than MIN_PIECES pieces and --max-total pieces at most
+# between them, then writes the tables to one file that every search process maps into memory.
+# The smallest tables (MIN_PIECES + 1 pieces each) have about 206 million positions (51 million boards, each with
+# 4 pairs of jare counts), and each extra piece multiplies that by 3 to 10, so larger tablebases take a lot of time
+# and memory to build.
+#
+# Example: python build_tablebase.py tablebase.bin --max-total 9
+
+
+def main(args):
+    start_time = time.perf_counter()
+
+    def progress(message):
+        print(f"[{time.perf_counter() - start_time:8.1f}s] {message}", flush=True)
+
+    tables = build_tables(args.min_pieces, args.max_total, progress=progress)
+    write_tablebase(args.path, tables, args.min_pieces)
+
+    total_positions = sum(len(table) for table in tables.values())
+    progress(f"Wrote {len(tables)} tables ({total_positions} positions) to {args.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves the movement stage positions with the fewest pieces")
+    parser.add_argument("path", help="file the tablebase is written to")
+    parser.add_argument("--max-total", type=int, default=8, help="most pieces on the board (both players together)")
+    parser.add_argument("--min-pieces", type=int, default=2, help="the games' min_pieces (at least 3 is used)")
+
+    main(parser.parse_args())
@@ -1,281 +1,358 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
 import sys
-from board_manager import GameState
-import numpy as np
-from board_manager import BoardManager, GameState
+from mcts_opponent import MCTSOpponent
+from shax_engine.board_manager import BoardManager, GameState
+from shax_engine.opening_book import OpeningBook
+from shax_engine.tablebase import Tablebase
+from shax_engine.transposition_table import Bound, TranspositionTable
+from shax_log import log_event, setup_logging
+from shax_protocol import BINARY_SUBPROTOCOL, decode_response, encode_request
+import logging
 import math
+import time
 import asyncio
 import websockets
 import json
 import subprocess
 
 
-class ComputerOpponent():
-    def __init__(self) -> None:
-        pass
+logger = logging.getLogger("computer_opponent")
+
+
+# Raised inside the search when the CPU runs out of time or nodes for the current move
+class SearchTimeout(Exception):
+    pass
+
 
+class ComputerOpponent():
+    # How many nodes are searched between each check of the clock
+    CLOCK_CHECK_INTERVAL = 256
+
+    # Number of killer moves remembered for each ply
+    TOTAL_KILLERS = 2
+
+    # One more than the largest code BoardManager.encode_move() can return
+    MOVE_CODE_LIMIT = 1024
+
+    # Move ordering scores that rank above any history score
+    TT_MOVE_SCORE = 3 << 40
+    JARE_MOVE_SCORE = 2 << 40
+    KILLER_MOVE_SCORE = 1 << 40
+
+    # Value of a won game with the tablebase (winning in n plies is worth TABLEBASE_WIN - n)
+    TABLEBASE_WIN = 1000
+
+    # memory_budget is the number of bytes the CPU can use to remember positions it already searched
+    # time_limit (seconds) and node_limit cap how long the CPU thinks about each move (None for no cap)
+    # max_depth is the deepest the CPU will search even if it still has time left
+    # deterministic makes the chosen move only depend on the position, so it's the same move ParallelSearch picks:
+    # every search goes all the way to max_depth (the time and node limits are ignored), positions from the
+    # transposition table are only reused at the exact depth they were searched to and ties between the best
+    # moves go to the first of them in BoardManager.legal_moves() order
+    # debug prints the stats of every search
+    # tablebase_path is an endgame tablebase from build_tablebase.py that gives the exact value of the positions
+    # it covers (None to not use one). Games that ended are then valued as wins and losses too
+    # opening_book_path is an opening book from build_opening_book.py whose moves are played without searching
+    # (None to not use one)
+    def __init__(self, memory_budget=4 * 2**20, time_limit=1.0, node_limit=None, max_depth=32,
+                 deterministic=False, debug=False, tablebase_path=None, opening_book_path=None) -> None:
+        self.transposition_table = TranspositionTable(memory_budget)
+        self.tablebase = None if tablebase_path is None else Tablebase(tablebase_path)
+        self.opening_book = None if opening_book_path is None else OpeningBook.load(opening_book_path)
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.deterministic = deterministic
+        self.debug = debug
+
+        # Number of positions visited in the current search
+        self.nodes = 0
+
+        # Number of positions where a move caused a cutoff, and how many times it was the first move tried
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+        # Deepest search that finished for the current move and when its budget runs out
+        self.completed_depth = 0
+        self.deadline = None
+
+        # Ply -> codes of the last moves that caused a cutoff at that ply
+        self.killers = [[0] * self.TOTAL_KILLERS for _ in range(self.max_depth + 1)]
+
+        # Player number -> move code -> how much that move has caused cutoffs
+        self.history = [[0] * self.MOVE_CODE_LIMIT for _ in range(2)]
+
+        # Stats about the last move the CPU made
+        self.last_search = {"depth": 0, "nodes": 0, "time": 0.0, "cutoffs": 0, "first_move_cutoffs": 0}
+
+    # Searches one ply deeper at a time until the time/node budget runs out
+    # and returns the best move of the deepest search that finished
     def make_move(self, board_manager: BoardManager):
-        _, best_move = self.minimax(3, -math.inf, math.inf,
-                                    board_manager.current_turn == 1, board_manager)
+        book_move = self._probe_book(board_manager)
+        if book_move is not None:
+            return book_move
+
+        if self.deterministic:
+            results = self.search_root(board_manager)
+            return pick_best_move(board_manager, results[-1]) if results else []
+
+        start_time = self._start_search()
+        start_ply = len(board_manager.undo_stack)
+
+        best_move = []
+        for depth in range(1, self.max_depth + 1):
+            try:
+                # The best move of each search is stored in the transposition table,
+                # so the next (deeper) search starts by looking at it first
+                _, move = self.negamax(depth, 0, -math.inf, math.inf, board_manager)
+            except SearchTimeout:
+                # Take back the moves of the unfinished search
+                while len(board_manager.undo_stack) > start_ply:
+                    board_manager.undo()
+                break
+
+            if move:
+                best_move = move
+            self.completed_depth = depth
+
+        self._finish_search(start_time)
         return best_move
 
-    def minimax(self, depth, alpha, beta, maximizing_player, board_manager: BoardManager):
-        # Save the current game variables
-        current_turn = board_manager.current_turn
-        board_state = np.copy(board_manager.board_state)
-        total_pieces = np.copy(board_manager.total_pieces)
-        first_to_jare = board_manager.first_to_jare
-        current_jare = np.copy(board_manager.current_jare)
-        game_state = board_manager.game_state
+    # Searches the root moves with the given move codes (every legal move if None) one ply deeper at a time
+    # until the time/node budget runs out
+    # Returns a {move code: value} dict for each depth that finished. A move's value is exact if it's at least
+    # as good as the moves searched before it and only an upper bound otherwise, which is enough to find
+    # the best moves when the root moves are split between several searches
+    def search_root(self, board_manager: BoardManager, codes=None):
+        start_time = self._start_search()
+        start_ply = len(board_manager.undo_stack)
+
+        moves = [(move, code) for move, code, _ in board_manager.legal_moves_info() if codes is None or code in codes]
+
+        results = []
+        for depth in range(1, self.max_depth + 1):
+            try:
+                values = self._search_root_moves(depth, moves, board_manager)
+            except SearchTimeout:
+                # Take back the moves of the unfinished search
+                while len(board_manager.undo_stack) > start_ply:
+                    board_manager.undo()
+                break
+
+            results.append(values)
+            self.completed_depth = depth
+
+            # Look at the best moves first in the next (deeper) search
+            moves.sort(key=lambda root_move: values[root_move[1]], reverse=True)
+
+        self._finish_search(start_time)
+        return results
+
+    # Searches each root move to the depth and returns their {move code: value} dict
+    def _search_root_moves(self, depth, moves, board_manager: BoardManager):
+        self.nodes += 1
+        player = board_manager.current_turn
+
+        best_eval = -math.inf
+        values = {}
+        for move, code in moves:
+            board_manager.apply(move)
+
+            # Every value is a whole number of pieces, so searching just below the best value so far
+            # still gives the exact value of the moves that tie with it
+            if board_manager.current_turn == player:
+                child_eval, _ = self.negamax(depth - 1, 1, best_eval - 1, math.inf, board_manager)
+            else:
+                child_eval, _ = self.negamax(depth - 1, 1, -math.inf, 1 - best_eval, board_manager)
+                child_eval = -child_eval
+
+            board_manager.undo()
+
+            values[code] = child_eval
+            best_eval = max(best_eval, child_eval)
+
+        return values
+
+    # Returns the opening book's move for the position (None if it isn't in the book)
+    def _probe_book(self, board_manager: BoardManager):
+        if self.opening_book is None:
+            return None
+
+        start_time = time.perf_counter()
+        move = self.opening_book.probe(board_manager)
+        if move is not None:
+            self.last_search = {"depth": 0, "nodes": 0, "time": time.perf_counter() - start_time, "cutoffs": 0,
+                                "first_move_cutoffs": 0}
+
+        return move
+
+    # Resets everything that's kept per search and returns when the search started
+    def _start_search(self):
+        self.transposition_table.new_search()
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.completed_depth = 0
+        self.deadline = None if self.time_limit is None else time.perf_counter() + self.time_limit
+
+        # Killer moves only make sense for the position they were found in,
+        # while the history of older moves fades out over time
+        for killers in self.killers:
+            killers[:] = [0] * self.TOTAL_KILLERS
+        for player_history in self.history:
+            player_history[:] = [score >> 1 for score in player_history]
+
+        return time.perf_counter()
+
+    # Saves the stats of the search that started at start_time
+    def _finish_search(self, start_time):
+        self.last_search = {"depth": self.completed_depth,
+                            "nodes": self.nodes,
+                            "time": time.perf_counter() - start_time,
+                            "cutoffs": self.cutoffs,
+                            "first_move_cutoffs": self.first_move_cutoffs}
+
+        if self.debug:
+            first_move_rate = self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
+            print("CPU searched to depth", self.completed_depth, "in", round(self.last_search["time"], 3),
+                  "seconds:", self.nodes, "nodes,", self.cutoffs, "cutoffs",
+                  "(" + str(round(100 * first_move_rate)) + "% on the first move)")
+
+    # Returns the value of the position for the player whose turn it is, along with their best move
+    # ply is how many moves deep the position is from the root of the search
+    def negamax(self, depth, ply, alpha, beta, board_manager: BoardManager):
+        # Stop searching if the move's budget ran out
+        self.nodes += 1
+        if self.nodes % self.CLOCK_CHECK_INTERVAL == 0 and self._is_out_of_budget():
+            raise SearchTimeout()
+
+        player = board_manager.current_turn
+
+        # Positions in the tablebase don't need to be searched (except at the root, where a move is needed)
+        if self.tablebase is not None and ply > 0:
+            result = self.tablebase.probe(board_manager)
+            if result is not None:
+                outcome, plies = result
+                return outcome * (self.TABLEBASE_WIN - plies), []
 
         # Check if the base case was reached
-        if depth == 0 or game_state == GameState.STOPPED:
-            return self.evaluate_game(board_manager), []
-
-        # Computer's Turn
-        if maximizing_player:
-            maxEval = -math.inf
-            bestMove = []
-
-            # Placement Stage
-            if (game_state == GameState.PLACEMENT):
-                # Get all the empty spots on the board
-                empty_spots = np.where(board_state == -1)
-
-                # Place a piece on each spot and minimax the new board
-                for i in range(len(empty_spots[0])):
-                    spot = (empty_spots[1][i], empty_spots[0][i])
-                    # print("\t"*(3-depth), "CPU places piece at", spot)
-                    board_manager.place_piece(spot[0], spot[1], 1)
-
-                    child_eval, _ = self.minimax(
-                        depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                    # Reset the board to its previous state
-                    board_manager.current_turn = current_turn
-                    board_manager.board_state = np.copy(board_state)
-                    board_manager.total_pieces = np.copy(total_pieces)
-                    board_manager.first_to_jare = first_to_jare
-                    board_manager.current_jare = np.copy(current_jare)
-                    board_manager.game_state = game_state
-
-                    # Check if this is the best move yet
-                    if (child_eval > maxEval):
-                        maxEval = child_eval
-                        bestMove = [spot[0], spot[1]]
-
-                    # Prune options
-                    alpha = max(alpha, child_eval)
-                    if beta <= alpha:
-                        break
-
-                return maxEval, bestMove
-
-            # Removal Stage
-            elif (game_state == GameState.REMOVAL or game_state == GameState.FIRST_REMOVAL):
-                # Get the indices of all the human player's pieces
-                # TODO: check if there is a better way to do this
-                board_copy = np.copy(board_state)
-                non_null = np.logical_and(board_copy != None, board_copy != -1)
-                board_copy[non_null] = board_copy[non_null] & 1
-                indices = np.where(board_copy == 0)
-
-                # Remove each piece and minimax the new board
-                for i in range(len(indices[0])):
-                    x = indices[1][i]
-                    y = indices[0][i]
-                    id = board_state[y][x]
-
-                    # print("\t"*(3-depth), "CPU removes piece", id)
-                    board_manager.remove_piece(id, 1)
-                    child_eval, _ = self.minimax(
-                        depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                    # Reset the board to its previous state
-                    board_manager.current_turn = current_turn
-                    board_manager.board_state = np.copy(board_state)
-                    board_manager.total_pieces = np.copy(total_pieces)
-                    board_manager.first_to_jare = first_to_jare
-                    board_manager.current_jare = np.copy(current_jare)
-                    board_manager.game_state = game_state
-
-                    # Check if this is the best move yet
-                    if (child_eval > maxEval):
-                        maxEval = child_eval
-                        bestMove = [id]
-
-                    # Prune options
-                    alpha = max(alpha, child_eval)
-                    if beta <= alpha:
-                        break
-
-                return maxEval, bestMove
-
-            # Movement State
-            elif (game_state == GameState.MOVEMENT):
-                # Get the indices of all the computer's pieces
-                # TODO: check if there is a better way to do this
-                board_copy = np.copy(board_state)
-                non_null = np.logical_and(board_copy != None, board_copy != -1)
-                board_copy[non_null] = board_copy[non_null] & 1
-                indices = np.where(board_copy == 1)
-
-                # Move each piece and minimax the new board
-                for i in range(len(indices[0])):
-                    x = indices[1][i]
-                    y = indices[0][i]
-                    id = board_state[y][x]
-
-                    possible_moves = board_manager._get_possible_moves(id)
-                    for move in possible_moves:
-
-                        # print("\t"*(3-depth), "CPU moves piece", id, "to", move)
-                        board_manager.move_piece(move[0], move[1], id, 1)
-
-                        child_eval, _ = self.minimax(
-                            depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                        # Reset the board to its previous state
-                        board_manager.current_turn = current_turn
-                        board_manager.board_state = np.copy(board_state)
-                        board_manager.total_pieces = np.copy(total_pieces)
-                        board_manager.first_to_jare = first_to_jare
-                        board_manager.current_jare = np.copy(current_jare)
-                        board_manager.game_state = game_state
-
-                        # Check if this is the best move yet
-                        if (child_eval > maxEval):
-                            maxEval = child_eval
-                            bestMove = [move[0], move[1], id]
-
-                        # Prune options
-                        alpha = max(alpha, child_eval)
-                        if beta <= alpha:
-                            break
-
-                return maxEval, bestMove
-
-        # Player's turn
+        if depth == 0 or board_manager.game_state == GameState.STOPPED:
+            value = self.evaluate_game(board_manager)
+            return (value if player == 1 else -value), []
+
+        # Check if this position was already searched
+        tt_code = 0
+        entry = self.transposition_table.probe(board_manager.position_hash)
+        if entry is not None:
+            value, entry_depth, bound, tt_code = entry
+
+            # Reuse the previous result if it was searched at least as deep
+            # (only exactly as deep in deterministic mode, since a deeper result depends on the search order)
+            if entry_depth == depth or (entry_depth > depth and not self.deterministic):
+                if bound == Bound.EXACT:
+                    return value, list(board_manager.decode_move(tt_code)) if tt_code else []
+                elif bound == Bound.LOWER:
+                    alpha = max(alpha, value)
+                elif bound == Bound.UPPER:
+                    beta = min(beta, value)
+
+                if beta <= alpha:
+                    return value, list(board_manager.decode_move(tt_code)) if tt_code else []
+
+        # Remember the search window to know what kind of bound the result is
+        window = (alpha, beta)
+
+        best_eval = -math.inf
+        best_move = []
+
+        # Play each legal move (most promising first), search the new board and then take the move back
+        for i, (move, code) in enumerate(self._order_moves(board_manager, tt_code, ply)):
+            board_manager.apply(move)
+
+            # Some moves (e.g. making a jare) give the same player another turn
+            if board_manager.current_turn == player:
+                child_eval, _ = self.negamax(depth - 1, ply + 1, alpha, beta, board_manager)
+            else:
+                child_eval, _ = self.negamax(depth - 1, ply + 1, -beta, -alpha, board_manager)
+                child_eval = -child_eval
+
+            board_manager.undo()
+
+            # Check if this is the best move yet
+            if child_eval > best_eval:
+                best_eval = child_eval
+                best_move = list(move)
+
+            # Prune options
+            alpha = max(alpha, child_eval)
+            if beta <= alpha:
+                self._record_cutoff(player, code, depth, ply)
+                if i == 0:
+                    self.first_move_cutoffs += 1
+                break
+
+        self._store_result(board_manager, depth, best_eval, window, best_move)
+        return best_eval, best_move
+
+    # Returns (move, move code) pairs for every legal move, sorted so the most promising moves come first:
+    # the best move from the transposition table, then moves that complete a jare,
+    # then killer moves and then all the other moves by their history score
+    def _order_moves(self, board_manager: BoardManager, tt_code, ply):
+        killers = self.killers[ply]
+        history = self.history[board_manager.current_turn]
+
+        scored_moves = []
+        for move, code, completes_jare in board_manager.legal_moves_info():
+            if code == tt_code:
+                score = self.TT_MOVE_SCORE
+            elif completes_jare:
+                score = self.JARE_MOVE_SCORE
+            elif code in killers:
+                score = self.KILLER_MOVE_SCORE
+            else:
+                score = history[code]
+
+            scored_moves.append((score, move, code))
+
+        scored_moves.sort(key=lambda scored_move: scored_move[0], reverse=True)
+        return [(move, code) for _, move, code in scored_moves]
+
+    # Remembers a move that caused a cutoff so it gets searched earlier in other positions
+    def _record_cutoff(self, player, code, depth, ply):
+        self.cutoffs += 1
+
+        killers = self.killers[ply]
+        if code not in killers:
+            killers.pop()
+            killers.insert(0, code)
+
+        self.history[player][code] += depth * depth
+
+    # Checks if the current search went over its time or node limit
+    def _is_out_of_budget(self):
+        # Always finish the first search so there's a move to play
+        if self.completed_depth == 0 or self.deterministic:
+            return False
+
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            return True
+
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    # Saves the result of searching the current position in the transposition table
+    # window is the (alpha, beta) pair the position was searched with
+    def _store_result(self, board_manager: BoardManager, depth, value, window, best_move):
+        alpha, beta = window
+        if value <= alpha:
+            bound = Bound.UPPER
+        elif value >= beta:
+            bound = Bound.LOWER
         else:
-            minEval = math.inf
-            bestMove = []
-
-            # Placement Stage
-            if (game_state == GameState.PLACEMENT):
-                # Get all the empty spots on the board
-                empty_spots = np.where(board_state == -1)
-
-                # Place a piece on each spot and minimax the new board
-                for i in range(len(empty_spots[0])):
-                    spot = (empty_spots[1][i], empty_spots[0][i])
-                    # print("\t"*(3-depth), "Player places piece at", spot)
-                    board_manager.place_piece(spot[0], spot[1], 0)
-
-                    child_eval, _ = self.minimax(
-                        depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                    # Reset the board to its previous state
-                    board_manager.current_turn = current_turn
-                    board_manager.board_state = np.copy(board_state)
-                    board_manager.total_pieces = np.copy(total_pieces)
-                    board_manager.first_to_jare = first_to_jare
-                    board_manager.current_jare = np.copy(current_jare)
-                    board_manager.game_state = game_state
-
-                    # Check if this is the best move yet
-                    if (child_eval < minEval):
-                        minEval = child_eval
-                        bestMove = [spot[0], spot[1]]
-
-                    # Perform pruning
-                    beta = min(beta, child_eval)
-                    if beta <= alpha:
-                        break
-
-                return minEval, bestMove
-
-            # Removal Stage
-            elif (game_state == GameState.REMOVAL or game_state == GameState.FIRST_REMOVAL):
-                # Get the indices of all the computer's pieces
-                # TODO: check if there is a better way to do this
-                board_copy = np.copy(board_state)
-                non_null = np.logical_and(board_copy != None, board_copy != -1)
-                board_copy[non_null] = board_copy[non_null] & 1
-                indices = np.where(board_copy == 1)
-
-                # Remove each piece and minimax the new board
-                for i in range(len(indices[0])):
-                    x = indices[1][i]
-                    y = indices[0][i]
-                    id = board_state[y][x]
-
-                    # print("\t"*(3-depth), "Player removes piece", id)
-                    board_manager.remove_piece(id, 0)
-
-                    child_eval, _ = self.minimax(
-                        depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                    # Reset the board to its previous state
-                    board_manager.current_turn = current_turn
-                    board_manager.board_state = np.copy(board_state)
-                    board_manager.total_pieces = np.copy(total_pieces)
-                    board_manager.first_to_jare = first_to_jare
-                    board_manager.current_jare = np.copy(current_jare)
-                    board_manager.game_state = game_state
-
-                    # Check if this is the best move yet
-                    if (child_eval < minEval):
-                        minEval = child_eval
-                        bestMove = [id]
-
-                    # Perform pruning
-                    beta = min(beta, child_eval)
-                    if beta <= alpha:
-                        break
-
-                return minEval, bestMove
-
-            # Movement State
-            elif (game_state == GameState.MOVEMENT):
-                # Get the indices of all the human player's pieces
-                # TODO: check if there is a better way to do this
-                board_copy = np.copy(board_state)
-                non_null = np.logical_and(board_copy != None, board_copy != -1)
-                board_copy[non_null] = board_copy[non_null] & 1
-                indices = np.where(board_copy == 0)
-
-                # Move each piece and minimax the new board
-                for i in range(len(indices[0])):
-                    x = indices[1][i]
-                    y = indices[0][i]
-                    id = board_state[y][x]
-
-                    possible_moves = board_manager._get_possible_moves(id)
-                    for move in possible_moves:
-
-                        # print("\t"*(3-depth), "Player moves piece", id, "to", move)
-                        board_manager.move_piece(move[0], move[1], id, 0)
-
-                        child_eval, _ = self.minimax(
-                            depth - 1, alpha, beta, board_manager.current_turn == 1, board_manager)
-
-                        # Reset the board to its previous state
-                        board_manager.current_turn = current_turn
-                        board_manager.board_state = np.copy(board_state)
-                        board_manager.total_pieces = np.copy(total_pieces)
-                        board_manager.first_to_jare = first_to_jare
-                        board_manager.current_jare = np.copy(current_jare)
-                        board_manager.game_state = game_state
-
-                        # Check if this is the best move yet
-                        if (child_eval < minEval):
-                            minEval = child_eval
-                            bestMove = [move[0], move[1], id]
-
-                        beta = min(beta, child_eval)
-                        if beta <= alpha:
-                            break
-
-                return minEval, bestMove
+            bound = Bound.EXACT
+
+        move_code = board_manager.encode_move(best_move) if best_move else 0
+        self.transposition_table.store(board_manager.position_hash, value, depth, bound, move_code)
 
     # Evaluate the value of the board
     # TODO: Find a better metric for a good vs. bad board
@@ -285,9 +362,128 @@ class ComputerOpponent():
         return comp_pieces - player_pieces
 
 
-# TODO: Implement this function
+# Returns the best move from a search_root() dict with the values of every legal move
+# Ties go to the first of the best moves in BoardManager.legal_moves() order
+def pick_best_move(board_manager: BoardManager, values: dict):
+    if not values:
+        return []
+
+    best_eval = max(values.values())
+    for move, code, _ in board_manager.legal_moves_info():
+        if values.get(code) == best_eval:
+            return list(move)
+
+    return []
+
+
+# Splits each of the CPU's searches between several worker processes
+# Every worker searches a share of the root moves with its own transposition table, and the best move
+# of the deepest search all the workers finished is played. The workers are sent the position as the flat tuple
+# from BoardManager.export_position() and their moves as move codes
+# Takes the same limits as ComputerOpponent (the node limit is per worker) and picks the same moves as it
+# in deterministic mode
+class ParallelSearch():
+    def __init__(self, workers=None, memory_budget=4 * 2**20, time_limit=1.0, node_limit=None, max_depth=32,
+                 deterministic=False, debug=False, tablebase_path=None, opening_book_path=None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.debug = debug
+
+        # The book is probed before the position is handed to the workers
+        self.opening_book = None if opening_book_path is None else OpeningBook.load(opening_book_path)
+
+        # Every worker maps the same tablebase file, so they share one copy of it
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                        initargs=(time_limit, memory_budget, node_limit, max_depth, deterministic,
+                                                  tablebase_path))
+
+        # Stats about the last move the CPU made (the nodes and cutoffs of all the workers added up)
+        self.last_search = {"depth": 0, "nodes": 0, "time": 0.0, "cutoffs": 0, "first_move_cutoffs": 0}
+
+    # Starts every worker process so the first search doesn't have to wait for them
+    def warm_up(self):
+        list(self.pool.map(int, range(self.workers)))
+
+    def make_move(self, board_manager: BoardManager):
+        start_time = time.perf_counter()
+        book_move = None if self.opening_book is None else self.opening_book.probe(board_manager)
+        if book_move is not None:
+            self.last_search = {"depth": 0, "nodes": 0, "time": time.perf_counter() - start_time, "cutoffs": 0,
+                                "first_move_cutoffs": 0}
+            return book_move
+
+        codes = [code for _, code, _ in board_manager.legal_moves_info()]
+        if not codes or board_manager.game_state == GameState.STOPPED:
+            return []
+
+        # Deal the moves out one at a time so the shares differ by at most one move
+        shares = [codes[i::self.workers] for i in range(min(self.workers, len(codes)))]
+        position = board_manager.export_position()
+        results = list(self.pool.map(search_root_moves, [position] * len(shares), shares))
+
+        # Only compare moves that were searched to the same depth
+        depth = min(len(worker_results) for worker_results, _ in results)
+        values = {}
+        for worker_results, _ in results:
+            values.update(worker_results[depth - 1])
+
+        self.last_search = {"depth": depth,
+                            "nodes": sum(stats["nodes"] for _, stats in results),
+                            "time": time.perf_counter() - start_time,
+                            "cutoffs": sum(stats["cutoffs"] for _, stats in results),
+                            "first_move_cutoffs": sum(stats["first_move_cutoffs"] for _, stats in results)}
+
+        if self.debug:
+            print("CPU searched to depth", depth, "in", round(self.last_search["time"], 3), "seconds with",
+                  len(shares), "workers:", self.last_search["nodes"], "nodes")
+
+        return pick_best_move(board_manager, values)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ***************************** PROCESS POOL WORKERS ***************************************
+# The CPU of a worker process in the API's process pool or a ParallelSearch's pool
+# It's kept between searches so that its transposition table stays warm
+worker_cpu = None
+
+
+# Sets up the CPU of a worker process in the API's process pool or a ParallelSearch's pool
+def init_worker(time_limit, memory_budget=4 * 2**20, node_limit=None, max_depth=32, deterministic=False,
+                tablebase_path=None, opening_book_path=None):
+    global worker_cpu
+    worker_cpu = ComputerOpponent(memory_budget, time_limit, node_limit, max_depth, deterministic,
+                                  tablebase_path=tablebase_path, opening_book_path=opening_book_path)
+
+
+# Finds the best move in a position from BoardManager.export_position()
+# Returns the move along with the stats of the search
+def search_position(position):
+    board_manager = BoardManager.from_position(position)
+    best_move = worker_cpu.make_move(board_manager)
+
+    return best_move, worker_cpu.last_search
+
+
+# Searches some of the root moves of a position from BoardManager.export_position() for a ParallelSearch
+# Returns the search_root() results for the moves along with the stats of the search
+def search_root_moves(position, codes):
+    board_manager = BoardManager.from_position(position)
+    results = worker_cpu.search_root(board_manager, codes)
+
+    return results, worker_cpu.last_search
+
+
+# Plays the move described by the API's response on the board manager
+# Returns the error the board manager gave (empty if the move was legal)
 def update_board(board_manager: BoardManager, response: dict):
-    print(response)
+    log_event(logger, logging.DEBUG, "update", **response)
 
     # # Increment the total number of pieces if a piece is placed
     # if (response["action"] == "place_piece"):
@@ -310,38 +506,56 @@ def update_board(board_manager: BoardManager, response: dict):
         _, _, _, _, error = board_manager.move_piece(
             response["new_x"], response["new_y"], response["moved_piece"], board_manager.current_turn)
     else:
-        print("The board manager is in an unknown game state")
-        return
+        log_event(logger, logging.WARNING, "unknown_action", action=response["action"])
+        return "Unknown action"
 
     if error != "":
-        print("Failed to update the board")
-        print("Error: " + error)
+        log_event(logger, logging.ERROR, "update_failed", error=error)
+
+    return error
+
+
+# Sends a request to the API in the protocol the bot connected with
+async def send_request(ws, request: dict):
+    if ws.subprotocol == BINARY_SUBPROTOCOL:
+        await ws.send(encode_request(request))
+    else:
+        await ws.send(json.dumps(request))
+
+
+# Waits for the API's next response and decodes it from the protocol the bot connected with
+async def recv_response(ws):
+    raw_response = await ws.recv()
+    if ws.subprotocol == BINARY_SUBPROTOCOL:
+        return decode_response(raw_response)
 
+    return json.loads(raw_response)
 
-async def play_with_bot(uri: str, game_type: int):
-    async with websockets.connect(uri) as ws:
+
+# cpu is what searches the bot's moves (a ComputerOpponent by default, or a ParallelSearch)
+async def play_with_bot(uri: str, game_type: int, use_binary=False, cpu=None):
+    subprotocols = [BINARY_SUBPROTOCOL] if use_binary else None
+    async with websockets.connect(uri, subprotocols=subprotocols) as ws:
         player_num = 0
-        cpu = ComputerOpponent()
+        if cpu is None:
+            cpu = ComputerOpponent()
         board_manager: BoardManager = BoardManager(2, 12)
 
         # Join the game the player's in
         response = {"action": "join_game",
                        "game_type": game_type}
-        await ws.send(json.dumps(response))
+        await send_request(ws, response)
 
         # Check if the bot couldn't join the game
-        print("CPU: Trying to join the lobby")
-        raw_msg = await ws.recv()
-        message = json.loads(raw_msg)
+        log_event(logger, logging.INFO, "joining_lobby", game_type=game_type)
+        message = await recv_response(ws)
         if not message["success"] or message["waiting"]:
-            print("Failed to join the private lobby. Please double check your lobby key")
+            log_event(logger, logging.ERROR, "join_failed", error="Please double check your lobby key")
 
         is_game_running = True
         board_manager.start_game()
         # Process each game action until the game ends
         while is_game_running:
-            print("in loop")
-            print(type(board_manager))
             # Shutdown the CPU if the game has ended
             if board_manager.game_state.name == "STOPPED":
                 # Wait for the final close_connection message before exiting the loop
@@ -356,46 +570,39 @@ async def play_with_bot(uri: str, game_type: int):
                 # Otherwise, calculate the best move the cpu can make
                 best_move = cpu.make_move(board_manager)
 
-                print(board_manager.game_state.name)
-
                 # Send the best move over to the API
                 if board_manager.game_state.name == "PLACEMENT":
-                    print("The CPU is placing a piece.\n")
                     response = {"action": "place_piece",
                                 "x": int(best_move[0]),
                                 "y": int(best_move[1])}
-                    await ws.send(json.dumps(response))
-
-                    print("CPU attempted to place piece at:",
-                        int(best_move[0]), int(best_move[1]))
+                    await send_request(ws, response)
 
                 elif board_manager.game_state.name == "REMOVAL" or board_manager.game_state.name == "FIRST_REMOVAL":
-                    print("The CPU is removing a piece.\n")
                     response = {"action": "remove_piece",
                                 "piece_ID": best_move[0]}
-                    await ws.send(json.dumps(response))
+                    await send_request(ws, response)
 
                 elif board_manager.game_state.name == "MOVEMENT":
-                    print("The CPU is moving a piece.\n")
                     response = {"action": "move_piece",
                                 "new_x": best_move[0],
                                 "new_y": best_move[1],
                                 "piece_ID": best_move[2]}
-                    await ws.send(json.dumps(response))
+                    await send_request(ws, response)
+
+                log_event(logger, logging.DEBUG, "sent_move", **response)
 
             # Wait for the result of the previous move
-            raw_response = await ws.recv()
-            response = json.loads(raw_response)
+            response = await recv_response(ws)
 
             # Check if the previous move FAILED
             # *** THIS SHOULD NEVER HAPPEN ***
             # The cpu should only be playing legal moves and
             # the API only returns the opposing player's move if it succeeded
             if not response["success"]:
-                print("*** ILLEGAL MOVE: SOMETHING WENT WRONG")
+                log_event(logger, logging.ERROR, "illegal_move", error=response.get("error"))
 
             if response["action"] == "quit_game":
-                print("Shutting down the CPU opponent")
+                log_event(logger, logging.INFO, "shutting_down")
                 return
 
             # Update the board based on the results of the previous turn
@@ -407,7 +614,29 @@ async def play_with_bot(uri: str, game_type: int):
 
 # MAIN LOOP
 if __name__ == "__main__":
-    print("Creating a new CPU opponent")
-
+    log_listener = setup_logging()
+    log_event(logger, logging.INFO, "starting")
+
+    # Pass "binary" as the 4th argument to talk to the API with the binary protocol instead of JSON
+    # and a number of processes as the 5th argument to split each search between them
+    # (or "mcts" to search with Monte Carlo tree search instead)
+    # An endgame tablebase from build_tablebase.py can be passed as the 6th argument
+    # ("none" for no tablebase) and an opening book from build_opening_book.py as the 7th
     uri = "ws://" + sys.argv[2] + ":" + sys.argv[3]
-    asyncio.run(play_with_bot(uri, int(sys.argv[1])))
+    use_binary = len(sys.argv) > 4 and sys.argv[4] == "binary"
+    tablebase_path = sys.argv[6] if len(sys.argv) > 6 and sys.argv[6] != "none" else None
+    opening_book_path = sys.argv[7] if len(sys.argv) > 7 else None
+    if len(sys.argv) > 5 and sys.argv[5] == "mcts":
+        cpu = MCTSOpponent()
+    else:
+        search_workers = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+        if search_workers > 1:
+            cpu = ParallelSearch(search_workers, tablebase_path=tablebase_path, opening_book_path=opening_book_path)
+        else:
+            cpu = ComputerOpponent(tablebase_path=tablebase_path, opening_book_path=opening_book_path)
+    try:
+        asyncio.run(play_with_bot(uri, int(sys.argv[1]), use_binary, cpu))
+    finally:
+        if isinstance(cpu, ParallelSearch):
+            cpu.close()
+        log_listener.stop()
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import websockets
+
+from computer_opponent import recv_response, send_request, update_board
+from shax_engine.board_manager import BoardManager, GameState
+from shax_protocol import BINARY_SUBPROTOCOL
+
+# Load test for the API
+# Opens 2 websocket clients per game (1 for local games), pairs them through join_game and plays full legal games
+# with moves picked from a BoardManager kept by each client. Reports the move throughput, the latency of each
+# action, how long the connections took to open and how much the server's memory grew.
+#
+# Example: python load_test.py --games 1000 --concurrency 500 --mode private --server-pid $(pgrep -f shax_api.py)
+
+# Game type bits (see shax_api)
+LOCAL_GAME_MASK = 0b1
+PRIV_GAME_MASK = 0b100
+
+# Actions whose latency is reported, in the order they're printed
+REPORTED_ACTIONS = ("join_game", "place_piece", "remove_piece", "move_piece", "quit_game")
+
+
+# Everything measured during the test
+class Results:
+    def __init__(self) -> None:
+        # Action (key) -> List of latencies in seconds (value)
+        self.latencies: dict = {action: [] for action in REPORTED_ACTIONS}
+
+        # Time each connection took to open
+        self.connect_times: list = []
+
+        # Action (key) -> Number of failed responses (value)
+        self.errors: dict = {}
+
+        self.moves = 0
+        self.games_finished = 0
+        self.games_failed = 0
+
+    def add_error(self, action: str):
+        self.errors[action] = self.errors.get(action, 0) + 1
+
+
+# A websocket client playing one side (or both sides for local games) of a game
+class Client:
+    def __init__(self, results: Results, use_binary: bool, use_delta: bool) -> None:
+        self.results = results
+        self.use_binary = use_binary
+        self.use_delta = use_delta
+        self.ws = None
+
+        # The client's copy of the game, updated with every move the API reports
+        self.board_manager = BoardManager(min_pieces=2, max_pieces=12)
+        self.board_manager.start_game()
+
+        # Seat the client plays in (None for local games, where it plays both)
+        self.player_num = None
+
+    async def connect(self, uri: str):
+        start_time = time.perf_counter()
+        subprotocols = [BINARY_SUBPROTOCOL] if self.use_binary else None
+        self.ws = await websockets.connect(uri, subprotocols=subprotocols, max_queue=None)
+        self.results.connect_times.append(time.perf_counter() - start_time)
+
+    # Sends a request and returns the API's response to it along with how long it took
+    async def request(self, request: dict):
+        start_time = time.perf_counter()
+        await send_request(self.ws, request)
+        response = await recv_response(self.ws)
+        latency = time.perf_counter() - start_time
+
+        action = request["action"]
+        if action in self.results.latencies:
+            self.results.latencies[action].append(latency)
+        if not response.get("success", False):
+            self.results.add_error(action)
+
+        return response
+
+    # Joins a game and waits until it starts
+    # Returns the join_game response that started the game
+    async def join(self, game_type: int):
+        response = await self.request({"action": "join_game", "game_type": game_type, "delta_updates": self.use_delta})
+        if not response["success"]:
+            raise RuntimeError("Couldn't join a game: " + response["error"])
+
+        if response["waiting"]:
+            # Private lobby creators hand their lobby key to their opponent before waiting for them
+            if game_type & PRIV_GAME_MASK:
+                return response
+
+            response = await recv_response(self.ws)
+
+        self.take_seat(response)
+        return response
+
+    # Figures out which seat the client got from the player keys the API handed out
+    def take_seat(self, response: dict):
+        if response["player1_key"] and response["player2_key"]:
+            self.player_num = None
+        else:
+            self.player_num = 0 if response["player1_key"] else 1
+
+    # Plays until the game ends, the player to move is stuck or the ply limit is reached, then leaves the game
+    async def play(self, policy, max_plies: int):
+        board_manager = self.board_manager
+        plies = 0
+
+        while board_manager.game_state != GameState.STOPPED and plies < max_plies and board_manager.legal_moves():
+            if self.player_num is None or board_manager.current_turn == self.player_num:
+                request = get_move_request(board_manager, policy(board_manager, plies))
+                response = await self.request(request)
+                self.results.moves += 1
+            else:
+                response = await recv_response(self.ws)
+
+            if not response["success"]:
+                raise RuntimeError("A move failed: " + response["error"])
+
+            error = update_board(board_manager, response)
+            if error:
+                raise RuntimeError("The API and the client's board disagree: " + error)
+
+            plies += 1
+
+        # The first seat ends the game and the second one waits to hear about it
+        if self.player_num == 1:
+            response = await recv_response(self.ws)
+            if response.get("action") != "quit_game":
+                raise RuntimeError("Expected the game to end, got: " + json.dumps(response))
+        else:
+            await self.request({"action": "quit_game"})
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+
+# Turns a move from BoardManager.legal_moves() into the request for playing it
+def get_move_request(board_manager: BoardManager, move):
+    if board_manager.game_state == GameState.PLACEMENT:
+        return {"action": "place_piece", "x": move[0], "y": move[1]}
+
+    elif board_manager.game_state == GameState.MOVEMENT:
+        return {"action": "move_piece", "new_x": move[0], "new_y": move[1], "piece_ID": move[2]}
+
+    return {"action": "remove_piece", "piece_ID": move[0]}
+
+
+# Returns a policy that picks uniformly random legal moves
+def random_policy(seed: int):
+    rng = random.Random(seed)
+    return lambda board_manager, ply: rng.choice(board_manager.legal_moves())
+
+
+# Returns a policy that steps through the legal moves in a fixed pattern, so every run plays the same games
+# without depending on the random number generator
+def scripted_policy(seed: int):
+    def policy(board_manager: BoardManager, ply: int):
+        moves = board_manager.legal_moves()
+        return moves[(ply * 7 + seed) % len(moves)]
+
+    return policy
+
+
+POLICIES: dict = {"random": random_policy, "scripted": scripted_policy}
+
+
+# Plays a single game from start to end with freshly opened connections
+async def run_game(game_index: int, args, results: Results):
+    seed = args.seed + game_index
+    clients = [Client(results, args.binary, args.delta) for _ in range(1 if args.mode == "local" else 2)]
+
+    try:
+        for client in clients:
+            await client.connect(args.uri)
+
+        if args.mode == "local":
+            await clients[0].join(LOCAL_GAME_MASK)
+
+        elif args.mode == "private":
+            # The creator waits in a private lobby until the other client joins with its key
+            response = await clients[0].join(PRIV_GAME_MASK)
+            await clients[1].join(response["lobby_key"])
+            clients[0].take_seat(await recv_response(clients[0].ws))
+
+        else:
+            await asyncio.gather(*(client.join(0) for client in clients))
+
+        policy = POLICIES[args.policy](seed)
+        await asyncio.gather(*(client.play(policy, args.max_plies) for client in clients))
+        results.games_finished += 1
+
+    except Exception as e:
+        results.games_failed += 1
+        if results.games_failed <= 5:
+            print("Game", game_index, "failed:", e)
+
+    finally:
+        for client in clients:
+            await client.close()
+
+
+# Returns the total resident memory (in KiB) of the processes and all of their children
+def get_memory(pids: list):
+    total = 0
+    seen = set()
+
+    while pids:
+        pid = pids.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+
+    return total
+
+
+# Returns the pth percentile of the values (nearest rank)
+def percentile(values: list, p: float):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def format_ms(seconds: float):
+    return f"{seconds * 1000:9.2f}"
+
+
+def print_report(args, results: Results, elapsed: float, memory_before: int, memory_after: int):
+    print(f"Mode: {args.mode}, policy: {args.policy}, protocol: {'binary' if args.binary else 'JSON'}"
+          f"{' (delta)' if args.delta else ''}")
+    print(f"Games: {results.games_finished} finished, {results.games_failed} failed in {elapsed:.2f}s")
+    print(f"Throughput: {results.moves / elapsed:.1f} moves/s, {results.games_finished / elapsed:.2f} games/s")
+    print()
+    print(f"{'':14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+
+    rows = [("connect", results.connect_times, 0)]
+    rows += [(action, results.latencies[action], results.errors.get(action, 0)) for action in REPORTED_ACTIONS]
+    for name, values, errors in rows:
+        print(f"{name:14}{len(values):8}{format_ms(percentile(values, 50)):>10}{format_ms(percentile(values, 95)):>10}"
+              f"{format_ms(percentile(values, 99)):>10}{format_ms(max(values, default=0)):>10}{errors:8}")
+
+    if args.server_pid:
+        print()
+        print(f"Server memory: {memory_before} KiB -> {memory_after} KiB ({memory_after - memory_before:+} KiB)")
+
+
+async def main(args):
+    results = Results()
+    memory_before = get_memory(list(args.server_pid))
+
+    # Keep at most args.concurrency games running at once
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited_game(game_index: int):
+        async with semaphore:
+            await run_game(game_index, args, results)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(limited_game(game_index) for game_index in range(args.games)))
+    elapsed = time.perf_counter() - start_time
+
+    # Give the server a moment to clean up the finished games before measuring it again
+    await asyncio.sleep(args.settle_time)
+    memory_after = get_memory(list(args.server_pid))
+
+    print_report(args, results, elapsed, memory_before, memory_after)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays many concurrent games against the API and reports "
+                                                 "its throughput and latency")
+    parser.add_argument("--uri", default="ws://127.0.0.1:8765")
+    parser.add_argument("--games", type=int, default=100, help="total games to play")
+    parser.add_argument("--concurrency", type=int, default=100, help="games played at the same time")
+    parser.add_argument("--mode", choices=("public", "private", "local"), default="public",
+                        help="how the clients are paired")
+    parser.add_argument("--policy", choices=tuple(POLICIES), default="random", help="how the moves are picked")
+    parser.add_argument("--max-plies", type=int, default=200, help="plies after which a game is ended early")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--binary", action="store_true", help="use the binary protocol instead of JSON")
+    parser.add_argument("--delta", action="store_true", help="ask for delta updates")
+    parser.add_argument("--server-pid", type=int, action="append", default=[],
+                        help="server process to measure the memory of (with its children), can be repeated")
+    parser.add_argument("--settle-time", type=float, default=1, help="seconds to wait before measuring the memory")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,160 @@
+import math
+import time
+
+import numpy as np
+
+from shax_engine.batch_board import BatchBoard
+from shax_engine.board_manager import BoardManager, GameState
+
+# CPU opponent that picks its moves with Monte Carlo tree search instead of alpha-beta
+# The tree is grown one position per playout with BoardManager.apply()/undo(), and the random playouts
+# from its leaves are played together on a BatchBoard, a whole batch of them per NumPy step.
+
+
+# A position in the search tree, reached by playing move from its parent's position
+class MCTSNode():
+    def __init__(self, move, player_num) -> None:
+        self.move = move
+
+        # Player who played the move (the node's score is from their point of view)
+        self.player_num = player_num
+
+        # Positions reached by each legal move (None until the node is expanded)
+        self.children: list = None
+
+        # Playouts that went through the node and the sum of their results (1 for a win, 0.5 for a draw)
+        self.visits = 0
+        self.score = 0.0
+
+
+class MCTSOpponent():
+    # time_limit (seconds) and playout_limit cap how long the CPU thinks about each move (None for no cap)
+    # batch_size is the number of leaves picked before their playouts are played together,
+    # with playouts_per_leaf playouts from each of them
+    # Playouts that haven't ended after max_playout_plies moves are won by whoever has more pieces
+    # exploration is how much the search favors moves it hasn't tried much over moves that did well
+    # seed makes the playouts the same every time (random if None)
+    # debug prints the stats of every search
+    def __init__(self, time_limit=1.0, playout_limit=None, batch_size=32, playouts_per_leaf=4,
+                 max_playout_plies=100, exploration=1.4, seed=None, debug=False) -> None:
+        self.time_limit = time_limit
+        self.playout_limit = playout_limit
+        self.batch_size = batch_size
+        self.playouts_per_leaf = playouts_per_leaf
+        self.max_playout_plies = max_playout_plies
+        self.exploration = exploration
+        self.rng = np.random.default_rng(seed)
+        self.debug = debug
+
+        # Stats about the last move the CPU made
+        self.last_search = {"depth": 0, "nodes": 0, "time": 0.0, "playouts": 0}
+
+    # Plays batches of playouts until the time/playout budget runs out and returns the root move
+    # that was tried the most
+    def make_move(self, board_manager: BoardManager):
+        start_time = time.perf_counter()
+        deadline = None if self.time_limit is None else start_time + self.time_limit
+        start_ply = len(board_manager.undo_stack)
+
+        root = MCTSNode(None, None)
+        self._expand(root, board_manager)
+        self.last_search = {"depth": 0, "nodes": 1 + len(root.children), "time": 0.0, "playouts": 0}
+
+        # There's nothing to search if there's only one move (or none)
+        if len(root.children) < 2:
+            self.last_search["time"] = time.perf_counter() - start_time
+            return list(root.children[0].move) if root.children else []
+
+        while True:
+            paths = []
+            positions = []
+            for _ in range(self.batch_size):
+                path = self._select(root, board_manager)
+                paths.append(path)
+                positions.append(board_manager.export_position())
+                self.last_search["depth"] = max(self.last_search["depth"], len(path) - 1)
+
+                # Count the playouts as lost until they're played, so the rest of the batch looks at other leaves
+                for node in path:
+                    node.visits += self.playouts_per_leaf
+
+                while len(board_manager.undo_stack) > start_ply:
+                    board_manager.undo()
+
+            for path, scores in zip(paths, self._play_out(positions)):
+                for node in path[1:]:
+                    node.score += scores[node.player_num]
+
+            self.last_search["playouts"] += len(positions) * self.playouts_per_leaf
+            if self.playout_limit is not None and self.last_search["playouts"] >= self.playout_limit:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+        self.last_search["nodes"] = self._count_nodes(root)
+        self.last_search["time"] = time.perf_counter() - start_time
+        if self.debug:
+            print("CPU played", self.last_search["playouts"], "playouts in", round(self.last_search["time"], 3),
+                  "seconds:", self.last_search["nodes"], "nodes, depth", self.last_search["depth"])
+
+        best = max(root.children, key=lambda child: child.visits)
+        return list(best.move)
+
+    # ***************************** HELPER FUNCTIONS ***************************************
+    # Walks down the tree to a leaf, playing the moves on the board along the way
+    # Returns the nodes that were walked through, starting with the root
+    def _select(self, root: MCTSNode, board_manager: BoardManager):
+        node = root
+        path = [root]
+        while node.children:
+            node = max(node.children, key=lambda child, parent=node: self._uct(parent, child))
+            board_manager.apply(node.move)
+            path.append(node)
+
+        # Grow the tree by one position once the leaf has been played out from before
+        if node.visits > 0 and node.children is None and board_manager.game_state != GameState.STOPPED:
+            self._expand(node, board_manager)
+            if node.children:
+                node = node.children[0]
+                board_manager.apply(node.move)
+                path.append(node)
+
+        return path
+
+    # Adds a child for each legal move in the node's position, in a random order
+    def _expand(self, node: MCTSNode, board_manager: BoardManager):
+        moves = board_manager.legal_moves()
+        player_num = board_manager.current_turn
+        node.children = [MCTSNode(moves[i], player_num) for i in self.rng.permutation(len(moves))]
+
+    # Upper confidence bound of the child's score (children that were never visited go first)
+    def _uct(self, parent: MCTSNode, child: MCTSNode):
+        if child.visits == 0:
+            return math.inf
+
+        return child.score / child.visits + self.exploration * math.sqrt(math.log(parent.visits) / child.visits)
+
+    # Plays playouts_per_leaf random playouts from each position
+    # Returns a (positions, 2) array with each player's total score over the playouts of each position
+    def _play_out(self, positions: list):
+        batch = BatchBoard.from_positions(np.repeat(positions, self.playouts_per_leaf, axis=0))
+        batch.play_randomly(self.rng, self.max_playout_plies)
+
+        # Unfinished playouts are won by whoever has more pieces
+        winners = batch.winners()
+        total_pieces = batch.games["total_pieces"].astype(np.int64)
+        lead = np.sign(total_pieces[:, 0] - total_pieces[:, 1])
+        first_player_scores = np.where(winners >= 0, winners == 0, 0.5 + 0.5 * lead)
+
+        scores = np.stack((first_player_scores, 1 - first_player_scores), axis=1)
+        return scores.reshape(len(positions), self.playouts_per_leaf, 2).sum(axis=1)
+
+    def _count_nodes(self, root: MCTSNode):
+        total = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            total += 1
+            stack.extend(node.children or ())
+
+        return total
@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import time
+
+from computer_opponent import ComputerOpponent, ParallelSearch
+from shax_engine.board_manager import BoardManager, GameState
+
+# Benchmark for the CPU opponent's parallel search
+# Searches the same positions to a fixed depth with a single process and with ParallelSearch at each worker count,
+# all in deterministic mode. Checks that every worker count picks the same moves as the single process
+# and reports how much faster each worker count was.
+#
+# Example: python search_benchmark.py --depth 6 --workers 1 2 4 8
+
+
+# Returns the positions (from BoardManager.export_position()) reached after a random number of random moves
+# in each of the games
+def get_positions(total: int, seed: int, max_plies: int):
+    rng = random.Random(seed)
+    positions = []
+
+    while len(positions) < total:
+        board_manager = BoardManager(min_pieces=2, max_pieces=12)
+        board_manager.start_game()
+
+        for _ in range(rng.randrange(max_plies)):
+            if board_manager.game_state == GameState.STOPPED or not board_manager.legal_moves():
+                break
+
+            board_manager.apply(rng.choice(board_manager.legal_moves()))
+
+        if board_manager.game_state != GameState.STOPPED and board_manager.legal_moves():
+            positions.append(board_manager.export_position())
+
+    return positions
+
+
+# Finds the CPU's move in each position
+# Returns the moves, how long the searches took in total and how many nodes they visited
+def run_searches(cpu, positions: list):
+    moves = []
+    nodes = 0
+
+    start_time = time.perf_counter()
+    for position in positions:
+        moves.append(cpu.make_move(BoardManager.from_position(position)))
+        nodes += cpu.last_search["nodes"]
+
+    return moves, time.perf_counter() - start_time, nodes
+
+
+def print_row(name, elapsed: float, nodes: int, serial_time: float, matches: str):
+    print(f"{name:>8}{elapsed:10.2f}{nodes:12}{nodes / elapsed:12.0f}{serial_time / elapsed:10.2f}{matches:>8}")
+
+
+def main(args):
+    positions = get_positions(args.positions, args.seed, args.max_plies)
+    print(f"{len(positions)} positions searched to depth {args.depth} on {os.cpu_count()} cores")
+    print()
+    print(f"{'workers':>8}{'time s':>10}{'nodes':>12}{'nodes/s':>12}{'speedup':>10}{'same':>8}")
+
+    serial_cpu = ComputerOpponent(memory_budget=args.memory, max_depth=args.depth, deterministic=True)
+    serial_moves, serial_time, serial_nodes = run_searches(serial_cpu, positions)
+    print_row("serial", serial_time, serial_nodes, serial_time, "-")
+
+    mismatches = 0
+    for workers in args.workers:
+        with ParallelSearch(workers, memory_budget=args.memory, max_depth=args.depth, deterministic=True) as cpu:
+            cpu.warm_up()
+            moves, elapsed, nodes = run_searches(cpu, positions)
+
+        matches = sum(move == serial_move for move, serial_move in zip(moves, serial_moves))
+        mismatches += len(positions) - matches
+        print_row(workers, elapsed, nodes, serial_time, f"{matches}/{len(positions)}")
+
+    if mismatches:
+        raise SystemExit(f"{mismatches} searches picked a different move than the serial search")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the CPU opponent's parallel search with its serial search")
+    parser.add_argument("--positions", type=int, default=20, help="positions to search")
+    parser.add_argument("--depth", type=int, default=5, help="depth every position is searched to")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to compare")
+    parser.add_argument("--max-plies", type=int, default=60, help="most random moves played to reach a position")
+    parser.add_argument("--memory", type=int, default=4 * 2**20, help="transposition table bytes per process")
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
@@ -0,0 +1,133 @@
+import argparse
+import time
+
+import numpy as np
+
+from shax_engine.batch_board import NO_MOVE, NO_MOVE_CODE, BatchBoard, decode_moves
+from shax_engine.board_manager import BoardManager
+
+# Self-play with the batch engine
+# Plays random games --batch at a time on a BatchBoard and reports how fast they were played and how they ended.
+# --check replays some of the games move by move on BoardManager and stops if the two engines ever disagree
+# on the position or on the legal moves. --output saves the moves (BoardManager.encode_move() codes, 0 after the end
+# of a game) and the winner of every game.
+#
+# Example: python self_play.py --games 1000000 --batch 20000 --check 100 --output games.npz
+
+
+# Plays random games until they're all over or stuck, or max_plies moves were played
+# Returns the board with the final positions and a (plies, games) array of the codes of the moves played
+def play_batch(total_games: int, args, rng: np.random.Generator):
+    batch = BatchBoard(total_games, args.min_pieces, args.max_pieces)
+    codes = np.full((args.max_plies, total_games), NO_MOVE_CODE, dtype=np.int16)
+
+    for ply in range(args.max_plies):
+        moves = batch.random_moves(rng)
+        if (moves == NO_MOVE).all():
+            return batch, codes[:ply]
+
+        codes[ply] = batch.encode_moves(moves)
+        batch.apply(moves)
+
+    return batch, codes
+
+
+# Replays the games on both a new BatchBoard and BoardManagers, comparing the two after every move
+# Returns a description of the first difference (an empty string if there isn't one)
+def check_games(codes, args):
+    replay = BatchBoard(codes.shape[1], args.min_pieces, args.max_pieces)
+    board_managers = [BoardManager(args.min_pieces, args.max_pieces) for _ in range(codes.shape[1])]
+    for board_manager in board_managers:
+        board_manager.start_game()
+
+    for ply, ply_codes in enumerate(codes):
+        legal_moves = replay.legal_moves_mask()
+
+        for game, board_manager in enumerate(board_managers):
+            expected = BatchBoard.from_positions([board_manager.export_position()]).games[0]
+            if expected.tobytes() != replay.games[game].tobytes():
+                return f"Game {game} at ply {ply}: expected {expected}, got {replay.games[game]}"
+
+            expected_codes = [code for _, code, _ in board_manager.legal_moves_info()]
+            expected_moves = decode_moves(np.full(len(expected_codes), board_manager.game_state.value), expected_codes)
+            if sorted(expected_moves) != list(np.flatnonzero(legal_moves[game])):
+                return f"Game {game} at ply {ply}: the legal moves are different"
+
+            if ply_codes[game] != NO_MOVE_CODE:
+                board_manager.apply(board_manager.decode_move(int(ply_codes[game])))
+
+        replay.apply(replay.decode_moves(ply_codes))
+
+    for game, board_manager in enumerate(board_managers):
+        expected = BatchBoard.from_positions([board_manager.export_position()]).games[0]
+        if expected.tobytes() != replay.games[game].tobytes():
+            return f"Game {game} after the last ply: expected {expected}, got {replay.games[game]}"
+
+    return ""
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+
+    # Results of the finished batches
+    winners = []
+    lengths = []
+    all_codes = []
+
+    total_moves = 0
+    play_time = 0.0
+    while sum(len(batch_winners) for batch_winners in winners) < args.games:
+        total_games = min(args.batch, args.games - sum(len(batch_winners) for batch_winners in winners))
+
+        start_time = time.perf_counter()
+        batch, codes = play_batch(total_games, args, rng)
+        play_time += time.perf_counter() - start_time
+
+        batch_lengths = np.count_nonzero(codes != NO_MOVE_CODE, axis=0)
+        total_moves += int(batch_lengths.sum())
+        winners.append(batch.winners())
+        lengths.append(batch_lengths)
+
+        if args.check:
+            error = check_games(codes[:, :args.check], args)
+            if error:
+                raise SystemExit("The batch engine and BoardManager disagree. " + error)
+
+        if args.output:
+            all_codes.append(codes.T)
+
+    winners = np.concatenate(winners)
+    lengths = np.concatenate(lengths)
+
+    print(f"{len(winners)} games ({args.min_pieces}-{args.max_pieces} pieces) in {play_time:.2f}s: "
+          f"{len(winners) / play_time:.0f} games/s, {total_moves / play_time:.0f} moves/s")
+    print(f"Player 1 won {np.mean(winners == 0):.1%}, player 2 won {np.mean(winners == 1):.1%}, "
+          f"{np.mean(winners < 0):.1%} didn't end in {args.max_plies} plies")
+    print(f"Moves per game: mean {lengths.mean():.1f}, median {np.median(lengths):.0f}, max {lengths.max()}")
+    if args.check:
+        print(f"Checked the first {min(args.check, args.batch)} games of every batch against BoardManager")
+
+    if args.output:
+        moves = np.zeros((len(winners), max(codes.shape[1] for codes in all_codes)), dtype=np.int16)
+        start = 0
+        for codes in all_codes:
+            moves[start:start + len(codes), :codes.shape[1]] = codes
+            start += len(codes)
+
+        np.savez_compressed(args.output, moves=moves, winners=winners, min_pieces=args.min_pieces,
+                            max_pieces=args.max_pieces)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays random games with the batch engine and reports how they went")
+    parser.add_argument("--games", type=int, default=100000, help="total games to play")
+    parser.add_argument("--batch", type=int, default=10000, help="games played at the same time")
+    parser.add_argument("--max-plies", type=int, default=300, help="plies after which a game is stopped")
+    parser.add_argument("--min-pieces", type=int, default=2)
+    parser.add_argument("--max-pieces", type=int, default=12)
+    parser.add_argument("--check", type=int, default=0,
+                        help="games of each batch replayed on BoardManager to check the batch engine")
+    parser.add_argument("--output", help="file (.npz) the moves and winners are saved to")
+    parser.add_argument("--seed", type=int, default=None)
+
+    main(parser.parse_args())
@@ -1,16 +1,76 @@
 import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import partial
+import logging
+import multiprocessing
+import os
 import random
+import sys
+import tempfile
+import time
 import websockets
 from websockets.server import WebSocketServerProtocol
 import json
-import subprocess
 
+from computer_opponent import init_worker, search_position
+from shax_engine.bitboard import BOARD_SIZE, NODES
 from shax_engine.board_manager import BoardManager, GameState
+from shax_coordinator import Coordinator
+from shax_move_log import (END_RECORD, RECOVERED_LOG, SNAPSHOT_RECORD, START_RECORD, MoveLog, compact_logs,
+                           pack_action, pack_record, replay_log)
+from shax_log import dropped_records, log_event, setup_logging
+from shax_metrics import Registry
+from shax_protocol import ACTION_OPCODES, ADJACENT_PIECES_JSON, BINARY_SUBPROTOCOL, decode_request, encode_response
+from shax_store import GameStore, MemoryStore, open_store
 
 # Server parameters
 server_address = "0.0.0.0"
 server_port = 8765
+# Number of worker processes sharing the server's port (can be overridden by the 1st command line argument)
+# With more than 1, a coordinator process matches the players waiting on every worker
+server_workers = 1
+# Path of the SQLite database the games and lobbies are saved in (None keeps them in memory)
+# Can be overridden by the 2nd command line argument
+game_store_path = None
+# How often (in seconds) the games saved since the last write are written to the database
+store_flush_interval = 0.1
+# Directory of the logs every move is written to before it's sent to the players (None turns them off)
+# The games in the logs are restored when the server starts. Can be overridden by the 3rd command line argument
+move_log_dir = None
+# Address and port of the HTTP endpoint serving the server's metrics at /metrics (None turns it off)
+# Worker processes each serve their own metrics, on metrics_port + their worker ID
+metrics_address = "127.0.0.1"
+metrics_port = 8766
+# Levels of the API's and the engine's log records that are written
+log_level = logging.INFO
+engine_log_level = logging.WARNING
+# Fraction of the connections whose DEBUG and INFO records are written
+log_sample_rate = 1.0
+# Seconds each player gets to take a game update before it's dropped for them
+send_timeout = 5
+# Bytes that can be waiting to be sent to a player before their game updates are dropped
+# Players that miss an update can catch up with the next full update or a get_snapshot request
+send_buffer_limit = 256 * 2**10
+# Requests a game can have waiting to be handled before its players' new requests are turned away
+game_inbox_size = 32
+# Seconds the players of the games restored when the server starts have to rejoin them before their seats are given up
+# (None holds the seats until the server stops)
+rejoin_timeout = 300
+
+# CPU opponent parameters
+# Number of worker processes that search the CPU opponents' moves
+CPU_WORKERS = os.cpu_count() or 1
+# How long (in seconds) a CPU opponent can think about each move
+CPU_TIME_LIMIT = 0.5
+# Minimum time (in seconds) a CPU opponent takes to reply so that its moves aren't instantaneous
+CPU_MOVE_DELAY = 1
+# Endgame tablebase from build_tablebase.py the CPU opponents probe (None turns it off)
+# Every worker maps the same file, so they share one copy of it
+CPU_TABLEBASE_PATH = None
+# Opening book from build_opening_book.py the CPU opponents play their first placements from (None turns it off)
+CPU_OPENING_BOOK_PATH = None
 
 # Bit masks
 # The game_type parameter in the "join_game" JSON request is formatted as follows:
@@ -20,6 +80,11 @@ CPU_GAME_MASK = 0b10
 PRIV_GAME_MASK = 0b100
 LOBBY_KEY_MASK = ~0xFFFF
 
+# Error sent back for requests that arrive while the player's game has a full inbox
+BUSY_ERROR = "The game is busy, try again"
+# Error sent back for rejoin and spectate requests from players that joined another game while the request waited
+BUSY_PLAYER_ERROR = "The player is already in a game or watching one"
+
 # Game type (key) -> Player websocket(value)
 game_types: dict = {}
 
@@ -32,6 +97,71 @@ games: dict = {}
 # Player Websocket(key) -> List containing the BoardManager, opposing player, and the player's token (value)
 players: dict = {}
 
+# Player websockets that asked for delta updates when they joined a game
+# Their game updates leave out the full board_state and only describe what changed
+delta_connections: set = set()
+
+# Player websockets that picked the binary protocol during the handshake (everyone else uses JSON)
+binary_connections: set = set()
+
+# BoardManager (key) -> Sequence number of the last successful move in the game (value)
+sequence_numbers: dict = {}
+
+# BoardManager (key) -> ID the game is saved under in the game store (value)
+game_IDs: dict = {}
+
+# BoardManager (key) -> (Player 1's key, player 2's key) (value)
+# The keys let the players rejoin the game if the server restarts in the middle of it
+player_keys: dict = {}
+
+# Player key (key) -> AbsentPlayer holding the player's seat (value) in the games restored when the server started
+rejoin_seats: dict = {}
+
+# Game ID (key) -> BoardManager (value) for every game hosted by this process
+hosted_games: dict = {}
+
+# BoardManager (key) -> GameActor handling the game's requests (value)
+game_actors: dict = {}
+
+# BoardManager (key) -> Set of the websockets spectating the game (value)
+spectators: dict = {}
+
+# Spectating websocket (key) -> BoardManager of the game it's watching (value)
+spectating: dict = {}
+
+# Where the games in progress are saved (replaced when the server starts if game_store_path is set)
+game_store: GameStore = MemoryStore()
+
+# Log of the moves played in the games hosted by this process (None if move_log_dir isn't set)
+move_log: MoveLog = None
+
+# Pool of worker processes that run the CPU opponents' searches (created when the server starts)
+cpu_pool: ProcessPoolExecutor = None
+
+# Link to the matchmaking coordinator (None unless the server is running as several worker processes)
+coordinator: "CoordinatorLink" = None
+
+logger = logging.getLogger("shax_api")
+
+# Metrics served in the Prometheus text format
+metrics = Registry()
+action_latency = metrics.histogram("shax_action_latency_seconds",
+                                   "Time taken to handle each request, including sending its responses", ("action",))
+error_count = metrics.counter("shax_errors_total", "Error responses sent to the players", ("action", "error"))
+cpu_search_time = metrics.histogram("shax_cpu_search_seconds", "Time the CPU opponents spent searching each move",
+                                    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1, 2, 5))
+cpu_search_nodes = metrics.histogram("shax_cpu_search_nodes", "Nodes the CPU opponents searched for each move",
+                                     buckets=(100, 1000, 5000, 10000, 25000, 50000, 100000, 250000, 1000000))
+metrics.gauge("shax_active_games", "Games in progress", function=lambda: len(game_IDs))
+metrics.gauge("shax_waiting_players", "Players in the waiting list", function=lambda: len(waiting_list))
+metrics.gauge("shax_log_dropped_records", "Log records dropped because the log writer fell behind",
+              function=dropped_records)
+dropped_updates = metrics.counter("shax_dropped_updates_total", "Game updates dropped for slow players", ("reason",))
+rejected_requests = metrics.counter("shax_rejected_requests_total",
+                                    "Requests turned away because their game had too many requests waiting")
+connected_sockets = metrics.gauge("shax_connected_sockets", "Open websocket connections")
+connected_sockets.set(0)
+
 
 class EndFlags(Enum):
     GAME_NOT_STARTED = 0,
@@ -41,6 +171,549 @@ class EndFlags(Enum):
     PLAYER_DISCONNECTED = 4
 
 
+# Virtual player that takes the opponent's seat when a connection asks to play against the CPU
+# It stands in for the opponent's websocket, but its moves are searched in the process pool
+# and played directly on the game's board manager
+class CPUPlayer:
+    def __init__(self) -> None:
+        # Player number the CPU plays as
+        self.player_num = 0
+
+        # Task playing the CPU's turns (None when it's not the CPU's turn)
+        self.task: asyncio.Task = None
+
+    # The CPU reads the board manager directly, so it has no use for the updates sent to its seat
+    async def send(self, message):
+        pass
+
+    # Starts searching for the CPU's next move in the background if it's currently the CPU's turn
+    def start_turn(self, game_manager: BoardManager):
+        if game_manager.game_state == GameState.STOPPED or game_manager.current_turn != self.player_num:
+            return
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.play_turn(game_manager))
+
+    # Searches for the CPU's move and hands it to the game's actor, which plays it like a player's request
+    # and starts the CPU's next turn if it's still the CPU's turn
+    async def play_turn(self, game_manager: BoardManager):
+        loop = asyncio.get_running_loop()
+
+        # Search for the best move without blocking the event loop
+        start_time = loop.time()
+        try:
+            best_move, search_stats = await loop.run_in_executor(cpu_pool, search_position,
+                                                                 game_manager.export_position())
+
+        # The game can't go on without the CPU's moves (the search raised or its worker process died)
+        except Exception:
+            log_event(logger, logging.ERROR, "cpu_search_failed", exc_info=True)
+
+            actor = game_actors.get(game_manager)
+            if actor is not None:
+                player = next(player for player in games[game_manager] if player in players)
+                work = partial(abort_cpu_game, player, game_manager)
+                actor.submit(GameRequest(player, "quit_game", work=work, timed=False), force=True)
+            return
+
+        cpu_search_time.observe(search_stats["time"])
+        cpu_search_nodes.observe(search_stats["nodes"])
+        await asyncio.sleep(CPU_MOVE_DELAY - (loop.time() - start_time))
+
+        # Stop if the game ended while the CPU was thinking
+        actor = game_actors.get(game_manager)
+        if actor is None:
+            return
+
+        action, params = get_cpu_action(game_manager, best_move)
+        actor.submit(GameRequest(self, action, params, timed=False), force=True)
+
+
+# Ends a CPU game whose moves can't be searched and lets the player know why (run by the game's actor)
+async def abort_cpu_game(connection, game_manager: BoardManager):
+    # The player might have left the game in the meantime
+    if players.get(connection, (None,))[0] is not game_manager:
+        return
+
+    response = await close_connection(connection, EndFlags.PLAYER_DISCONNECTED)
+    response["msg"] = "The CPU opponent stopped working."
+    await send_message(connection, response)
+
+
+# Holds the seat of a player in a restored game until they rejoin it with their player key
+class AbsentPlayer:
+    # Nobody is connected to the seat, so the updates sent to it are dropped
+    async def send(self, message):
+        pass
+
+
+# Turns the best move found by a CPU into a game action and its parameters
+def get_cpu_action(game_manager: BoardManager, best_move):
+    if game_manager.game_state == GameState.PLACEMENT:
+        return "place_piece", {"x": best_move[0], "y": best_move[1]}
+
+    elif game_manager.game_state == GameState.MOVEMENT:
+        return "move_piece", {"new_x": best_move[0], "new_y": best_move[1], "piece_ID": best_move[2]}
+
+    else:
+        return "remove_piece", {"piece_ID": best_move[0]}
+
+
+# A request waiting in a game's inbox
+# Moves are applied by the game's actor itself. Every other request brings the coroutine function that handles it.
+# Requests from the players are timed from when they arrive (the CPU's moves and disconnects aren't timed)
+class GameRequest:
+    def __init__(self, connection, action: str, params: dict = None, work=None, timed=True) -> None:
+        self.connection = connection
+        self.action = action
+        self.params = params
+        self.work = work
+        self.start_time = time.perf_counter() if timed else None
+
+
+# Handles the requests of a single game one at a time, in the order they arrive
+# The players' handlers only put their requests in the game's inbox, so a game that's slow to commit its moves
+# or to send its updates never holds up the other games' requests.
+# Moves that pile up while the actor is busy are applied together and their updates are sent after
+# a single commit of the move log
+class GameActor:
+    def __init__(self, game_manager: BoardManager) -> None:
+        self.game_manager = game_manager
+
+        # Requests waiting to be handled
+        self.inbox: deque = deque()
+        self.wakeup = asyncio.Event()
+
+        # Sends waiting for the moves applied since the last flush to be committed
+        self.outbox: list = []
+
+        # Player requests handled since the last flush (timed once their updates are sent)
+        self.applied: list = []
+
+        # Set once the game is over (the requests already in the inbox are still handled)
+        self.closed = False
+
+        self.task = asyncio.create_task(self.run())
+
+    # Adds a request to the inbox
+    # Returns False if the inbox is full, unless the request is forced in because it can't be turned away
+    def submit(self, request: GameRequest, force=False):
+        if len(self.inbox) >= game_inbox_size and not force:
+            rejected_requests.inc()
+            return False
+
+        self.inbox.append(request)
+        self.wakeup.set()
+        return True
+
+    # Stops the actor once it's done with the requests already in its inbox
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+    async def run(self):
+        while self.inbox or not self.closed:
+            if not self.inbox:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            request = self.inbox.popleft()
+            try:
+                if request.work is None:
+                    self.apply_move(request)
+                else:
+                    await request.work()
+                    if request.start_time is not None:
+                        observe_request(request.connection, request.action, request.start_time)
+
+                # Apply the moves that are already waiting before sending any updates
+                if self.outbox and not (self.inbox and self.inbox[0].work is None):
+                    await self.flush()
+
+            except Exception:
+                log_event(logger, logging.ERROR, "game_request_failed", id(request.connection), exc_info=True,
+                          action=request.action)
+
+    # Applies a move from a player or the CPU and queues its updates until the next flush
+    def apply_move(self, request: GameRequest):
+        game_manager = self.game_manager
+        connection = request.connection
+
+        if isinstance(connection, CPUPlayer):
+            # Drop the CPU's move if the game ended while it was thinking
+            if self.closed:
+                return
+
+            player_num = connection.player_num
+
+        else:
+            if request.start_time is not None:
+                self.applied.append(request)
+
+            # The player might have left the game after sending the move
+            if players.get(connection, (None,))[0] is not game_manager:
+                response = {
+                    "success": False,
+                    "action": request.action,
+                    "error": "The player isn't in a game yet"
+                }
+                self.outbox.append(partial(send_message, connection, response))
+                return
+
+            _, opponent, player_num = players[connection]
+
+            # For local games, always set the player_num key to the current turn
+            # This is b/c there is no way of accurately differentiating the two players
+            # since they come from the same connection. So we have to assume that the one
+            # requesting the move is the player whose turn it currently is.
+            if connection == opponent:
+                player_num = game_manager.current_turn
+
+        # Pass the action to the game manager
+        result = perform_action(game_manager, request.action, request.params, player_num)
+        if result is None:
+            log_event(logger, logging.INFO, "missing_params", id(connection), action=request.action)
+            return
+
+        # The pieces as they are right after the move, in case someone needs the full board once it's sent
+        node_pieces = tuple(game_manager.board.node_pieces)
+
+        # Notify everyone following the game if the move was successful
+        # (players on the same connection as their opponent are only notified once)
+        if result["success"]:
+            recipients = tuple(dict.fromkeys((*games[game_manager], *spectators.get(game_manager, ()))))
+            self.outbox.append(partial(broadcast_update, recipients, result, node_pieces))
+
+            # Let the CPU opponent play its turn
+            for player in games[game_manager]:
+                if isinstance(player, CPUPlayer):
+                    player.start_turn(game_manager)
+
+        # *** THIS SHOULD NEVER HAPPEN ***
+        # The cpu should only be playing legal moves
+        elif isinstance(connection, CPUPlayer):
+            log_event(logger, logging.ERROR, "illegal_cpu_move", action=request.action, params=request.params)
+            return
+
+        # Otherwise only the player needs to know what went wrong
+        else:
+            self.outbox.append(partial(send_update, connection, result, node_pieces))
+
+        # Notify both players if the last move ended the game
+        # A CPU that won isn't one of the players, so the game is closed through its opponent's seat
+        if result.get("next_state") == GameState.STOPPED.name:
+            if connection not in players:
+                connection = next(player for player in games[game_manager] if player in players)
+
+            work = partial(leave_game, connection, EndFlags.PLAYER_WON)
+            self.inbox.appendleft(GameRequest(connection, "quit_game", work=work, timed=False))
+
+    # Commits the moves applied since the last flush and sends their updates in order
+    # If the moves can't be committed, their updates are held until a later flush manages to
+    async def flush(self):
+        outbox, self.outbox = self.outbox, []
+        applied, self.applied = self.applied, []
+
+        try:
+            await commit_moves()
+        except Exception:
+            self.outbox[:0] = outbox
+            self.applied[:0] = applied
+            raise
+
+        for send in outbox:
+            try:
+                await send()
+            except websockets.ConnectionClosed:
+                # The player's own handler cleans up after them
+                pass
+
+        for request in applied:
+            observe_request(request.connection, request.action, request.start_time)
+
+
+# Stands in for a player whose websocket is connected to another worker process
+# Everything sent to it is relayed to that worker through the coordinator
+class RemotePlayer:
+    def __init__(self, link: "CoordinatorLink", worker_ID: int, conn_ID: int) -> None:
+        self.link = link
+        self.worker_ID = worker_ID
+        self.conn_ID = conn_ID
+
+    async def send(self, message):
+        self.link.send({"type": "relay",
+                        "worker": self.worker_ID,
+                        "kind": "message",
+                        "conn": self.conn_ID,
+                        "host": self.link.worker_ID,
+                        "message": message})
+
+
+# A worker process' connection to the matchmaking coordinator
+# Games are always hosted by the worker of the player that completed the match.
+# If their opponent is connected to another worker, the host seats a RemotePlayer for them
+# and the opponent's worker forwards all of their requests to the host.
+class CoordinatorLink:
+    def __init__(self, worker_ID: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.worker_ID = worker_ID
+        self.reader = reader
+        self.writer = writer
+
+        # Connection ID (key) -> Player websocket (value) for every player connected to this worker
+        self.connections: dict = {}
+        self.connection_IDs: dict = {}
+        self.next_ID = 0
+
+        # Player websocket (key) -> ID of the worker hosting their game (value)
+        self.remote_players: dict = {}
+
+        # (Worker ID, connection ID) (key) -> RemotePlayer (value) for the games hosted by this worker
+        self.remote_opponents: dict = {}
+
+        # Remote players that disconnected before their game was set up
+        self.closed_players: set = set()
+
+        # Connection ID (key) -> Future for the coordinator's reply to the player's join_game request (value)
+        self.pending_joins: dict = {}
+
+    @classmethod
+    async def connect(cls, worker_ID: int, path: str):
+        reader, writer = await asyncio.open_unix_connection(path)
+
+        link = cls(worker_ID, reader, writer)
+        link.send({"type": "hello", "worker": worker_ID})
+        return link
+
+    def send(self, message: dict):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    # Gives the connection an ID that the other processes can refer to it by
+    def register(self, connection):
+        self.connections[self.next_ID] = connection
+        self.connection_IDs[connection] = self.next_ID
+        self.next_ID += 1
+
+    def unregister(self, connection):
+        conn_ID = self.connection_IDs.pop(connection, None)
+        self.connections.pop(conn_ID, None)
+
+    # Asks the coordinator to find an opponent for the connection
+    async def join_game(self, connection, game_type: int, joining_lobby: bool, create_lobby: bool,
+                        wants_delta: bool, response: dict):
+        conn_ID = self.connection_IDs[connection]
+        future = asyncio.get_running_loop().create_future()
+        self.pending_joins[conn_ID] = future
+
+        self.send({"type": "join",
+                   "conn": conn_ID,
+                   "game_type": game_type,
+                   "joining_lobby": joining_lobby,
+                   "create_lobby": create_lobby,
+                   "delta_updates": wants_delta})
+        reply = await future
+
+        if reply["type"] == "matched":
+            opponent_worker, opponent_conn = reply["opponent"]
+
+            # Look for another match if the opponent left before their worker heard about this one
+            if (opponent_worker, opponent_conn) in self.closed_players:
+                self.closed_players.discard((opponent_worker, opponent_conn))
+                return await self.join_game(connection, game_type, joining_lobby, create_lobby, wants_delta, response)
+
+            if opponent_worker == self.worker_ID:
+                opponent = self.connections.get(opponent_conn)
+                if opponent is None:
+                    return await self.join_game(connection, game_type, joining_lobby, create_lobby, wants_delta,
+                                                response)
+
+                waiting_list.pop(opponent)
+            else:
+                opponent = RemotePlayer(self, opponent_worker, opponent_conn)
+                self.remote_opponents[(opponent_worker, opponent_conn)] = opponent
+
+                if reply["opponent_delta"]:
+                    delta_connections.add(opponent)
+
+            await start_game(connection, opponent, response, wants_delta)
+
+        elif reply["type"] == "invalid_lobby":
+            response["error"] = "Your private lobby key is invalid"
+            await send_message(connection, response)
+
+        else:
+            if create_lobby:
+                response["lobby_key"] = reply["game_type"]
+
+            await wait_for_opponent(connection, reply["game_type"], wants_delta, response)
+
+    # Asks the coordinator which worker restored the game of the player key and forwards the request there
+    # Returns False if no other worker is holding a seat for the key
+    async def rejoin_game(self, connection, params: dict):
+        query = {"type": "rejoin", "player_key": int(params["player_key"])}
+        return await self.forward_to_host(connection, params, query)
+
+    # Asks the coordinator which worker hosts the game and forwards the spectate request there
+    # Returns False if no other worker hosts the game
+    async def spectate_game(self, connection, params: dict):
+        query = {"type": "spectate", "game_ID": int(params["game_ID"])}
+        return await self.forward_to_host(connection, params, query)
+
+    # Sends the query for the worker hosting a game to the coordinator and forwards the request to that worker
+    async def forward_to_host(self, connection, params: dict, query: dict):
+        conn_ID = self.connection_IDs[connection]
+        future = asyncio.get_running_loop().create_future()
+        self.pending_joins[conn_ID] = future
+
+        self.send({**query, "conn": conn_ID})
+        reply = await future
+
+        if reply["host"] is None:
+            return False
+
+        self.remote_players[connection] = reply["host"]
+        self.forward_action(connection, params)
+        return True
+
+    # Takes the connection out of the coordinator's waiting list
+    def leave(self, connection):
+        self.send({"type": "leave", "conn": self.connection_IDs[connection]})
+
+    # Sends a request from a player connected to this worker to the worker hosting their game
+    def forward_action(self, connection, params: dict):
+        self.send({"type": "relay",
+                   "worker": self.remote_players[connection],
+                   "kind": "action",
+                   "player": [self.worker_ID, self.connection_IDs[connection]],
+                   "params": params})
+
+    # Tells the worker hosting the player's game that the player disconnected
+    def forward_disconnect(self, host_ID: int, conn_ID: int):
+        self.send({"type": "relay",
+                   "worker": host_ID,
+                   "kind": "disconnect",
+                   "player": [self.worker_ID, conn_ID]})
+
+    # Forgets a RemotePlayer once its game is over
+    def drop_remote_opponent(self, opponent):
+        if isinstance(opponent, RemotePlayer):
+            self.remote_opponents.pop((opponent.worker_ID, opponent.conn_ID), None)
+            delta_connections.discard(opponent)
+
+    # Tells the coordinator that a game is hosted by this worker until close_game() is called, so spectators
+    # on other workers can find it
+    def open_game(self, game_ID: int):
+        self.send({"type": "open_game", "game_ID": game_ID})
+
+    def close_game(self, game_ID: int):
+        self.send({"type": "close_game", "game_ID": game_ID})
+
+    # Relays a single copy of an update to several players connected to the same worker
+    def relay_broadcast(self, worker_ID: int, conn_IDs: list, payload: str):
+        self.send({"type": "relay",
+                   "worker": worker_ID,
+                   "kind": "broadcast",
+                   "conns": conn_IDs,
+                   "host": self.worker_ID,
+                   "message": payload})
+
+    # Forgets a RemotePlayer that was never seated and lets its worker know it isn't in a game hosted here
+    def release_remote_player(self, opponent: RemotePlayer):
+        self.drop_remote_opponent(opponent)
+        self.send({"type": "relay",
+                   "worker": opponent.worker_ID,
+                   "kind": "release",
+                   "conn": opponent.conn_ID})
+
+    # Handles the messages from the coordinator until the connection to it closes
+    async def listen(self):
+        async for line in self.reader:
+            message = json.loads(line)
+
+            # Replies to join_game, rejoin_game and spectate_game requests
+            if message["type"] in ("matched", "waiting", "invalid_lobby", "host_reply"):
+                future = self.pending_joins.pop(message["conn"], None)
+                if future is not None:
+                    future.set_result(message)
+
+            # A player waiting on this worker was matched with a player on another worker
+            elif message["type"] == "hosted":
+                connection = self.connections.get(message["conn"])
+                if connection is None:
+                    self.forward_disconnect(message["host"], message["conn"])
+                    continue
+
+                waiting_list.pop(connection, None)
+                self.remote_players[connection] = message["host"]
+
+            elif message["type"] == "relay":
+                try:
+                    await self.handle_relay(message)
+                except Exception:
+                    log_event(logger, logging.ERROR, "relay_failed", exc_info=True, kind=message.get("kind"))
+
+    async def handle_relay(self, message: dict):
+        # An update for a player connected to this worker from the worker hosting their game
+        if message["kind"] == "message":
+            connection = self.connections.get(message["conn"])
+            if connection is None:
+                self.forward_disconnect(message["host"], message["conn"])
+                return
+
+            result = json.loads(message["message"])
+            if result.get("action") == "quit_game":
+                self.remote_players.pop(connection, None)
+
+            # The host already left out whatever the player's update format doesn't include
+            await send_message(connection, result)
+
+        # An update for several players connected to this worker (the spectators of a game hosted elsewhere)
+        elif message["kind"] == "broadcast":
+            result = json.loads(message["message"])
+            recipients = []
+
+            for conn_ID in message["conns"]:
+                connection = self.connections.get(conn_ID)
+                if connection is None:
+                    self.forward_disconnect(message["host"], conn_ID)
+                    continue
+
+                if result.get("action") == "quit_game":
+                    self.remote_players.pop(connection, None)
+                recipients.append(connection)
+
+            await broadcast_update(recipients, result)
+
+        # A request from a player of a game hosted by this worker
+        elif message["kind"] == "action":
+            player = tuple(message["player"])
+            opponent = self.remote_opponents.get(player)
+
+            # Players rejoining or spectating a game hosted by this worker don't have a stand-in yet
+            if opponent is None and message["params"].get("action") in ("rejoin_game", "spectate_game"):
+                opponent = RemotePlayer(self, *player)
+                self.remote_opponents[player] = opponent
+
+            if opponent is not None:
+                await handle_message(opponent, message["params"])
+
+        # A player connected to this worker couldn't rejoin the game they were forwarded to
+        elif message["kind"] == "release":
+            connection = self.connections.get(message["conn"])
+            if connection is not None:
+                self.remote_players.pop(connection, None)
+
+        # A player of a game hosted by this worker disconnected
+        elif message["kind"] == "disconnect":
+            player = tuple(message["player"])
+            opponent = self.remote_opponents.get(player)
+            if opponent is None:
+                self.closed_players.add(player)
+                return
+
+            await disconnect(opponent)
+
+
 # Takes in a new connection looking for a game.
 # If the waiting list has another connection waiting for the same type of game,
 # a new game is started between it and the new connection.
@@ -58,7 +731,10 @@ async def join_game(connection, params):
         "player_num": 0,
         "adjacent_pieces": {},
         "next_state": GameState.STOPPED.name,
-        "next_player": 0
+        "next_player": 0,
+        "delta_updates": False,
+        "game_ID": 0,
+        "seq": 0
     }
 
     # Load all the necessary parameters
@@ -66,9 +742,13 @@ async def join_game(connection, params):
         game_type: int = params["game_type"]
     except Exception:
         response["error"] = "Wasn't given all the necessary parameters for joining a game"
-        await connection.send(json.dumps(response))
+        await send_message(connection, response)
         return
 
+    # Check if the connection wants delta updates instead of full board snapshots
+    # Only applied if the connection isn't already in a game or the waiting list
+    wants_delta = bool(params.get("delta_updates", False))
+
     # Check if the connection is requesting to join a private lobby
     joining_lobby = (bool)(game_type & LOBBY_KEY_MASK)
     # Check if the connection is requesting to create a private game lobby
@@ -81,85 +761,379 @@ async def join_game(connection, params):
     # Checks if the player is already in a game
     if connection in players:
         response["error"] = "The player is already in a game"
-        await connection.send(json.dumps(response))
+        await send_message(connection, response)
 
     # Checks if the player is already waiting for a game
     elif connection in waiting_list:
         response["error"] = "The player is already in the waiting list"
-        await connection.send(json.dumps(response))
-
-    # Tries to start a new game using the current connection
-    # A new game can be started under 2 conditions:
-    # 1) The current connection is requesting a game type that a previous connection already asked for
-    # 2) The current connection is requesting a local game (aka both players originate from the same connection)
-    elif game_type in game_types or is_local:
-        # Initializes a new instance of the board manager
-        game_manager: BoardManager = BoardManager(min_pieces=2, max_pieces=12)
-        response["next_player"] = game_manager.start_game()
-
-        # Loads the adjacent pieces array into a JSON-compatible format
-        # so that the client knows how the board is arranged
-        adjacent_pieces_json = []
-        for node, neighbors in game_manager.adjacent_pieces.items():
-            neighbors_array = []
-
-            for neighbor in neighbors:
-                neighbors_array.append({"x": neighbor[0], "y": neighbor[1]})
-
-            adjacent_pieces_json.append({"x": node[0], "y": node[1], "neighbors": neighbors_array})
-
-        # Update the JSON response for the current connection
-        response["next_state"] = game_manager.game_state.name
-        response["adjacent_pieces"] = adjacent_pieces_json
-        response["success"] = True
-
-        # Reuses the same connection for the opponent if this is a local game
-        if is_local:
-            opponent = connection
-
-        # Otherwise, find the other player and remove them from the waiting list
-        else:
-            opponent = game_types.pop(game_type)
-            waiting_list.pop(opponent)
+        await send_message(connection, response)
 
-            # Notify the second player (opponent) that the game has started
-            response["player_num"] = 1
-            await opponent.send(json.dumps(response))
+    # Checks if the player is watching a game
+    elif connection in spectating:
+        response["error"] = "The player is spectating a game"
+        await send_message(connection, response)
 
-        # Notify the first player that a game has started
-        await connection.send(json.dumps(response))
+    # Starts a local game right away (aka both players originate from the same connection)
+    elif is_local:
+        await start_game(connection, connection, response, wants_delta)
 
-        # Update all references to the relevant connections and game manager
-        games[game_manager] = (connection, opponent)
-        players[connection] = (game_manager, opponent, 0)
-        players[opponent] = (game_manager, connection, 1)
+    # Seats a CPU opponent in the game right away if the connection asked for one
+    # The CPU plays first, like it did when it joined the game as the second connection
+    elif requesting_CPU and not joining_lobby:
+        response["player_num"] = 1
+        await start_game(connection, CPUPlayer(), response, wants_delta)
+
+    # Lets the coordinator find the opponent if the waiting list is shared with other worker processes
+    elif coordinator is not None:
+        await coordinator.join_game(connection, game_type, joining_lobby, create_lobby, wants_delta, response)
+
+    # Starts a game with the connection that already asked for the same game type
+    elif game_type in game_types:
+        opponent = game_types.pop(game_type)
+        waiting_list.pop(opponent)
+
+        await start_game(connection, opponent, response, wants_delta)
 
     # Checks if the current connection is trying to join an unknown private lobby
     elif joining_lobby:
         response["error"] = "Your private lobby key is invalid"
-        await connection.send(json.dumps(response))
+        await send_message(connection, response)
 
     # If there are no available opponents, add the current connection to the waiting list
     else:
         # TODO: check if the "game_type" variable can be a 64-bit int
-        # If the connection wants a private lobby or to go against a CPU opponent,
+        # If the connection wants a private lobby,
         # add a random "lobby key" to the front of the game type
-        if requesting_CPU or create_lobby:
+        if create_lobby:
             lobby_key = random.randint(2**16, 2**32)
             game_type = (lobby_key << 16) | (game_type & 0xFFFF)
             response["lobby_key"] = game_type
 
-        # Add the new connection to the waiting list
         game_types[game_type] = connection
-        waiting_list[connection] = game_type
+        await wait_for_opponent(connection, game_type, wants_delta, response)
+
+
+# Seats the connection in the game it left when the server restarted, using the key it was given when the game started
+# Returns True if the request was handed to the game's actor
+async def rejoin_game(connection, params):
+    # Generate a default API response
+    response = {
+        "success": False,
+        "action": "rejoin_game",
+        "error": "",
+        "player1_key": 0,
+        "player2_key": 0,
+        "player_num": 0,
+        "adjacent_pieces": {},
+        "active_pieces": [],
+        "next_state": GameState.STOPPED.name,
+        "next_player": 0,
+        "delta_updates": False,
+        "game_ID": 0,
+        "seq": 0
+    }
+
+    # Load all the necessary parameters
+    try:
+        player_key = int(params["player_key"])
+    except Exception:
+        response["error"] = "Wasn't given all the necessary parameters for rejoining a game"
+        await send_message(connection, response)
+        return False
+
+    wants_delta = bool(params.get("delta_updates", False))
+
+    # Checks if the player is already in a game
+    if connection in players:
+        response["error"] = "The player is already in a game"
+        await send_message(connection, response)
+        return False
+
+    # Checks if the player is already waiting for a game
+    if connection in waiting_list:
+        response["error"] = "The player is already in the waiting list"
+        await send_message(connection, response)
+        return False
+
+    # Checks if the player is watching a game
+    if connection in spectating:
+        response["error"] = "The player is spectating a game"
+        await send_message(connection, response)
+        return False
+
+    seat = rejoin_seats.get(player_key)
+    if seat is None:
+        # The game might have been restored by another worker process
+        if coordinator is not None and not isinstance(connection, RemotePlayer):
+            if await coordinator.rejoin_game(connection, params):
+                return False
+
+        await refuse_request(connection, response, "Your player key is invalid")
+        return False
+
+    # Take the seat once the game's actor is done with the requests it already has
+    request = GameRequest(connection, "rejoin_game", work=partial(take_seat, connection, player_key, wants_delta,
+                                                                  response))
+    if submit_request(players[seat][0], request):
+        return True
+
+    await refuse_request(connection, response, BUSY_ERROR)
+    return False
+
+
+# Sends the error about why the connection couldn't rejoin or spectate a game
+async def refuse_request(connection, response: dict, error: str):
+    response["error"] = error
+    await send_message(connection, response)
+
+    # Forget the stand-in for a player on another worker since they never got a seat
+    if coordinator is not None and isinstance(connection, RemotePlayer):
+        coordinator.release_remote_player(connection)
+
+
+# Puts the connection in the seat held for the player key (run by the game's actor)
+async def take_seat(connection, player_key: int, wants_delta: bool, response: dict):
+    # The connection might have found something else to do while the request waited
+    if connection in players or connection in waiting_list or connection in spectating:
+        await refuse_request(connection, response, BUSY_PLAYER_ERROR)
+        return
+
+    # Someone else might have taken the seat while the request was waiting
+    seat = rejoin_seats.pop(player_key, None)
+    if seat is None:
+        await refuse_request(connection, response, "Your player key is invalid")
+        return
+
+    # Put the connection in the seat (both seats for local games)
+    game_manager, opponent, player_num = players.pop(seat)
+    if opponent == seat:
+        opponent = connection
+    elif opponent in players:
+        players[opponent] = (game_manager, connection, players[opponent][2])
+
+    players[connection] = (game_manager, opponent, player_num)
+    games[game_manager] = tuple(connection if player == seat else player for player in games[game_manager])
+
+    if wants_delta:
+        delta_connections.add(connection)
+
+    # Send the player everything they need to pick the game back up
+    response.update(get_snapshot(game_manager))
+    response["action"] = "rejoin_game"
+    response["game_ID"] = game_IDs[game_manager]
+    response["player_num"] = player_num
+    response["adjacent_pieces"] = ADJACENT_PIECES_JSON
+    response["delta_updates"] = connection in delta_connections
+
+    player1_key, player2_key = player_keys[game_manager]
+    if opponent == connection:
+        response["player1_key"], response["player2_key"] = player1_key, player2_key
+    elif player_num == 0:
+        response["player1_key"] = player1_key
+    else:
+        response["player2_key"] = player2_key
+
+    await send_message(connection, response)
+
+    # Let the CPU opponent play if it's its turn
+    if isinstance(opponent, CPUPlayer):
+        opponent.start_turn(game_manager)
+
+
+# Attaches the connection to a game as a spectator that gets every update of the game but can't make moves
+# Returns True if the request was handed to the game's actor
+async def spectate_game(connection, params):
+    # Generate a default API response
+    response = {
+        "success": False,
+        "action": "spectate_game",
+        "error": "",
+        "game_ID": 0,
+        "adjacent_pieces": {},
+        "active_pieces": [],
+        "next_state": GameState.STOPPED.name,
+        "next_player": 0,
+        "delta_updates": False,
+        "seq": 0
+    }
+
+    # Load all the necessary parameters
+    try:
+        game_ID = int(params["game_ID"])
+    except Exception:
+        response["error"] = "Wasn't given all the necessary parameters for spectating a game"
+        await send_message(connection, response)
+        return False
+
+    wants_delta = bool(params.get("delta_updates", False))
+
+    # Checks if the player is already in a game
+    if connection in players:
+        response["error"] = "The player is already in a game"
+        await send_message(connection, response)
+        return False
+
+    # Checks if the player is already waiting for a game
+    if connection in waiting_list:
+        response["error"] = "The player is already in the waiting list"
+        await send_message(connection, response)
+        return False
+
+    # Checks if the player is already watching a game
+    if connection in spectating:
+        response["error"] = "The player is already spectating a game"
+        await send_message(connection, response)
+        return False
+
+    game_manager = hosted_games.get(game_ID)
+    if game_manager is None:
+        # The game might be hosted by another worker process
+        if coordinator is not None and not isinstance(connection, RemotePlayer):
+            if await coordinator.spectate_game(connection, params):
+                return False
+
+        await refuse_request(connection, response, "The game doesn't exist")
+        return False
+
+    # Start watching once the game's actor is done with the requests it already has,
+    # so the spectator's snapshot includes every update they won't be sent
+    request = GameRequest(connection, "spectate_game", work=partial(add_spectator, connection, game_manager,
+                                                                    wants_delta, response))
+    if submit_request(game_manager, request):
+        return True
+
+    await refuse_request(connection, response, BUSY_ERROR)
+    return False
+
+
+# Adds the connection to the spectators of the game and sends it a snapshot of the game (run by the game's actor)
+async def add_spectator(connection, game_manager: BoardManager, wants_delta: bool, response: dict):
+    # The game might have ended or the connection might have found something else to do while the request waited
+    if game_manager not in game_IDs:
+        await refuse_request(connection, response, "The game doesn't exist")
+        return
+
+    if connection in spectating or connection in players or connection in waiting_list:
+        await refuse_request(connection, response, BUSY_PLAYER_ERROR)
+        return
 
-        response["success"] = True
-        response["waiting"] = True
-        await connection.send(json.dumps(response))
+    spectating[connection] = game_manager
+    spectators.setdefault(game_manager, set()).add(connection)
 
-        # Create a new cpu if the connection is requesting a cpu opponent
-        if requesting_CPU:
-            subprocess.Popen(['python3', 'computer_opponent.py', str(game_type), server_address, str(server_port)])
+    if wants_delta:
+        delta_connections.add(connection)
+
+    # Start the spectator off with a snapshot of the game so far
+    response.update(get_snapshot(game_manager))
+    response["action"] = "spectate_game"
+    response["game_ID"] = game_IDs[game_manager]
+    response["adjacent_pieces"] = ADJACENT_PIECES_JSON
+    response["delta_updates"] = connection in delta_connections
+
+    await send_message(connection, response)
+
+
+# Stops sending a game's updates to a spectator
+def stop_spectating(connection):
+    game_manager = spectating.pop(connection, None)
+    if game_manager is None:
+        return
+
+    watchers = spectators.get(game_manager)
+    if watchers is not None:
+        watchers.discard(connection)
+        if not watchers:
+            spectators.pop(game_manager)
+
+    delta_connections.discard(connection)
+    if coordinator is not None:
+        coordinator.drop_remote_opponent(connection)
+
+
+# Starts the game's actor and lets spectators find the game by its ID,
+# including spectators connected to other worker processes
+def host_game(game_manager: BoardManager, game_ID: int):
+    game_actors[game_manager] = GameActor(game_manager)
+    hosted_games[game_ID] = game_manager
+    if coordinator is not None:
+        coordinator.open_game(game_ID)
+
+
+# Starts a new game between the connection and its opponent
+# The opponent is either another player's websocket, the same connection for local games or a CPUPlayer
+async def start_game(connection, opponent, response: dict, wants_delta: bool):
+    # Initializes a new instance of the board manager
+    game_manager: BoardManager = BoardManager(min_pieces=2, max_pieces=12)
+    response["next_player"] = game_manager.start_game()
+    sequence_numbers[game_manager] = 0
+
+    # Give each seat a key its player can rejoin the game with if the server restarts
+    # Both seats of a local game belong to the same connection, so they share a key
+    player1_key = random.getrandbits(63)
+    player2_key = player1_key if opponent == connection else random.getrandbits(63)
+    player_keys[game_manager] = (player1_key, player2_key)
+
+    # Save the game before anyone hears about it
+    game_IDs[game_manager] = random.getrandbits(63)
+    cpu_num = opponent.player_num if isinstance(opponent, CPUPlayer) else -1
+    game_store.save_game(game_IDs[game_manager], 0, game_manager.export_position(),
+                         (player1_key, player2_key, cpu_num))
+    log_record(pack_record(START_RECORD, game_IDs[game_manager], 0, player1_key, player2_key, cpu_num))
+    await commit_moves()
+    host_game(game_manager, game_IDs[game_manager])
+
+    if wants_delta:
+        delta_connections.add(connection)
+
+    # Update the JSON response for the current connection
+    # (the adjacent pieces let the client know how the board is arranged)
+    response["game_ID"] = game_IDs[game_manager]
+    response["next_state"] = game_manager.game_state.name
+    response["adjacent_pieces"] = ADJACENT_PIECES_JSON
+    response["success"] = True
+
+    # Notify the second player (opponent) that the game has started
+    if opponent != connection and not isinstance(opponent, CPUPlayer):
+        response["player_num"] = 1
+        response["player2_key"] = player2_key
+        response["delta_updates"] = opponent in delta_connections
+        await send_message(opponent, response)
+        response["player2_key"] = 0
+
+    # Notify the first player that a game has started
+    # The player sits in the 2nd seat in CPU games and in both seats in local games
+    if isinstance(opponent, CPUPlayer):
+        response["player2_key"] = player2_key
+    else:
+        response["player1_key"] = player1_key
+        if opponent == connection:
+            response["player2_key"] = player2_key
+
+    response["delta_updates"] = connection in delta_connections
+    await send_message(connection, response)
+
+    # Update all references to the relevant connections and game manager
+    if isinstance(opponent, CPUPlayer):
+        games[game_manager] = (opponent, connection)
+        players[connection] = (game_manager, opponent, 1)
+        opponent.start_turn(game_manager)
+    else:
+        games[game_manager] = (connection, opponent)
+        players[connection] = (game_manager, opponent, 0)
+        players[opponent] = (game_manager, connection, 1)
+
+
+# Adds the connection to the waiting list until another connection asks for the same game type
+async def wait_for_opponent(connection, game_type: int, wants_delta: bool, response: dict):
+    waiting_list[connection] = game_type
+
+    if wants_delta:
+        delta_connections.add(connection)
+
+    response["success"] = True
+    response["waiting"] = True
+    response["delta_updates"] = wants_delta
+    await send_message(connection, response)
 
 
 # Remove any references to the connection
@@ -175,6 +1149,36 @@ async def close_connection(connection, flag: EndFlags):
     if connection in players:
         board_manager, opponent, player_num = players.pop(connection, None)
         board_manager.end_game()
+        game_ID = game_IDs.pop(board_manager)
+        game_store.delete_game(game_ID)
+        log_record(pack_record(END_RECORD, game_ID, sequence_numbers.pop(board_manager, 0)))
+        await commit_moves()
+
+        hosted_games.pop(game_ID, None)
+        if coordinator is not None:
+            coordinator.close_game(game_ID)
+
+        # The actor finishes the requests it already has (they're turned away now that the players left)
+        actor = game_actors.pop(board_manager, None)
+        if actor is not None:
+            actor.close()
+
+        # The player who made the last removal keeps the turn when the game ends
+        if flag == EndFlags.PLAYER_WON:
+            result["winner"] = board_manager.current_turn
+            result["msg"] = "Player " + str(board_manager.current_turn + 1) + " won."
+
+        # Let the spectators know that the game is over
+        watchers = spectators.get(board_manager, ())
+        if watchers:
+            await broadcast_update(watchers, {**result, "msg": "The game ended."})
+
+            for watcher in list(watchers):
+                stop_spectating(watcher)
+
+        # The seats of a restored game can't be rejoined once it's over
+        for key in player_keys.pop(board_manager, ()):
+            rejoin_seats.pop(key, None)
 
         # Check if it was a local game
         is_local = connection == opponent
@@ -182,20 +1186,40 @@ async def close_connection(connection, flag: EndFlags):
         if not is_local:
             players.pop(opponent, None)
 
-            # Tell the other player that their opponent left
-            result["msg"] = "Opponent Forfeited."
-            await opponent.send(json.dumps(result))
+            # Tell the other player that their opponent left (or who won)
+            if flag != EndFlags.PLAYER_WON:
+                result["msg"] = "Opponent Forfeited."
+            await broadcast_update((opponent,), result)
 
             # Generate message for telling the player that they forfeited
-            result["msg"] = "You Forfeited."
+            if flag != EndFlags.PLAYER_WON:
+                result["msg"] = "You Forfeited."
+
+        if coordinator is not None:
+            coordinator.drop_remote_opponent(connection)
+            coordinator.drop_remote_opponent(opponent)
 
     # Remove any references to the closed connection in the waiting list
     elif connection in waiting_list:
         game_type = waiting_list.pop(connection)
-        game_types.pop(game_type)
+        if coordinator is not None:
+            coordinator.leave(connection)
+        else:
+            game_types.pop(game_type)
 
         result["flag"] = EndFlags.QUIT_QUEUE.value
 
+    # Stop sending the game's updates to a spectator
+    elif connection in spectating:
+        stop_spectating(connection)
+        result["msg"] = "You stopped spectating."
+
+    # Let the worker hosting the game know if a player on another worker disconnected
+    # (their other requests, including quit_game, are forwarded before reaching here)
+    elif coordinator is not None and connection in coordinator.remote_players:
+        coordinator.forward_disconnect(coordinator.remote_players.pop(connection),
+                                       coordinator.connection_IDs[connection])
+
     else:
         # Generate the message for telling the player that they left the waiting list
         result["success"] = False
@@ -205,171 +1229,613 @@ async def close_connection(connection, flag: EndFlags):
     return result
 
 
+# Passes a game action from one of the players to the game manager
+# Returns the JSON response about the action's outcome or None if the action is missing some of its parameters
+# The response leaves out the board_state, which is only built for the players that get full updates
+def perform_action(game_manager: BoardManager, action: str, params: dict, player_num: int):
+    # PLACE PIECE CASE
+    if action == "place_piece":
+        # Check that the request contains all the required keys
+        required_keys = ("x", "y")
+        if not all(key in params for key in required_keys):
+            return None
+
+        # Pass the player's action to the game manager
+        new_ID, x, y, active_pieces, error = game_manager.place_piece(
+            params["x"], params["y"], player_num)
+
+        # Generate a JSON response about the move's outcome
+        result = {"success": error == "",
+                  "action": "place_piece",
+                  "error": error,
+                  "new_piece_ID": new_ID,
+                  "new_x": x,
+                  "new_y": y,
+                  "active_pieces": active_pieces,
+                  "next_player": game_manager.current_turn,
+                  "next_state": game_manager.game_state.name}
+
+    # REMOVE PIECE CASE
+    elif action == "remove_piece":
+        # Check that the request contains all the required keys
+        required_keys = ["piece_ID"]
+        if not all(key in params for key in required_keys):
+            return None
+
+        # Pass the player's action to the game manager
+        piece_ID, active_pieces, error = game_manager.remove_piece(
+            params["piece_ID"], player_num)
+
+        # Generate a JSON response about the move's outcome
+        result = {"success": error == "",
+                  "action": "remove_piece",
+                  "error": error,
+                  "next_player": game_manager.current_turn,
+                  "next_state": game_manager.game_state.name,
+                  "removed_piece": piece_ID,
+                  "active_pieces": active_pieces}
+
+    # MOVE PIECE CASE
+    elif action == "move_piece":
+        # Check that the request contains all the required keys
+        required_keys = ("new_x", "new_y",
+                         "piece_ID")
+        if not all(key in params for key in required_keys):
+            return None
+
+        # Get the piece's coordinates before it's moved
+        old_node = game_manager.board.piece_nodes.get(params["piece_ID"]) \
+            if isinstance(params["piece_ID"], int) else None
+        old_x, old_y = NODES[old_node] if old_node is not None else (None, None)
+
+        # Pass the player's action to the game manager
+        x, y, piece_ID, active_pieces, error = game_manager.move_piece(
+            params["new_x"], params["new_y"], params["piece_ID"], player_num)
+
+        # Generate a JSON response about the move's outcome
+        result = {"success": error == "",
+                  "action": "move_piece",
+                  "error": error,
+                  "next_player": game_manager.current_turn,
+                  "next_state": game_manager.game_state.name,
+                  "moved_piece": piece_ID,
+                  "old_x": old_x,
+                  "old_y": old_y,
+                  "new_x": x,
+                  "new_y": y,
+                  "active_pieces": active_pieces}
+
+    # INVALID ACTION CASE
+    else:
+        result = {
+            "success": False,
+            "error": "Invalid action"
+        }
+        return result
+
+    # Number each successful move so clients with delta updates can tell if they missed one
+    if result["success"]:
+        sequence_numbers[game_manager] = sequence_numbers.get(game_manager, 0) + 1
+        game_store.save_game(game_IDs[game_manager], sequence_numbers[game_manager], game_manager.export_position(),
+                             get_game_players(game_manager))
+        log_record(pack_action(game_IDs[game_manager], sequence_numbers[game_manager], action, params))
+    result["seq"] = sequence_numbers.get(game_manager, 0)
+
+    return result
+
+
+# Returns (player 1's key, player 2's key, player number of the CPU or -1 if there's no CPU) for saving the game
+def get_game_players(game_manager: BoardManager):
+    cpu_num = -1
+    for player in games[game_manager]:
+        if isinstance(player, CPUPlayer):
+            cpu_num = player.player_num
+
+    return (*player_keys[game_manager], cpu_num)
+
+
+# Adds a record to the move log if it's turned on
+def log_record(record: bytes):
+    if move_log is not None:
+        move_log.append(record)
+
+
+# Waits until every record logged so far is on disk
+# Called before the players hear about a move so a move they saw is never lost in a crash
+async def commit_moves():
+    if move_log is not None:
+        await move_log.commit()
+
+
+# Returns a full snapshot of the game so a client can resync after missing an update
+def get_snapshot(game_manager: BoardManager):
+    return {"success": True,
+            "action": "get_snapshot",
+            "error": "",
+            "seq": sequence_numbers.get(game_manager, 0),
+            "board_state": game_manager.board_state.tolist(),
+            "active_pieces": game_manager.get_active_pieces(),
+            "next_player": game_manager.current_turn,
+            "next_state": game_manager.game_state.name}
+
+
+# Sends a response to a connection in the protocol it picked during the handshake
+async def send_message(connection, message: dict):
+    # Errors are counted by the process the player is connected to
+    if not message.get("success", True) and message.get("error") and not isinstance(connection, RemotePlayer):
+        error_count.inc(message.get("action", ""), message["error"])
+
+    if connection in binary_connections:
+        await connection.send(encode_response(message))
+    else:
+        await connection.send(json.dumps(message))
+
+
+# Adds the board_state built from the ID of the piece on each node (or -1) to a game update
+# Updates sent without the pieces (they already have their board_state or don't need one) are returned as they are
+def add_board_state(result: dict, node_pieces=None):
+    if node_pieces is None:
+        return result
+
+    board_state = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    for (x, y), piece_ID in zip(NODES, node_pieces):
+        board_state[y][x] = piece_ID
+
+    return {**result, "board_state": board_state}
+
+
+# Sends the outcome of a game action to a connection in the update format it asked for
+async def send_update(connection, result: dict, node_pieces=None):
+    if connection in delta_connections:
+        result = {key: value for key, value in result.items() if key != "board_state"}
+    else:
+        result = add_board_state(result, node_pieces)
+
+    await send_message(connection, result)
+
+
+# Sends a game update to every recipient at the same time
+# The update is encoded once for each format the recipients use, and a slow recipient only loses its own copy:
+# it's dropped if the recipient's send buffer is full or if it isn't sent within send_timeout
+# Recipients connected to the same worker process share a single relayed copy
+# The board_state is only built from node_pieces if one of the recipients gets full updates
+async def broadcast_update(recipients, result: dict, node_pieces=None):
+    payloads = {}
+    deliveries = []
+    full_result = None
+
+    # (Worker ID, update format) (key) -> Connection IDs of the recipients on the worker (value)
+    remote_recipients = {}
+
+    for connection in recipients:
+        update_format = (connection in binary_connections, connection in delta_connections)
+        if update_format not in payloads:
+            if update_format[1]:
+                message = {key: value for key, value in result.items() if key != "board_state"}
+            else:
+                if full_result is None:
+                    full_result = add_board_state(result, node_pieces)
+                message = full_result
+
+            payloads[update_format] = encode_response(message) if update_format[0] else json.dumps(message)
+
+        if isinstance(connection, RemotePlayer):
+            remote_recipients.setdefault((connection.worker_ID, update_format), []).append(connection.conn_ID)
+        else:
+            deliveries.append(deliver_update(connection, payloads[update_format]))
+
+    for (worker_ID, update_format), conn_IDs in remote_recipients.items():
+        coordinator.relay_broadcast(worker_ID, conn_IDs, payloads[update_format])
+
+    await asyncio.gather(*deliveries)
+
+
+# Sends an encoded update to one recipient unless it's falling behind
+async def deliver_update(connection, payload):
+    # Only websockets have a send buffer to check
+    transport = getattr(connection, "transport", None)
+    if transport is not None and transport.get_write_buffer_size() > send_buffer_limit:
+        dropped_updates.inc("backpressure")
+        return
+
+    try:
+        await asyncio.wait_for(connection.send(payload), send_timeout)
+    except asyncio.TimeoutError:
+        dropped_updates.inc("timeout")
+    except websockets.ConnectionClosed:
+        # The recipient's own handler cleans up after it
+        pass
+
+
+# Picks the binary protocol if the client offered it during the handshake and JSON otherwise
+def select_protocol(connection, subprotocols):
+    if BINARY_SUBPROTOCOL in subprotocols:
+        return BINARY_SUBPROTOCOL
+
+    return None
+
+
+# Handles one request from a player
+# The connection can also be a RemotePlayer standing in for a player connected to another worker process
+async def handle_message(connection, params: dict):
+    # Get the action that the player wants to perform
+    try:
+        action: str = params["action"]
+    except Exception:
+        response = {
+            "success": False,
+            "error": "The \"action\" property could not be found in your JSON request"
+        }
+        await send_message(connection, response)
+        return
+
+    # Requests handed to a game's actor are timed by the actor once they're handled
+    start_time = time.perf_counter()
+    queued = False
+    try:
+        queued = await handle_action(connection, action, params)
+    finally:
+        if not queued:
+            observe_request(connection, action, start_time)
+
+
+# Records how long a request took under its action's name (unknown actions are grouped together)
+def observe_request(connection, action, start_time: float):
+    latency = time.perf_counter() - start_time
+    action_name = action if isinstance(action, str) and action in ACTION_OPCODES else "invalid"
+    action_latency.observe(latency, action_name)
+    log_event(logger, logging.DEBUG, "request", id(connection), action=action_name, latency=latency)
+
+
+# Performs the action a player asked for and sends them its outcome
+# Requests about a game in progress are handed to the game's actor, which handles them in order
+# Returns True if the request was handed to an actor
+async def handle_action(connection, action: str, params: dict):
+    # START GAME CASE
+    if action == "join_game":
+        # Tries connecting a new player to a game
+        await join_game(connection, params)
+
+    # REJOIN GAME CASE
+    elif action == "rejoin_game":
+        return await rejoin_game(connection, params)
+
+    # SPECTATE GAME CASE
+    elif action == "spectate_game":
+        return await spectate_game(connection, params)
+
+    # QUIT GAME CASE
+    elif action == "quit_game":
+        # Players leave their game once the moves they already sent are handled
+        request = GameRequest(connection, action, work=partial(leave_game, connection, EndFlags.PLAYER_QUIT))
+        if connection in players and submit_request(players[connection][0], request, force=True):
+            return True
+
+        await leave_game(connection, EndFlags.PLAYER_QUIT)
+
+    # SPECTATOR CASES
+    # Spectators can only ask for snapshots of the game they're watching
+    elif connection in spectating:
+        if action == "get_snapshot":
+            return await queue_request(spectating[connection],
+                                       GameRequest(connection, action, work=partial(send_snapshot, connection)))
+
+        response = {
+            "success": False,
+            "action": action,
+            "error": "Spectators can't make moves"
+        }
+        await send_message(connection, response)
+
+    # GAME RELATED CASES
+    else:
+        game_manager = players.get(connection, (None,))[0]
+
+        # Check if the player is in a game
+        if game_manager is None:
+            response = {
+                "success": False,
+                "action": action,
+                "error": "The player isn't in a game yet"
+            }
+            await send_message(connection, response)
+            return False
+
+        # SNAPSHOT CASE
+        if action == "get_snapshot":
+            return await queue_request(game_manager,
+                                       GameRequest(connection, action, work=partial(send_snapshot, connection)))
+
+        # Everything else is a move, applied by the game's actor
+        return await queue_request(game_manager, GameRequest(connection, action, params))
+
+    return False
+
+
+# Hands a request to the actor of the game
+# Returns False if the game's inbox is full or the game just ended
+def submit_request(game_manager: BoardManager, request: GameRequest, force=False):
+    actor = game_actors.get(game_manager)
+    return actor is not None and actor.submit(request, force)
+
+
+# Hands a request to the actor of the game, or tells the player that the game is busy if it can't take it
+# Returns True if the actor took the request
+async def queue_request(game_manager: BoardManager, request: GameRequest):
+    if submit_request(game_manager, request):
+        return True
+
+    response = {
+        "success": False,
+        "action": request.action,
+        "error": BUSY_ERROR
+    }
+    await send_message(request.connection, response)
+    return False
+
+
+# Takes the connection out of its game or the waiting list and tells it the outcome
+async def leave_game(connection, flag: EndFlags):
+    response = await close_connection(connection, flag)
+    await send_message(connection, response)
+
+
+# Sends a snapshot of the game the connection is playing or watching
+async def send_snapshot(connection):
+    game_manager = spectating.get(connection) or players.get(connection, (None,))[0]
+    if game_manager is None:
+        response = {
+            "success": False,
+            "action": "get_snapshot",
+            "error": "The player isn't in a game yet"
+        }
+        await send_message(connection, response)
+        return
+
+    await send_message(connection, get_snapshot(game_manager))
+
+
+# Removes a player that disconnected from their game once the moves they already sent are handled,
+# or from the waiting list or the game they were watching right away
+async def disconnect(connection):
+    work = partial(close_connection, connection, EndFlags.PLAYER_DISCONNECTED)
+    request = GameRequest(connection, "disconnect", work=work, timed=False)
+    if connection not in players or not submit_request(players[connection][0], request, force=True):
+        await work()
+
+
 async def handler(connection):
-    print("There's a new connection from ", connection.remote_address[0], "!")
+    log_event(logger, logging.INFO, "connected", id(connection), address=connection.remote_address[0])
+    connected_sockets.inc()
+
+    if connection.subprotocol == BINARY_SUBPROTOCOL:
+        binary_connections.add(connection)
+
+    if coordinator is not None:
+        coordinator.register(connection)
 
     try:
         async for message in connection:
-            # Padding for debug prints
-            print("")
-
-            params = json.loads(message)
+            if connection in binary_connections:
+                params = decode_request(message)
+            else:
+                params = json.loads(message)
 
             # FOR TESTING PURPOSES
             if "test" in params:
                 await connection.send(json.dumps({}))
                 continue
 
-            # Get the action that the player wants to perform
-            try:
-                action: str = params["action"]
-            except Exception:
-                response = {
-                    "success": False,
-                    "error": "The \"action\" property could not be found in your JSON request"
-                }
-                await connection.send(json.dumps(response))
+            # Let the worker hosting the player's game handle the message if it's on another process
+            if coordinator is not None and connection in coordinator.remote_players:
+                coordinator.forward_action(connection, params)
                 continue
 
-            # START GAME CASE
-            if action == "join_game":
-                print("A player is trying to join a game")
+            await handle_message(connection, params)
 
-                # Tries connecting a new player to a game
-                await join_game(connection, params)
+    except Exception as e:
+        log_event(logger, logging.INFO, "disconnected", id(connection), reason=str(e))
 
-            # QUIT GAME CASE
-            elif action == "quit_game":
-                print("A player is trying to quit a game")
-                response = await close_connection(connection, EndFlags.PLAYER_QUIT)
+        # Remove all references to the player websockets and the game manager
+        await disconnect(connection)
 
-                # Notify the player of the outcome
-                await connection.send(json.dumps(response))
+    finally:
+        connected_sockets.dec()
+        stop_spectating(connection)
+        delta_connections.discard(connection)
+        binary_connections.discard(connection)
 
-            # GAME RELATED CASES
-            else:
-                game_manager, opponent, player_num = players.get(connection, [None, None, None])
-
-                # Check if the player is in a game
-                if game_manager is None:
-                    response = {
-                        "success": False,
-                        "action": action,
-                        "error": "The player isn't in a game yet"
-                    }
-                    await connection.send(json.dumps(response))
-                    continue
+        if coordinator is not None:
+            coordinator.unregister(connection)
+
+
+# Hosts the games that were in progress when the server last stopped until their players rejoin them
+# The games are taken from the recovered move log if the move logs are turned on since it's never behind
+# the game store, and from the game store otherwise
+async def restore_games(recovered_path: str = None):
+    if move_log is not None:
+        recovered = replay_log(recovered_path)[0] if recovered_path is not None else {}
+    else:
+        recovered = {game_ID: [BoardManager.from_position(position), seq, game_players[:2], game_players[2]]
+                     for game_ID, seq, position, game_players in game_store.load_games()}
+
+    restored = 0
+    for game_ID, (game_manager, seq, keys, cpu_num) in recovered.items():
+        # A game that was over before its end was recorded only needs to be closed for good
+        if game_manager.game_state == GameState.STOPPED:
+            game_store.delete_game(game_ID)
+            log_record(pack_record(END_RECORD, game_ID, seq))
+            continue
 
-                # For local games, always set the player_num key to the current turn
-                # This is b/c there is no way of accurately differentiating the two players
-                # since they come from the same connection. So we have to assume that the one
-                # requesting the move is the player whose turn it currently is.
-                if connection == opponent:
-                    player_num = game_manager.current_turn
-
-                # PLACE PIECE CASE
-                if action == "place_piece":
-                    # Check that the request contains all the required keys
-                    required_keys = ("x", "y")
-                    if not all(key in params for key in required_keys):
-                        print("Couldn't load all the necessary parameters")
-                        continue
-
-                    # Pass the player's action to the game manager
-                    new_ID, x, y, active_pieces, error = game_manager.place_piece(
-                        params["x"], params["y"], player_num)
-
-                    # Generate a JSON response about the move's outcome
-                    result = {"success": error == "",
-                              "action": "place_piece",
-                              "error": error,
-                              "board_state": game_manager.board_state.tolist(),
-                              "new_piece_ID": new_ID,
-                              "new_x": x,
-                              "new_y": y,
-                              "active_pieces": active_pieces,
-                              "next_player": game_manager.current_turn,
-                              "next_state": game_manager.game_state.name}
-
-                # REMOVE PIECE CASE
-                elif action == "remove_piece":
-                    # Check that the request contains all the required keys
-                    required_keys = ["piece_ID"]
-                    if not all(key in params for key in required_keys):
-                        print("Couldn't load all the necessary parameters")
-                        continue
-
-                    # Pass the player's action to the game manager
-                    piece_ID, active_pieces, error = game_manager.remove_piece(
-                        params["piece_ID"], player_num)
-
-                    # Generate a JSON response about the move's outcome
-                    result = {"success": error == "",
-                              "action": "remove_piece",
-                              "error": error,
-                              "next_player": game_manager.current_turn,
-                              "next_state": game_manager.game_state.name,
-                              "board_state": game_manager.board_state.tolist(),
-                              "removed_piece": piece_ID,
-                              "active_pieces": active_pieces}
-
-                # MOVE PIECE CASE
-                elif action == "move_piece":
-                    # Check that the request contains all the required keys
-                    required_keys = ("new_x", "new_y",
-                                     "piece_ID")
-                    if not all(key in params for key in required_keys):
-                        print("Couldn't load all the necessary parameters")
-                        continue
-
-                    # Pass the player's action to the game manager
-                    x, y, piece_ID, active_pieces, error = game_manager.move_piece(
-                        params["new_x"], params["new_y"], params["piece_ID"], player_num)
-
-                    # Generate a JSON response about the move's outcome
-                    result = {"success": error == "",
-                              "action": "move_piece",
-                              "board_state": game_manager.board_state.tolist(),
-                              "error": error,
-                              "next_player": game_manager.current_turn,
-                              "next_state": game_manager.game_state.name,
-                              "moved_piece": piece_ID,
-                              "new_x": x,
-                              "new_y": y,
-                              "active_pieces": active_pieces}
-
-                # INVALID ACTION CASE
+        restored += 1
+
+        # Local games share a single seat and CPU opponents pick up where they left off on their own
+        seats = [AbsentPlayer()]
+        seats.append(seats[0] if keys[0] == keys[1] else AbsentPlayer())
+
+        if cpu_num >= 0:
+            seats[cpu_num] = CPUPlayer()
+            seats[cpu_num].player_num = cpu_num
+
+        games[game_manager] = tuple(seats)
+        for player_num, seat in enumerate(seats):
+            if not isinstance(seat, CPUPlayer):
+                players[seat] = (game_manager, seats[1 - player_num], player_num)
+                rejoin_seats[keys[player_num]] = seat
+
+        sequence_numbers[game_manager] = seq
+        game_IDs[game_manager] = game_ID
+        player_keys[game_manager] = tuple(keys)
+        host_game(game_manager, game_ID)
+
+        # Take the game over in this process' own move log
+        game_store.save_game(game_ID, seq, game_manager.export_position(), (*keys, cpu_num))
+        log_record(pack_record(START_RECORD, game_ID, 0, *keys, cpu_num))
+        log_record(pack_record(SNAPSHOT_RECORD, game_ID, seq, *game_manager.export_position()))
+
+    await commit_moves()
+    if recovered_path is not None:
+        os.remove(recovered_path)
+
+    # Let the other workers send the players rejoining these games here
+    if coordinator is not None:
+        coordinator.send({"type": "rejoin_keys", "keys": list(rejoin_seats)})
+
+    log_event(logger, logging.INFO, "games_restored", games=restored, ended=len(recovered) - restored)
+
+
+# Gives up the seats of the restored games that nobody rejoined within rejoin_timeout seconds
+# An expired seat leaves its game like a player who disconnected
+async def expire_seats(seats: list):
+    await asyncio.sleep(rejoin_timeout)
+
+    expired = [seat for seat in dict.fromkeys(seats) if seat in players]
+    for seat in expired:
+        await disconnect(seat)
+
+    if expired:
+        log_event(logger, logging.INFO, "seats_expired", seats=len(expired))
+
+
+# Writes the game store's buffered saves every store_flush_interval seconds
+async def flush_store():
+    while True:
+        await asyncio.sleep(store_flush_interval)
+
+        try:
+            await asyncio.to_thread(game_store.flush)
+        except Exception:
+            log_event(logger, logging.ERROR, "store_flush_failed", exc_info=True)
+
+
+# Runs the API server
+# When it's one of several worker processes, the server shares the port with the other workers
+# and finds opponents through the coordinator listening on coordinator_path
+# The move logs left by the last run are merged by whoever starts the worker processes
+async def main(worker_ID=None, coordinator_path=None, cpu_workers=CPU_WORKERS, store_path=game_store_path,
+               log_dir=move_log_dir):
+    global cpu_pool, coordinator, game_store, move_log
+
+    log_listener = setup_logging(log_level, engine_log_level, log_sample_rate)
+
+    if coordinator_path is not None:
+        coordinator = await CoordinatorLink.connect(worker_ID, coordinator_path)
+        listener = asyncio.create_task(coordinator.listen())
+
+    # Each process appends to its own move log
+    recovered_path = None
+    if log_dir is not None:
+        if worker_ID is None:
+            compact_logs(log_dir)
+        log_name = "server.log" if worker_ID is None else f"worker-{worker_ID}.log"
+        move_log = MoveLog(os.path.join(log_dir, log_name))
+
+        if os.path.exists(os.path.join(log_dir, RECOVERED_LOG)):
+            recovered_path = os.path.join(log_dir, RECOVERED_LOG)
+
+    # Only one process restores the saved games so they aren't hosted twice
+    game_store = open_store(store_path)
+    seat_expiry = None
+    if worker_ID is None or worker_ID == 0:
+        await restore_games(recovered_path)
+
+        if rejoin_timeout is not None and rejoin_seats:
+            seat_expiry = asyncio.create_task(expire_seats(list(rejoin_seats.values())))
+
+    flusher = asyncio.create_task(flush_store())
+
+    # Every process serves its own metrics
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = await metrics.serve(metrics_address, metrics_port + (worker_ID or 0))
+
+    cpu_initializer = partial(init_worker, tablebase_path=CPU_TABLEBASE_PATH, opening_book_path=CPU_OPENING_BOOK_PATH)
+    with ProcessPoolExecutor(cpu_workers, initializer=cpu_initializer, initargs=(CPU_TIME_LIMIT,)) as cpu_pool:
+        # Start all the workers up front so the first CPU games don't have to wait for them
+        for _ in range(cpu_workers):
+            cpu_pool.submit(int)
+
+        async with websockets.serve(handler, server_address, server_port, reuse_port=coordinator is not None,
+                                    subprotocols=[BINARY_SUBPROTOCOL], select_subprotocol=select_protocol):
+            try:
+                # Worker processes shut down if they lose the coordinator
+                if coordinator is not None:
+                    await listener
                 else:
-                    result = {
-                        "success": False,
-                        "error": "Invalid action"
-                    }
+                    await asyncio.Future()
+            finally:
+                flusher.cancel()
+                if seat_expiry is not None:
+                    seat_expiry.cancel()
+                game_store.close()
 
-                # Notify the player of the move's outcome
-                await connection.send(json.dumps(result))
+                if metrics_server is not None:
+                    metrics_server.close()
 
-                # Notify the opponent if the move was successful and the opponent is on a different connection
-                if result["success"] and connection != opponent:
-                    await opponent.send(json.dumps(result))
+                log_listener.stop()
 
-                # Notify both players if the last move ended the game
-                if result["next_state"] == GameState.STOPPED:
-                    # Remove all references to the player websockets and the game manager
-                    result = await close_connection(connection, EndFlags.PLAYER_WON)
+                if move_log is not None:
+                    move_log.close()
 
-                    await connection.send(json.dumps(result))
 
-    except Exception as e:
-        print("Connection closed: ", e)
+def run_worker(worker_ID: int, coordinator_path: str, cpu_workers: int, store_path: str, log_dir: str):
+    asyncio.run(main(worker_ID, coordinator_path, cpu_workers, store_path, log_dir))
 
-        # Remove all references to the player websockets and the game manager
-        await close_connection(connection, EndFlags.PLAYER_DISCONNECTED)
 
+# Runs the matchmaking coordinator and starts the worker processes that host the games
+async def run_cluster(total_workers: int, store_path: str = game_store_path, log_dir: str = move_log_dir):
+    # Merge the logs of the last run before any worker starts writing its own
+    if log_dir is not None:
+        compact_logs(log_dir)
 
-async def main():
-    async with websockets.serve(handler, server_address, server_port):
-        await asyncio.Future()
+    coordinator_path = os.path.join(tempfile.mkdtemp(), "coordinator.sock")
+    server = await Coordinator(open_store(store_path)).serve(coordinator_path)
+
+    # Split the CPU opponents' search processes between the workers
+    cpu_workers = max(1, CPU_WORKERS // total_workers)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker,
+                               args=(worker_ID, coordinator_path, cpu_workers, store_path, log_dir))
+               for worker_ID in range(total_workers)]
+
+    for worker in workers:
+        worker.start()
+
+    try:
+        async with server:
+            await asyncio.Future()
+    finally:
+        for worker in workers:
+            worker.terminate()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    total_workers = int(sys.argv[1]) if len(sys.argv) > 1 else server_workers
+    store_path = sys.argv[2] if len(sys.argv) > 2 else game_store_path
+    log_dir = sys.argv[3] if len(sys.argv) > 3 else move_log_dir
+
+    if total_workers > 1:
+        asyncio.run(run_cluster(total_workers, store_path, log_dir))
+    else:
+        asyncio.run(main(store_path=store_path, log_dir=log_dir))
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import random
+
+from shax_store import GameStore, MemoryStore
+
+# Matchmaking coordinator for running the API as several worker processes that share the same port
+# The kernel spreads new connections over the workers, so two players looking for the same game type
+# can end up on different workers. The coordinator owns the waiting list of every worker and tells
+# the worker of the player that completes a match to host the game.
+# Workers talk to the coordinator (and to each other through it) with one JSON message per line.
+#
+# Messages from a worker:
+#   {"type": "hello", "worker": worker ID}
+#   {"type": "join", "conn": connection ID, "game_type": int, "joining_lobby": bool, "create_lobby": bool,
+#    "delta_updates": bool}
+#   {"type": "leave", "conn": connection ID}
+#   {"type": "rejoin_keys", "keys": [player key, ...]} (the seats of the games the worker restored)
+#   {"type": "rejoin", "conn": connection ID, "player_key": int}
+#   {"type": "open_game", "game_ID": int} / {"type": "close_game", "game_ID": int} (games hosted by the worker)
+#   {"type": "spectate", "conn": connection ID, "game_ID": int}
+#   {"type": "relay", "worker": worker ID, ...} (forwarded as-is to the given worker)
+#
+# Messages to a worker:
+#   {"type": "matched", "conn": connection ID, "opponent": [worker ID, connection ID], "opponent_delta": bool}
+#   {"type": "waiting", "conn": connection ID, "game_type": int}
+#   {"type": "invalid_lobby", "conn": connection ID}
+#   {"type": "hosted", "conn": connection ID, "host": worker ID}
+#   {"type": "host_reply", "conn": connection ID, "host": worker ID or null} (reply to rejoin and spectate)
+#   any relayed message
+class Coordinator:
+    def __init__(self, store: GameStore = None) -> None:
+        # Lobbies the players are waiting in
+        # Each waiting player is saved as a JSON list of [worker ID, connection ID, wants delta updates]
+        self.store: GameStore = MemoryStore() if store is None else store
+        self.store.clear_lobbies()
+
+        # (worker ID, connection ID) of a waiting player (key) -> Game type (value)
+        self.waiting_list: dict = {}
+
+        # Worker ID (key) -> Stream to the worker (value)
+        self.workers: dict = {}
+
+        # Player key (key) -> ID of the worker holding the player's seat in a restored game (value)
+        self.rejoin_keys: dict = {}
+
+        # Game ID (key) -> ID of the worker hosting the game (value)
+        self.game_hosts: dict = {}
+
+    async def serve(self, path: str):
+        return await asyncio.start_unix_server(self.handle_worker, path)
+
+    # Handles all the messages from one worker until it disconnects
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_ID = None
+
+        try:
+            async for line in reader:
+                message = json.loads(line)
+
+                if message["type"] == "hello":
+                    worker_ID = message["worker"]
+                    self.workers[worker_ID] = writer
+
+                elif message["type"] == "join":
+                    self.join(worker_ID, message)
+
+                elif message["type"] == "leave":
+                    self.leave((worker_ID, message["conn"]))
+
+                elif message["type"] == "rejoin_keys":
+                    for key in message["keys"]:
+                        self.rejoin_keys[key] = worker_ID
+
+                elif message["type"] == "rejoin":
+                    host = self.rejoin_keys.pop(message["player_key"], None)
+                    self.reply_host(worker_ID, message["conn"], host)
+
+                elif message["type"] == "open_game":
+                    self.game_hosts[message["game_ID"]] = worker_ID
+
+                elif message["type"] == "close_game":
+                    self.game_hosts.pop(message["game_ID"], None)
+
+                elif message["type"] == "spectate":
+                    self.reply_host(worker_ID, message["conn"], self.game_hosts.get(message["game_ID"]))
+
+                elif message["type"] == "relay":
+                    self.send(message["worker"], message)
+
+        finally:
+            # Drop the worker's waiting players since their connections are gone
+            self.workers.pop(worker_ID, None)
+            for player in [player for player in self.waiting_list if player[0] == worker_ID]:
+                self.leave(player)
+
+            for game_ID in [game_ID for game_ID, host in self.game_hosts.items() if host == worker_ID]:
+                self.game_hosts.pop(game_ID)
+
+    # Finds an opponent for a player or adds them to the waiting list
+    def join(self, worker_ID, message: dict):
+        conn_ID = message["conn"]
+        game_type = message["game_type"]
+
+        # Start a game if another player is waiting for the same game type
+        # The worker of the player completing the match hosts the game
+        opponent = self.store.take_lobby(game_type)
+        if opponent is not None:
+            opponent_worker, opponent_conn, opponent_delta = json.loads(opponent)
+            self.waiting_list.pop((opponent_worker, opponent_conn))
+
+            # Let the waiting player's worker know where their game is being hosted
+            if opponent_worker != worker_ID:
+                self.send(opponent_worker, {"type": "hosted", "conn": opponent_conn, "host": worker_ID})
+
+            self.send(worker_ID, {"type": "matched",
+                                  "conn": conn_ID,
+                                  "opponent": [opponent_worker, opponent_conn],
+                                  "opponent_delta": opponent_delta})
+
+        # Private lobbies can only be joined if someone created them
+        elif message["joining_lobby"]:
+            self.send(worker_ID, {"type": "invalid_lobby", "conn": conn_ID})
+
+        # Otherwise, add the player to the waiting list
+        else:
+            # Add a random "lobby key" to the front of the game type if the player wants a private lobby
+            if message["create_lobby"]:
+                lobby_key = random.randint(2**16, 2**32)
+                game_type = (lobby_key << 16) | (game_type & 0xFFFF)
+
+            self.store.add_lobby(game_type, json.dumps([worker_ID, conn_ID, message["delta_updates"]]))
+            self.waiting_list[(worker_ID, conn_ID)] = game_type
+
+            self.send(worker_ID, {"type": "waiting", "conn": conn_ID, "game_type": game_type})
+
+    # Tells the worker of a player which worker hosts the game they're rejoining or spectating
+    def reply_host(self, worker_ID, conn_ID, host):
+        # The player's own worker already checked its own games
+        if host == worker_ID or host not in self.workers:
+            host = None
+
+        self.send(worker_ID, {"type": "host_reply", "conn": conn_ID, "host": host})
+
+    # Removes a player from the waiting list
+    def leave(self, player):
+        game_type = self.waiting_list.pop(player, None)
+        if game_type is not None:
+            self.store.remove_lobby(game_type)
+
+    def send(self, worker_ID, message: dict):
+        writer = self.workers.get(worker_ID)
+        if writer is not None:
+            writer.write(json.dumps(message).encode() + b"\n")
@@ -0,0 +1,330 @@
+import numpy as np
+
+from shax_engine.bitboard import ADJACENT_NODES, FULL_MASK, TOTAL_NODES
+from shax_engine.board_manager import GameState
+
+# Plays many games at once with the same rules as BoardManager
+# Every game is a row of a structured NumPy array, and each step plays one move in every game
+# with array operations instead of a method call per move. Piece IDs aren't tracked since the rules don't need them.
+# Used for the MCTS opponent's playouts and for self-play (see self_play.py)
+
+# Fields of each game
+# occupancy: player number -> mask of the nodes their pieces are on
+# total_pieces: player number -> pieces the player has placed and not lost yet
+# current_jare: player number -> jare the player had after their last placement or move (as in BoardManager)
+# first_to_jare: player who made the first jare in the placement stage (-1 for no one)
+# game_state: GameState value
+GAME_DTYPE = np.dtype([("occupancy", np.uint32, (2,)),
+                       ("total_pieces", np.int8, (2,)),
+                       ("current_jare", np.int8, (2,)),
+                       ("first_to_jare", np.int8),
+                       ("game_state", np.int8),
+                       ("current_turn", np.int8)])
+
+# Every way a piece can slide as (node it leaves, node it arrives at)
+EDGES: list = [(node, neighbor) for node, neighbors in enumerate(ADJACENT_NODES) for neighbor in neighbors]
+EDGE_FROM = np.array([edge[0] for edge in EDGES], dtype=np.intp)
+EDGE_TO = np.array([edge[1] for edge in EDGES], dtype=np.intp)
+
+# Moves are numbered per game: by the node they're played on in the placement and removal stages
+# and by their index in EDGES in the movement stage
+MOVE_SLOTS = max(TOTAL_NODES, len(EDGES))
+
+# No move (for games that are over or stuck)
+NO_MOVE = -1
+
+# Code of NO_MOVE in encode_moves() (BoardManager.encode_move() never returns 0)
+NO_MOVE_CODE = 0
+
+_NODE_SHIFTS = np.arange(TOTAL_NODES, dtype=np.uint32)
+_NODE_BITS = np.uint32(1) << _NODE_SHIFTS
+_FULL_MASK = np.uint32(FULL_MASK)
+
+# Node (row) -> 1 for each of its neighbors (column)
+_ADJACENCY = np.zeros((TOTAL_NODES, TOTAL_NODES), dtype=np.float32)
+for _node, _neighbors in enumerate(ADJACENT_NODES):
+    _ADJACENCY[_node, _neighbors] = 1
+
+_PLACEMENT = GameState.PLACEMENT.value
+_FIRST_REMOVAL = GameState.FIRST_REMOVAL.value
+_REMOVAL = GameState.REMOVAL.value
+_MOVEMENT = GameState.MOVEMENT.value
+_STOPPED = GameState.STOPPED.value
+
+# Move number -> BoardManager.encode_move() code, for each stage
+_PLACE_CODES = (np.arange(TOTAL_NODES) + 1) << 5
+_REMOVE_CODES = np.arange(TOTAL_NODES) + 1
+_MOVE_CODES = (EDGE_FROM + 1) | ((EDGE_TO + 1) << 5)
+
+# Movement code -> index in EDGES (NO_MOVE for codes that aren't an edge)
+_CODE_EDGES = np.full(1 << 10, NO_MOVE)
+_CODE_EDGES[_MOVE_CODES] = np.arange(len(EDGES))
+
+
+# Expands each mask into a row of bools, one for each node
+def node_masks(masks):
+    return ((masks[:, None] >> _NODE_SHIFTS) & 1).astype(bool)
+
+
+# Counts the jare in each mask with the same neighbor scan as bitboard.count_jare(),
+# stepping through the nodes once for the whole batch
+def count_jare(masks):
+    masks = np.asarray(masks, dtype=np.uint32)
+    pieces_in_jare = np.zeros_like(masks)
+    total_jare = np.zeros(len(masks), dtype=np.int8)
+
+    for node, neighbors in enumerate(ADJACENT_NODES):
+        free_allies = masks & ~pieces_in_jare
+        scanning = ((free_allies >> node) & 1) == 1
+
+        # Bit of the first free neighbor found next to the piece (0 until there is one)
+        neighboring_ally = np.zeros_like(masks)
+        for neighbor in neighbors:
+            is_ally = scanning & (((free_allies >> neighbor) & 1) == 1)
+            made_jare = is_ally & (neighboring_ally != 0)
+
+            pieces_in_jare |= np.where(made_jare, _NODE_BITS[node] | _NODE_BITS[neighbor] | neighboring_ally, 0)
+            total_jare += made_jare
+            scanning &= ~made_jare
+            neighboring_ally = np.where(is_ally & (neighboring_ally == 0), _NODE_BITS[neighbor], neighboring_ally)
+
+    return total_jare
+
+
+# Turns the move played in each game into the code BoardManager.encode_move() gives it
+# game_states are the GameState values of the games before the moves are played
+def encode_moves(game_states, moves):
+    game_states = np.asarray(game_states)
+    moves = np.asarray(moves)
+    slots = np.maximum(moves, 0)
+
+    removing = (game_states == _FIRST_REMOVAL) | (game_states == _REMOVAL)
+    codes = np.select([game_states == _PLACEMENT, removing, game_states == _MOVEMENT],
+                      [_PLACE_CODES[np.minimum(slots, TOTAL_NODES - 1)],
+                       _REMOVE_CODES[np.minimum(slots, TOTAL_NODES - 1)],
+                       _MOVE_CODES[np.minimum(slots, len(EDGES) - 1)]], NO_MOVE_CODE)
+
+    return np.where(moves == NO_MOVE, NO_MOVE_CODE, codes)
+
+
+# Turns BoardManager.encode_move() codes back into each game's move numbers (the reverse of encode_moves())
+def decode_moves(game_states, codes):
+    game_states = np.asarray(game_states)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    removing = (game_states == _FIRST_REMOVAL) | (game_states == _REMOVAL)
+    moves = np.select([game_states == _PLACEMENT, removing, game_states == _MOVEMENT],
+                      [(codes >> 5) - 1, (codes & 0b11111) - 1, _CODE_EDGES[codes & 0b1111111111]], NO_MOVE)
+
+    return np.where(codes == NO_MOVE_CODE, NO_MOVE, moves)
+
+
+class BatchBoard:
+    # Starts total_games new games
+    def __init__(self, total_games, min_pieces=2, max_pieces=12) -> None:
+        # Same limits as BoardManager
+        self.MIN_PIECES = max(3, min_pieces)
+        self.MAX_PIECES = min(12, max_pieces)
+
+        self.games = np.zeros(total_games, GAME_DTYPE)
+        self.games["first_to_jare"] = -1
+        self.games["game_state"] = _PLACEMENT
+
+    # Creates a batch with a game in each of the positions returned by BoardManager.export_position()
+    # The positions have to come from games with the same piece limits
+    @classmethod
+    def from_positions(cls, positions):
+        positions = np.array(positions, dtype=np.int64).reshape(len(positions), -1)
+        if (positions[:, :2] != positions[0, :2]).any():
+            raise ValueError("The positions don't all have the same piece limits")
+
+        batch = cls(len(positions), positions[0, 0], positions[0, 1])
+        games = batch.games
+        games["current_turn"] = positions[:, 2]
+        games["game_state"] = positions[:, 3]
+        games["first_to_jare"] = positions[:, 4]
+        games["current_jare"] = positions[:, 5:7]
+
+        # The owner of a piece is stored in the lowest bit of its ID
+        node_pieces = positions[:, 7:]
+        for player_num in range(2):
+            owned = (node_pieces >= 0) & ((node_pieces & 1) == player_num)
+            pieces = (owned * _NODE_BITS).sum(axis=1).astype(np.uint32)
+
+            games["occupancy"][:, player_num] = pieces
+            games["total_pieces"][:, player_num] = owned.sum(axis=1)
+
+        return batch
+
+    def __len__(self):
+        return len(self.games)
+
+    # Returns a (games, MOVE_SLOTS) array of bools marking the legal moves of each game's current player
+    def legal_moves_mask(self):
+        games = self.games
+        rows = np.arange(len(games))
+        turn = games["current_turn"].astype(np.intp)
+        state = games["game_state"]
+
+        own = games["occupancy"][rows, turn]
+        other = games["occupancy"][rows, 1 - turn]
+        empty = _FULL_MASK & ~(own | other)
+
+        mask = np.zeros((len(games), MOVE_SLOTS), dtype=bool)
+
+        placing = state == _PLACEMENT
+        mask[placing, :TOTAL_NODES] = node_masks(empty[placing])
+
+        # Any of the opponent's pieces can be removed
+        removing = (state == _FIRST_REMOVAL) | (state == _REMOVAL)
+        mask[removing, :TOTAL_NODES] = node_masks(other[removing])
+
+        moving = state == _MOVEMENT
+        mask[moving, :len(EDGES)] = node_masks(own[moving])[:, EDGE_FROM] & node_masks(empty[moving])[:, EDGE_TO]
+
+        return mask
+
+    # Picks a uniformly random legal move in each game (NO_MOVE for games without one)
+    def random_moves(self, rng: np.random.Generator):
+        mask = self.legal_moves_mask()
+
+        weights = rng.random(mask.shape)
+        weights[~mask] = -1
+        moves = weights.argmax(axis=1)
+        moves[~mask.any(axis=1)] = NO_MOVE
+
+        return moves
+
+    # Returns the BoardManager.encode_move() code of the move in each game (NO_MOVE_CODE for NO_MOVE)
+    def encode_moves(self, moves):
+        return encode_moves(self.games["game_state"], moves)
+
+    # Returns the move numbers of the BoardManager.encode_move() codes in each game
+    def decode_moves(self, codes):
+        return decode_moves(self.games["game_state"], codes)
+
+    # Plays a move in each game, without checking if it's legal (games given NO_MOVE are left as they are)
+    def apply(self, moves):
+        moves = np.asarray(moves)
+        state = self.games["game_state"]
+        playing = moves != NO_MOVE
+
+        # Sort the games by stage before any of them change stage
+        placing = np.flatnonzero(playing & (state == _PLACEMENT))
+        removing = np.flatnonzero(playing & ((state == _FIRST_REMOVAL) | (state == _REMOVAL)))
+        moving = np.flatnonzero(playing & (state == _MOVEMENT))
+
+        self._place(placing, moves[placing])
+        self._remove(removing, moves[removing])
+        self._move(moving, moves[moving])
+
+    # Plays random moves in every game until they're all over or stuck, or max_plies moves were played
+    # Returns how many moves were played in total
+    def play_randomly(self, rng: np.random.Generator, max_plies: int):
+        total_moves = 0
+        for _ in range(max_plies):
+            moves = self.random_moves(rng)
+            playing = np.count_nonzero(moves != NO_MOVE)
+            if not playing:
+                break
+
+            self.apply(moves)
+            total_moves += playing
+
+        return total_moves
+
+    # Returns the winner of each game (-1 for games that aren't over)
+    # A game ends when one of the players is down to MIN_PIECES, which makes the other player the winner
+    def winners(self):
+        lost = self.games["total_pieces"] <= self.MIN_PIECES
+        return np.where(self.games["game_state"] == _STOPPED, np.where(lost[:, 0], 1, 0), -1)
+
+    # ***************************** HELPER FUNCTIONS ***************************************
+    # Recounts the jare of each player after they placed or moved a piece
+    # Returns which of them made a new jare
+    def _update_jare(self, rows, players, pieces):
+        current_jare = self.games["current_jare"]
+        total_jare = count_jare(pieces)
+
+        made_jare = total_jare > current_jare[rows, players]
+        current_jare[rows, players] = total_jare
+        return made_jare
+
+    # Checks which of the players have a piece with an empty node next to it
+    def _can_move(self, rows, players):
+        occupancy = self.games["occupancy"][rows]
+        empty = node_masks(_FULL_MASK & ~(occupancy[:, 0] | occupancy[:, 1]))
+        next_to_empty = (empty.astype(np.float32) @ _ADJACENCY) > 0
+
+        own = node_masks(occupancy[np.arange(len(rows)), players])
+        return (own & next_to_empty).any(axis=1)
+
+    # Places a new piece for the current player of each game on the node
+    def _place(self, rows, nodes):
+        if not len(rows):
+            return
+
+        games = self.games
+        turn = games["current_turn"][rows].astype(np.intp)
+
+        pieces = games["occupancy"][rows, turn] | _NODE_BITS[nodes]
+        games["occupancy"][rows, turn] = pieces
+        games["total_pieces"][rows, turn] += 1
+
+        # Remember who made the first jare
+        made_jare = self._update_jare(rows, turn, pieces)
+        first_to_jare = games["first_to_jare"][rows]
+        first_to_jare = np.where(made_jare & (first_to_jare < 0), turn, first_to_jare)
+        games["first_to_jare"][rows] = first_to_jare
+
+        # Go on to the first removal stage once all the pieces have been placed
+        # It's started by whoever made the first jare (player 2 if no one did)
+        placed = games["total_pieces"][rows].min(axis=1) >= self.MAX_PIECES
+        games["game_state"][rows[placed]] = _FIRST_REMOVAL
+        games["current_turn"][rows] = np.where(placed, np.where(first_to_jare >= 0, first_to_jare, 1), 1 - turn)
+
+    # Removes the opponent's piece on the node in each game
+    def _remove(self, rows, nodes):
+        if not len(rows):
+            return
+
+        games = self.games
+        turn = games["current_turn"][rows].astype(np.intp)
+        owner = 1 - turn
+
+        pieces = games["occupancy"][rows, owner] & ~_NODE_BITS[nodes]
+        games["occupancy"][rows, owner] = pieces
+        games["total_pieces"][rows, owner] -= 1
+
+        state = games["game_state"][rows]
+        game_over = (games["total_pieces"][rows] <= self.MIN_PIECES).any(axis=1)
+
+        # Both players remove a piece in the first removal stage before going on to the movement stage,
+        # and the player who made a jare keeps their turn after removing a piece in the movement stage
+        first_removal = ~game_over & (state == _FIRST_REMOVAL)
+        next_turn = np.where(first_removal, owner, turn)
+        first_to_jare = games["first_to_jare"][rows]
+        removals_done = ((first_to_jare < 0) & (next_turn == 1)) | (next_turn == first_to_jare)
+
+        to_movement = ~game_over & ((state == _REMOVAL) | (first_removal & removals_done))
+        games["game_state"][rows] = np.where(game_over, _STOPPED, np.where(to_movement, _MOVEMENT, state))
+        games["current_turn"][rows] = next_turn
+
+    # Slides one of the current player's pieces along the edge in each game
+    def _move(self, rows, edges):
+        if not len(rows):
+            return
+
+        games = self.games
+        turn = games["current_turn"][rows].astype(np.intp)
+
+        pieces = games["occupancy"][rows, turn] ^ (_NODE_BITS[EDGE_FROM[edges]] | _NODE_BITS[EDGE_TO[edges]])
+        games["occupancy"][rows, turn] = pieces
+
+        # Players that made a new jare get to remove a piece
+        made_jare = self._update_jare(rows, turn, pieces)
+        games["game_state"][rows[made_jare]] = _REMOVAL
+
+        # Otherwise it's the other player's turn, unless they can't move any of their pieces
+        can_move = self._can_move(rows, 1 - turn)
+        games["current_turn"][rows] = np.where(~made_jare & can_move, 1 - turn, turn)
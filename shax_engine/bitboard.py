@@ -0,0 +1,186 @@
+import numpy as np
+
+# Adjacency list for keeping track of all the nodes the pieces can be placed in
+# TODO: find a better word than "nodes" and maybe rename this variable
+ADJACENT_PIECES: dict = {  # Outer Square Nodes
+    (0, 0): [(0, 3), (3, 0)],
+    (0, 3): [(0, 0), (1, 3), (0, 6)],
+    (0, 6): [(0, 3), (3, 6)],
+    (3, 6): [(0, 6), (3, 5), (6, 6)],
+    (6, 6): [(3, 6), (6, 3)],
+    (6, 3): [(6, 6), (5, 3), (6, 0)],
+    (6, 0): [(6, 3), (3, 0)],
+    (3, 0): [(6, 0), (3, 1), (0, 0)],
+
+    (1, 1): [(1, 3), (3, 1)],
+    (1, 3): [(1, 1), (2, 3), (0, 3), (1, 5)],
+    (1, 5): [(1, 3), (3, 5)],
+    (3, 5): [(1, 5), (3, 4), (3, 6), (5, 5)],
+    (5, 5): [(3, 5), (5, 3)],
+    (5, 3): [(5, 5), (4, 3), (6, 3), (5, 1)],
+    (5, 1): [(5, 3), (3, 1)],
+    (3, 1): [(5, 1), (3, 2), (3, 0), (1, 1)],
+
+    (2, 2): [(3, 2), (2, 3)],
+    (2, 3): [(2, 2), (1, 3), (2, 4)],
+    (2, 4): [(2, 3), (3, 4)],
+    (3, 4): [(2, 4), (3, 5), (4, 4)],
+    (4, 4): [(3, 4), (4, 3)],
+    (4, 3): [(4, 4), (5, 3), (4, 2)],
+    (4, 2): [(4, 3), (3, 2)],
+    (3, 2): [(4, 2), (3, 1), (2, 2)]
+}
+
+# The length/width of the board's grid
+BOARD_SIZE = 7
+
+# Every playable node as an (x, y) coordinate
+# Sorted by row and then column so that walking the bits of a mask from lowest to highest
+# visits the nodes in the same order as np.where() does on the 7x7 board
+NODES: list = sorted(ADJACENT_PIECES, key=lambda node: (node[1], node[0]))
+
+# (x, y) coordinate -> bit index of the node
+NODE_INDEX: dict = {node: i for i, node in enumerate(NODES)}
+
+TOTAL_NODES = len(NODES)
+
+# Mask with a bit set for every playable node
+FULL_MASK = (1 << TOTAL_NODES) - 1
+
+# Bit index of a node -> bit indices of its neighbors (in the same order as ADJACENT_PIECES)
+ADJACENT_NODES: list = [[NODE_INDEX[neighbor] for neighbor in ADJACENT_PIECES[node]]
+                        for node in NODES]
+
+# Bit index of a node -> mask of its neighbors
+ADJACENT_MASKS: list = [sum(1 << neighbor for neighbor in neighbors)
+                        for neighbors in ADJACENT_NODES]
+
+# The 8 rotations and reflections of the board, each as bit index of a node -> bit index of the node it's moved to
+# They map every node's neighbors to the new node's neighbors, but count_jare() walks the nodes in a fixed order,
+# so a turned board can count a player's jare differently once they have a few pieces next to each other
+SYMMETRIES: list = [[NODE_INDEX[transform(x, y)] for x, y in NODES] for transform in (
+    lambda x, y: (x, y),
+    lambda x, y: (BOARD_SIZE - 1 - y, x),
+    lambda x, y: (BOARD_SIZE - 1 - x, BOARD_SIZE - 1 - y),
+    lambda x, y: (y, BOARD_SIZE - 1 - x),
+    lambda x, y: (BOARD_SIZE - 1 - x, y),
+    lambda x, y: (x, BOARD_SIZE - 1 - y),
+    lambda x, y: (y, x),
+    lambda x, y: (BOARD_SIZE - 1 - y, BOARD_SIZE - 1 - x))]
+
+
+# Yields the index of every set bit in the mask, from lowest to highest
+def iter_bits(mask: int):
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+# Counts the jare in the pieces the same way the original board scan did:
+# walking the pieces in node order, a piece that isn't in a jare yet makes one with the first two of its neighbors
+# (in adjacency list order) that aren't in a jare yet either
+def count_jare(pieces: int):
+    pieces_in_jare = 0
+    total_jare = 0
+
+    for node in iter_bits(pieces):
+        # Checks if the piece is already in another "jare"
+        if (pieces_in_jare >> node) & 1:
+            continue
+
+        free_allies = pieces & ~pieces_in_jare
+        neighboring_ally = None
+        for neighbor in ADJACENT_NODES[node]:
+            if not (free_allies >> neighbor) & 1:
+                continue
+
+            if neighboring_ally is None:
+                neighboring_ally = neighbor
+            else:
+                total_jare += 1
+
+                # Record all the pieces that make up this jare
+                pieces_in_jare |= (1 << node) | (1 << neighbor) | (1 << neighboring_ally)
+                break
+
+    return total_jare
+
+
+# Returns the mask of the pieces that are connected to any of the seed nodes through neighboring pieces
+def connected_pieces(pieces: int, seeds: int):
+    found = pieces & seeds
+    frontier = found
+    while frontier:
+        reach = 0
+        for node in iter_bits(frontier):
+            reach |= ADJACENT_MASKS[node]
+
+        frontier = reach & pieces & ~found
+        found |= frontier
+
+    return found
+
+
+# Returns how much count_jare() changes when a player's pieces go from before to after
+# A jare is always made of connected pieces, so the count is the sum of the counts of each group of connected pieces
+# and only the groups touching (or next to) the nodes that changed need to be scanned again
+def jare_change(before: int, after: int):
+    changed = before ^ after
+    seeds = changed
+    for node in iter_bits(changed):
+        seeds |= ADJACENT_MASKS[node]
+
+    region = connected_pieces(before, seeds) | connected_pieces(after, seeds)
+    return count_jare(after & region) - count_jare(before & region)
+
+
+# Stores the pieces on the board as one occupancy mask per player
+# plus a table mapping each node to the ID of the piece sitting on it
+class BitBoard:
+    def __init__(self, total_players=2) -> None:
+        # Player number -> mask of the nodes their pieces are on
+        self.occupancy: list = [0] * total_players
+
+        # Bit index of a node -> ID of the piece on it (-1 if it's empty)
+        self.node_pieces: list = [-1] * TOTAL_NODES
+
+        # ID of a piece on the board -> bit index of the node it's on
+        self.piece_nodes: dict = {}
+
+    # Returns a mask of all the nodes that don't have a piece on them
+    def empty_mask(self):
+        occupied = 0
+        for mask in self.occupancy:
+            occupied |= mask
+
+        return FULL_MASK & ~occupied
+
+    # Puts a piece on an empty node
+    def place(self, node, piece_ID, player_num):
+        self.occupancy[player_num] |= 1 << node
+        self.node_pieces[node] = piece_ID
+        self.piece_nodes[piece_ID] = node
+
+    # Takes whatever piece is on the node off the board
+    def clear(self, node, player_num):
+        self.occupancy[player_num] &= ~(1 << node)
+        del self.piece_nodes[self.node_pieces[node]]
+        self.node_pieces[node] = -1
+
+    # Slides a piece from one node to another
+    def move(self, old_node, new_node, player_num):
+        self.occupancy[player_num] ^= (1 << old_node) | (1 << new_node)
+        piece_ID = self.node_pieces[old_node]
+        self.node_pieces[new_node] = piece_ID
+        self.node_pieces[old_node] = -1
+        self.piece_nodes[piece_ID] = new_node
+
+    # Builds the 7x7 grid used by the API
+    # None marks cells that aren't on the board and -1 marks empty nodes
+    def to_array(self):
+        board = np.full((BOARD_SIZE, BOARD_SIZE), None, dtype=object)
+        for (x, y), piece_ID in zip(NODES, self.node_pieces):
+            board[y][x] = piece_ID
+
+        return board
@@ -1,5 +1,11 @@
 from enum import Enum
-import numpy as np
+import logging
+
+from shax_engine.bitboard import (ADJACENT_MASKS, ADJACENT_NODES, ADJACENT_PIECES, BOARD_SIZE,
+                                  NODE_INDEX, NODES, BitBoard, count_jare, iter_bits, jare_change)
+from shax_engine.zobrist import FIRST_TO_JARE_KEYS, JARE_KEYS, PIECE_KEYS, STATE_KEYS, TURN_KEYS
+
+logger = logging.getLogger(__name__)
 
 # Enum for tracking what state the game is in
 # TODO: Come up with a better name for the 'MOVEMENT' game state
@@ -26,7 +32,7 @@ class BoardManager:
         self.MAX_PIECES: int = min(12, max_pieces)
 
         # The length/width of the board's grid
-        self.BOARD_SIZE = 7
+        self.BOARD_SIZE = BOARD_SIZE
 
         # Total number of players
         self.TOTAL_PLAYERS = 2
@@ -39,35 +45,7 @@ class BoardManager:
         self.ID_SHIFT = 1
 
         # Adjacency list for keeping track of all the nodes the pieces can be placed in
-        # TODO: find a better word than "nodes" and maybe rename this variable
-        self.adjacent_pieces: dict = {  # Outer Square Nodes
-            (0, 0): [(0, 3), (3, 0)],
-            (0, 3): [(0, 0), (1, 3), (0, 6)],
-            (0, 6): [(0, 3), (3, 6)],
-            (3, 6): [(0, 6), (3, 5), (6, 6)],
-            (6, 6): [(3, 6), (6, 3)],
-            (6, 3): [(6, 6), (5, 3), (6, 0)],
-            (6, 0): [(6, 3), (3, 0)],
-            (3, 0): [(6, 0), (3, 1), (0, 0)],
-
-            (1, 1): [(1, 3), (3, 1)],
-            (1, 3): [(1, 1), (2, 3), (0, 3), (1, 5)],
-            (1, 5): [(1, 3), (3, 5)],
-            (3, 5): [(1, 5), (3, 4), (3, 6), (5, 5)],
-            (5, 5): [(3, 5), (5, 3)],
-            (5, 3): [(5, 5), (4, 3), (6, 3), (5, 1)],
-            (5, 1): [(5, 3), (3, 1)],
-            (3, 1): [(5, 1), (3, 2), (3, 0), (1, 1)],
-
-            (2, 2): [(3, 2), (2, 3)],
-            (2, 3): [(2, 2), (1, 3), (2, 4)],
-            (2, 4): [(2, 3), (3, 4)],
-            (3, 4): [(2, 4), (3, 5), (4, 4)],
-            (4, 4): [(3, 4), (4, 3)],
-            (4, 3): [(4, 4), (5, 3), (4, 2)],
-            (4, 2): [(4, 3), (3, 2)],
-            (3, 2): [(4, 2), (3, 1), (2, 2)]
-        }
+        self.adjacent_pieces: dict = ADJACENT_PIECES
 
     # Starts a game between two players
     # Initializes all the variables that keep track of the state of the game
@@ -75,28 +53,32 @@ class BoardManager:
         # Set which player goes first
         self.current_turn = 0
 
-        # Load the starting state of the board
-        self.board_state = np.array([[-1,     None,    None,    -1,      None,    None,    -1],
-                                     [None,   -1,      None,    -1,      None,    -1,      None],
-                                     [None,   None,    -1,      -1,      -1,      None,    None],
-                                     [-1,     -1,      -1,      None,    -1,      -1,      -1],
-                                     [None,   None,    -1,      -1,      -1,      None,    None],
-                                     [None,   -1,      None,    -1,      None,    -1,      None],
-                                     [-1,     None,    None,    -1,      None,    None,    -1]])
+        # Load the starting state of the board (no pieces on any node)
+        self.board = BitBoard(self.TOTAL_PLAYERS)
 
-        # Array for keeping track of how many pieces each player has
-        self.total_pieces = np.zeros(self.TOTAL_PLAYERS, np.int8)
+        # List for keeping track of how many pieces each player has
+        self.total_pieces = [0] * self.TOTAL_PLAYERS
 
         # Tracks the ID of the player who first made a jare in the placement stage
         # Determines which player goes first in the "first_removal" stage
         self.first_to_jare = None
 
-        # Array containing the total number of "jare" each player has made
-        self.current_jare = np.zeros(self.TOTAL_PLAYERS, np.int8)
+        # List containing the total number of "jare" each player has made
+        # Only updated when the player places or moves a piece, so it isn't lowered when one of their pieces is removed
+        self.current_jare = [0] * self.TOTAL_PLAYERS
+
+        # List containing the number of "jare" each player has on the board right now
+        self.board_jare = [0] * self.TOTAL_PLAYERS
+
+        # Records of the moves played with apply() that haven't been undone yet
+        self.undo_stack = []
 
         # Start the game off in the placement stage
         self.game_state = GameState.PLACEMENT
 
+        # Zobrist hash of the position (starts with an empty board)
+        self._position_hash = self._get_state_key()
+
         self.game_running = True
 
         return self.current_turn
@@ -124,43 +106,13 @@ class BoardManager:
             error = "Can't place piece at an invalid node"
             return [new_ID, x, y, active_pieces, error]
 
-        # *** 2) UPDATE THE BOARD VARIABLES BASED ON THE PLAYER"S MOVE
-        # Generate an ID for the new game piece
-        new_ID = int((self.total_pieces[self.current_turn]
-                          << self.ID_SHIFT) | self.current_turn)
-
-        # Update the board's state with the new game piece
-        self.board_state[y][x] = new_ID
-
-        # Update the player's total number of pieces
-        self.total_pieces[self.current_turn] += 1
-
-        # *** 3) VERIFY IF ANY SPECIAL CONDITIONS HAVE BEEN MET
-        # Check if the first jare has been made yet
-        if self._made_new_jare() and self.first_to_jare is None:
-            self.first_to_jare = self.current_turn
-
-        # *** 4) PREPARE THE BOARD FOR THE NEXT TURN
-        # If all the pieces have been placed,
-        # go on to the first removal state of the game
-        if np.all(self.total_pieces >= self.MAX_PIECES):
-            self.game_state = GameState.FIRST_REMOVAL
-
-            if self.first_to_jare != None:
-                self.current_turn = self.first_to_jare
-
-            # If no one made a jare in the placement stage, player 2 goes first
-            else:
-                self.current_turn = 1
+        # *** 2) UPDATE THE BOARD BASED ON THE PLAYER'S MOVE
+        new_ID = self._place(NODE_INDEX[valid_spot])
 
-            active_pieces = self._get_removable_pieces()
-
-        # Otherwise, go to the next player's turn
-        else:
-            self.current_turn = (self.current_turn + 1) % self.TOTAL_PLAYERS
-
-        # *** 5) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
-        return [new_ID, x, y, active_pieces, error]
+        # *** 3) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
+        # Report the node the piece went on rather than the coordinates the player sent
+        active_pieces = self.get_active_pieces()
+        return [new_ID, valid_spot[0], valid_spot[1], active_pieces, error]
 
     # Removes a game piece from the board
     def remove_piece(self, piece_ID, player_num):
@@ -179,7 +131,8 @@ class BoardManager:
             return [piece_ID, active_pieces, error]
 
         # Checks if the piece exists
-        if piece_ID not in self.board_state:
+        node = self.board.piece_nodes.get(piece_ID)
+        if node is None:
             error = "The piece to be removed doesn't exist"
             return [piece_ID, active_pieces, error]
 
@@ -190,38 +143,11 @@ class BoardManager:
             error = "This piece belongs to the current player"
             return [piece_ID, active_pieces, error]
 
-        # *** 2) UPDATE THE BOARD VARIABLES BASED ON THE PLAYER"S MOVE
-        # Remove the piece from the board
-        self.board_state[self.board_state == piece_ID] = -1
-
-        # Update the remaining pieces of the other player
-        self.total_pieces[piece_owner] -= 1
-
-        # *** 3) VERIFY IF ANY SPECIAL CONDITIONS HAVE BEEN MET
-        # End the game if one of the players won
-        if (self._is_game_over()):
-            self.game_state = GameState.STOPPED
-            return [piece_ID, active_pieces, error]
-
-        # *** 4) PREPARE THE BOARD FOR THE NEXT TURN
-        # If this is the very first removal stage,
-        # every player must have a chance to remove a piece before going on to the movement stage
-        # TODO: combine these conditions better
-        if self.game_state == GameState.FIRST_REMOVAL:
-            self.current_turn = (self.current_turn + 1) % self.TOTAL_PLAYERS
-
-            if (self.first_to_jare is None and self.current_turn == 1) or \
-                    (self.current_turn == self.first_to_jare):
-                self.game_state = GameState.MOVEMENT
-                active_pieces = self._get_active_pieces()
-            else:
-                active_pieces = self._get_removable_pieces()
+        # *** 2) UPDATE THE BOARD BASED ON THE PLAYER'S MOVE
+        self._remove(node)
 
-        else:
-            self.game_state = GameState.MOVEMENT
-            active_pieces = self._get_active_pieces()
-
-        # *** 5) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
+        # *** 3) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
+        active_pieces = self.get_active_pieces()
         return [piece_ID, active_pieces, error]
 
     # Moves a game piece from one spot to another
@@ -246,53 +172,348 @@ class BoardManager:
             error = "Can't move the piece to an invalid spot"
             return [x, y, piece_ID, active_pieces, error]
 
-        # Get the old coordinates of the game piece
-        old_x, old_y = self._piece_ID_to_coord(piece_ID)
+        # Checks if the piece exists
+        old_node = self.board.piece_nodes.get(piece_ID)
+        if old_node is None:
+            error = "The piece to be moved doesn't exist"
+            return [x, y, piece_ID, active_pieces, error]
+
+        # Checks if the piece belongs to the current player
+        if piece_ID & (2**self.ID_SHIFT - 1) != self.current_turn:
+            error = "This piece belongs to the other player"
+            return [x, y, piece_ID, active_pieces, error]
 
         # Check if the new spot is adjacent to the old spot
-        is_adjacent = valid_spot in self.adjacent_pieces[(old_x, old_y)]
+        is_adjacent = valid_spot in self.adjacent_pieces[NODES[old_node]]
 
         if not is_adjacent:
             error = "Can't move the piece to a nonadjacent spot"
             return [x, y, piece_ID, active_pieces, error]
 
-        # *** 2) UPDATE THE BOARD VARIABLES BASED ON THE PLAYER"S MOVE
-        # Update the board's state
-        self.board_state[old_y][old_x] = -1
-        self.board_state[valid_spot[1]][valid_spot[0]] = piece_ID
+        # *** 2) UPDATE THE BOARD BASED ON THE PLAYER'S MOVE
+        self._move(old_node, NODE_INDEX[valid_spot])
+
+        # If the other player can't move any of their pieces, the current player gets another turn
+        if self.game_state == GameState.MOVEMENT and self.current_turn == player_num:
+            logger.info("Player %d can't move any pieces. Going back to the previous player.",
+                        (player_num + 1) % self.TOTAL_PLAYERS + 1)
+
+        # *** 3) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
+        active_pieces = self.get_active_pieces()
+        return [valid_spot[0], valid_spot[1], piece_ID, active_pieces, error]
+
+    # Returns every legal move the current player can make, in the same format the CPU sends them:
+    # (x, y) in the placement stage, (piece_ID,) in the removal stages and (x, y, piece_ID) in the movement stage
+    def legal_moves(self):
+        if self.game_state == GameState.PLACEMENT:
+            return [NODES[node] for node in iter_bits(self.board.empty_mask())]
+
+        elif self.game_state == GameState.REMOVAL or self.game_state == GameState.FIRST_REMOVAL:
+            return [(piece_ID,) for piece_ID in self._get_removable_pieces()]
+
+        elif self.game_state == GameState.MOVEMENT:
+            moves = []
+            empty = self.board.empty_mask()
+            for node in iter_bits(self.board.occupancy[self.current_turn]):
+                piece_ID = self.board.node_pieces[node]
+                for neighbor in ADJACENT_NODES[node]:
+                    if (empty >> neighbor) & 1:
+                        moves.append(NODES[neighbor] + (piece_ID,))
+
+            return moves
+
+        return []
+
+    # Packs a move into a non-negative int built from the nodes it goes from and to
+    # Unlike the move itself, the code doesn't depend on which ID the moved/removed piece has,
+    # so it can be reused in any game that reaches the same position (e.g. through a position_hash lookup)
+    def encode_move(self, move):
+        if len(move) == 2:
+            old_node, new_node = -1, NODE_INDEX[(move[0], move[1])]
+        elif len(move) == 1:
+            old_node, new_node = self.board.piece_nodes[move[0]], -1
+        else:
+            old_node, new_node = self.board.piece_nodes[move[2]], NODE_INDEX[(move[0], move[1])]
+
+        return (old_node + 1) | ((new_node + 1) << 5)
+
+    # Turns a code from encode_move() back into a move for the current position
+    def decode_move(self, code):
+        old_node = (code & 0b11111) - 1
+        new_node = (code >> 5) - 1
+
+        if old_node < 0:
+            return NODES[new_node]
+        elif new_node < 0:
+            return (self.board.node_pieces[old_node],)
+        else:
+            return NODES[new_node] + (self.board.node_pieces[old_node],)
+
+    # Returns a (move, move code, completes a jare) tuple for every move in legal_moves()
+    # The code is the same one encode_move() returns and the last item is if the move would make
+    # a new jare for the current player. Used to sort moves without looking up each move's nodes again
+    def legal_moves_info(self):
+        player_pieces = self.board.occupancy[self.current_turn]
+        board_jare = self.board_jare[self.current_turn]
+        current_jare = self.current_jare[self.current_turn]
+
+        if self.game_state == GameState.PLACEMENT:
+            return [(NODES[node], (node + 1) << 5,
+                     board_jare + jare_change(player_pieces, player_pieces | (1 << node)) > current_jare)
+                    for node in iter_bits(self.board.empty_mask())]
+
+        elif self.game_state == GameState.REMOVAL or self.game_state == GameState.FIRST_REMOVAL:
+            opponent = (self.current_turn + 1) % self.TOTAL_PLAYERS
+            return [((self.board.node_pieces[node],), node + 1, False)
+                    for node in iter_bits(self.board.occupancy[opponent])]
+
+        elif self.game_state == GameState.MOVEMENT:
+            moves = []
+            empty = self.board.empty_mask()
+            for node in iter_bits(player_pieces):
+                piece_ID = self.board.node_pieces[node]
+                for neighbor in ADJACENT_NODES[node]:
+                    if (empty >> neighbor) & 1:
+                        moved_pieces = player_pieces ^ (1 << node) ^ (1 << neighbor)
+                        moves.append((NODES[neighbor] + (piece_ID,), (node + 1) | ((neighbor + 1) << 5),
+                                      board_jare + jare_change(player_pieces, moved_pieces) > current_jare))
+
+            return moves
+
+        return []
+
+    # Plays a move from legal_moves() for the current player without checking if it's legal
+    # Records everything needed to take the move back with undo()
+    def apply(self, move):
+        game_state = self.game_state
+        record = (game_state, self.current_turn, self.first_to_jare, tuple(self.current_jare),
+                  tuple(self.board_jare), self._position_hash)
+
+        if game_state == GameState.PLACEMENT:
+            node = NODE_INDEX[(move[0], move[1])]
+            self._place(node)
+            self.undo_stack.append(record + (-1, node, -1))
+
+        elif game_state == GameState.REMOVAL or game_state == GameState.FIRST_REMOVAL:
+            node = self.board.piece_nodes[move[0]]
+            self._remove(node)
+            self.undo_stack.append(record + (node, -1, move[0]))
+
+        else:
+            old_node = self.board.piece_nodes[move[2]]
+            new_node = NODE_INDEX[(move[0], move[1])]
+            self._move(old_node, new_node)
+            self.undo_stack.append(record + (old_node, new_node, -1))
+
+    # Takes back the last move played with apply()
+    def undo(self):
+        (game_state, current_turn, first_to_jare, current_jare, board_jare, position_hash,
+         old_node, new_node, captured_ID) = self.undo_stack.pop()
+
+        if game_state == GameState.PLACEMENT:
+            self.board.clear(new_node, current_turn)
+            self.total_pieces[current_turn] -= 1
+
+        elif game_state == GameState.MOVEMENT:
+            self.board.move(new_node, old_node, current_turn)
+
+        else:
+            owner = captured_ID & (2**self.ID_SHIFT - 1)
+            self.board.place(old_node, captured_ID, owner)
+            self.total_pieces[owner] += 1
+
+        self.game_state = game_state
+        self.current_turn = current_turn
+        self.first_to_jare = first_to_jare
+        self.current_jare[:] = current_jare
+        self.board_jare[:] = board_jare
+        self._position_hash = position_hash
+
+    # Sets the game state to STOPPED
+    def end_game(self):
+        self._position_hash ^= self._get_state_key()
+        self.game_state = GameState.STOPPED
+        self._position_hash ^= self._get_state_key()
+
+    # Returns the pieces the current player can act on in the current stage of the game
+    def get_active_pieces(self):
+        if self.game_state == GameState.REMOVAL or self.game_state == GameState.FIRST_REMOVAL:
+            return self._get_removable_pieces()
+        elif self.game_state == GameState.MOVEMENT:
+            return self._get_active_pieces()
+        else:
+            return []
+
+    # Returns the current position as a flat tuple of ints that's cheap to send to other processes:
+    # (MIN_PIECES, MAX_PIECES, current turn, game state, first to jare (-1 for no one), each player's jare count,
+    #  ID of the piece on each node...)
+    # Everything else about the position (piece counts, jare on the board and the hash) can be rebuilt from it
+    def export_position(self):
+        first_to_jare = -1 if self.first_to_jare is None else self.first_to_jare
+        return (self.MIN_PIECES, self.MAX_PIECES, self.current_turn, self.game_state.value,
+                first_to_jare, *self.current_jare, *self.board.node_pieces)
+
+    # Creates a board manager in the position returned by export_position()
+    @classmethod
+    def from_position(cls, position):
+        min_pieces, max_pieces, current_turn, game_state, first_to_jare, *rest = position
+        current_jare, node_pieces = rest[:2], rest[2:]
+
+        board_manager = cls(min_pieces, max_pieces)
+        board_manager.start_game()
+        board_manager._position_hash = 0
+        board_manager.current_turn = current_turn
+        board_manager.game_state = GameState(game_state)
+        board_manager.first_to_jare = None if first_to_jare < 0 else first_to_jare
+        board_manager.current_jare[:] = current_jare
+
+        for node, piece_ID in enumerate(node_pieces):
+            if piece_ID == -1:
+                continue
+
+            player_num = piece_ID & (2**board_manager.ID_SHIFT - 1)
+            board_manager.board.place(node, piece_ID, player_num)
+            board_manager.total_pieces[player_num] += 1
+            board_manager._position_hash ^= PIECE_KEYS[player_num][node]
+
+        for player_num in range(board_manager.TOTAL_PLAYERS):
+            board_manager.board_jare[player_num] = count_jare(board_manager.board.occupancy[player_num])
+
+        board_manager._position_hash ^= board_manager._get_state_key()
+        return board_manager
+
+    # 64-bit Zobrist hash of the current position
+    # Covers the pieces on the board, whose turn it is, the game state, who made the first jare and the jare counts
+    @property
+    def position_hash(self):
+        return self._position_hash
 
-        # *** 3) VERIFY IF ANY SPECIAL CONDITIONS HAVE BEEN MET
-        new_jare = self._made_new_jare()
+    # The board as a 7x7 grid
+    # None marks cells that aren't on the board, -1 marks empty nodes and any other value is a piece ID
+    @property
+    def board_state(self):
+        return self.board.to_array()
+
+    # ***************************** HELPER FUNCTIONS ***************************************
+    # Places a new piece for the current player on an empty node and returns the piece's ID
+    def _place(self, node):
+        # Take the current turn and state out of the hash until they've been updated
+        self._position_hash ^= self._get_state_key()
+
+        # Generate an ID for the new game piece
+        new_ID = (self.total_pieces[self.current_turn] << self.ID_SHIFT) | self.current_turn
+
+        # Update the board's state with the new game piece
+        previous_pieces = self.board.occupancy[self.current_turn]
+        self.board.place(node, new_ID, self.current_turn)
+        self._position_hash ^= PIECE_KEYS[self.current_turn][node]
+
+        # Update the player's total number of pieces
+        self.total_pieces[self.current_turn] += 1
+
+        # Check if the first jare has been made yet
+        if self._made_new_jare(previous_pieces) and self.first_to_jare is None:
+            self.first_to_jare = self.current_turn
+
+        # If all the pieces have been placed,
+        # go on to the first removal state of the game
+        if min(self.total_pieces) >= self.MAX_PIECES:
+            self.game_state = GameState.FIRST_REMOVAL
+
+            if self.first_to_jare != None:
+                self.current_turn = self.first_to_jare
+
+            # If no one made a jare in the placement stage, player 2 goes first
+            else:
+                self.current_turn = 1
+
+        # Otherwise, go to the next player's turn
+        else:
+            self.current_turn = (self.current_turn + 1) % self.TOTAL_PLAYERS
+
+        self._position_hash ^= self._get_state_key()
+        return new_ID
+
+    # Removes the opponent's piece sitting on the node
+    def _remove(self, node):
+        piece_owner = self.board.node_pieces[node] & (2**self.ID_SHIFT - 1)
+
+        # Take the current turn and state out of the hash until they've been updated
+        self._position_hash ^= self._get_state_key()
+
+        # Remove the piece from the board
+        # The owner's jare count stays as it is until their next move, so only the jare on the board are updated
+        previous_pieces = self.board.occupancy[piece_owner]
+        self.board.clear(node, piece_owner)
+        self.board_jare[piece_owner] += jare_change(previous_pieces, self.board.occupancy[piece_owner])
+        self._position_hash ^= PIECE_KEYS[piece_owner][node]
+
+        # Update the remaining pieces of the other player
+        self.total_pieces[piece_owner] -= 1
+
+        # End the game if one of the players won
+        if (self._is_game_over()):
+            self.game_state = GameState.STOPPED
+
+        # If this is the very first removal stage,
+        # every player must have a chance to remove a piece before going on to the movement stage
+        # TODO: combine these conditions better
+        elif self.game_state == GameState.FIRST_REMOVAL:
+            self.current_turn = (self.current_turn + 1) % self.TOTAL_PLAYERS
+
+            if (self.first_to_jare is None and self.current_turn == 1) or \
+                    (self.current_turn == self.first_to_jare):
+                self.game_state = GameState.MOVEMENT
+
+        else:
+            self.game_state = GameState.MOVEMENT
+
+        self._position_hash ^= self._get_state_key()
+
+    # Slides one of the current player's pieces to an adjacent empty node
+    def _move(self, old_node, new_node):
+        self._position_hash ^= self._get_state_key()
+
+        player_keys = PIECE_KEYS[self.current_turn]
+        previous_pieces = self.board.occupancy[self.current_turn]
+        self.board.move(old_node, new_node, self.current_turn)
+        self._position_hash ^= player_keys[old_node] ^ player_keys[new_node]
 
-        # *** 4) PREPARE THE BOARD FOR THE NEXT TURN
         # Lets the current player go to the removal state if they made a new jare
-        if new_jare:
-            active_pieces = self._get_removable_pieces()
+        if self._made_new_jare(previous_pieces):
             self.game_state = GameState.REMOVAL
 
         # Go on to the next player if no jare was made
         else:
             self.current_turn = (self.current_turn + 1) % self.TOTAL_PLAYERS
 
-            # Checks if the next player has any pieces that can be moved
-            active_pieces = self._get_active_pieces()
-
-            # If the current player can't move any of their pieces,
+            # If the next player can't move any of their pieces,
             # the previous player gets another turn
-            if not active_pieces:
-                print("Player " + str(self.current_turn + 1) + " can't move any pieces. " +
-                      "Going back to the previous player.")
+            if not self._can_move(self.current_turn):
                 self.current_turn = (self.current_turn - 1) % self.TOTAL_PLAYERS
-                active_pieces = self._get_active_pieces()
 
-        # *** 5) NOTIFY THE PLAYER OF THE MOVE'S OUTCOME
-        return [valid_spot[0], valid_spot[1], piece_ID, active_pieces, error]
+        self._position_hash ^= self._get_state_key()
 
-    # Sets the game state to STOPPED
-    def end_game(self):
-        self.game_state = GameState.STOPPED
+    # Returns the part of the position's hash that comes from the turn, game state, first jare and jare counts
+    def _get_state_key(self):
+        key = TURN_KEYS[self.current_turn] ^ STATE_KEYS[self.game_state.value]
+        if self.first_to_jare is not None:
+            key ^= FIRST_TO_JARE_KEYS[self.first_to_jare]
+
+        for player_num, total_jare in enumerate(self.current_jare):
+            key ^= JARE_KEYS[player_num][total_jare]
+
+        return key
+
+    # Checks if any of the player's pieces has an empty node next to it
+    def _can_move(self, player_num):
+        empty = self.board.empty_mask()
+        for node in iter_bits(self.board.occupancy[player_num]):
+            if ADJACENT_MASKS[node] & empty:
+                return True
+
+        return False
 
-    # ***************************** HELPER FUNCTIONS ***************************************
     def _is_empty_spot(self, x, y):
         target_x = round(x)
         target_y = round(y)
@@ -305,11 +526,12 @@ class BoardManager:
                 y_error > self.MARGIN_OF_ERROR):
             # print("Too far from corner/intersection")
             return None
-        elif (target_x < 0 or target_x >= self.BOARD_SIZE or
-                target_y < 0 or target_y >= self.BOARD_SIZE):
+
+        node = NODE_INDEX.get((target_x, target_y))
+        if node is None:
             # print("Outside of the game board")
             return None
-        elif (self.board_state[target_y][target_x] != -1):
+        elif not (self.board.empty_mask() >> node) & 1:
             # print("Not an empty spot")
             return None
         else:
@@ -317,117 +539,37 @@ class BoardManager:
 
     def _piece_ID_to_coord(self, piece_ID):
         # print("The pieces ID is: " + str(pieceID))
-        index = np.where(self.board_state == piece_ID)
-        return index[1][0], index[0][0]
+        return NODES[self.board.piece_nodes[piece_ID]]
 
     # Takes in a piece ID and returns all the board locations that piece can move to
     def _get_possible_moves(self, piece_ID):
-        # Stores all the possible moves of the piece
-        # 0 means a piece can't move to that index
-        # 1 means a piece can move to that index
-        possible_moves = []
-
-        x, y = self._piece_ID_to_coord(piece_ID)
+        node = self.board.piece_nodes[piece_ID]
 
         # Gets all the adjacent spots that are empty
-        for adjacent_spot in self.adjacent_pieces[(x, y)]:
-            if self._is_empty_spot(adjacent_spot[0], adjacent_spot[1]):
-                possible_moves.append(adjacent_spot)
-
-        return possible_moves
+        empty = self.board.empty_mask()
+        return [NODES[neighbor] for neighbor in ADJACENT_NODES[node] if (empty >> neighbor) & 1]
 
     def _get_active_pieces(self):
-        active_pieces = []
-
-        # Get the indices of the player's pieces
-        # TODO: check if there is a better way to do this
-        board_copy = np.copy(self.board_state)
-        non_null = np.logical_and(board_copy != None, board_copy != -1)
-        board_copy[non_null] = board_copy[non_null] & (2**self.ID_SHIFT - 1)
-        indices = np.where(board_copy == self.current_turn)
+        empty = self.board.empty_mask()
 
-        # Goes through each of the player's pieces
-        for i in range(len(indices[0])):
-            x = indices[1][i]
-            y = indices[0][i]
-            id = self.board_state[y][x]
-            if self._get_possible_moves(id):
-                active_pieces.append(id)
-
-        return active_pieces
+        # Goes through each of the player's pieces and keeps the ones with an empty neighbor
+        return [self.board.node_pieces[node]
+                for node in iter_bits(self.board.occupancy[self.current_turn])
+                if ADJACENT_MASKS[node] & empty]
 
     def _get_removable_pieces(self):
-        active_pieces = []
-
-        # Get the indices of the player's pieces
-        # TODO: check if there is a better way to do this
-        board_copy = np.copy(self.board_state)
-        non_null = np.logical_and(board_copy != None, board_copy != -1)
-        board_copy[non_null] = board_copy[non_null] & (2**self.ID_SHIFT - 1)
-        indices = np.where(board_copy == (self.current_turn + 1) % 2)
-
-        # Goes through each of the player's pieces
-        for i in range(len(indices[0])):
-            x = indices[1][i]
-            y = indices[0][i]
-            id = self.board_state[y][x]
-            active_pieces.append(id)
-
-        return active_pieces
-
-    # Searches the board and returns if a new jare was made or not
-    def _made_new_jare(self):
-        pieces_in_jare = []
-        neighboring_ally = None
-        total_jare = 0
-        # Get the indices of the player's pieces
-        # TODO: check if there is a better way to do this
-        board_copy = np.copy(self.board_state)
-        non_null = np.logical_and(board_copy != None, board_copy != -1)
-        board_copy[non_null] = board_copy[non_null] & (2**self.ID_SHIFT - 1)
-        indices = np.where(board_copy == self.current_turn)
-
-        # Goes through each of the player's pieces
-        for i in range(len(indices[0])):
-            board_coord = (indices[1][i], indices[0][i])
-
-            # Checks if the piece is already in another "jare"
-            if board_coord in pieces_in_jare:
-                # print("The game piece at " + str(board_coord) + " is already a part of a jare\n")
-                continue
-
-            # print("Investigating the game piece at " + str(board_coord))
-            # Checks if any adjacent pieces are also one of the player's pieces
-            for neighbor_coord in self.adjacent_pieces[board_coord]:
-
-                neighbor_id = self.board_state[neighbor_coord[1]][neighbor_coord[0]]
-
-                if neighbor_coord in pieces_in_jare:
-                    # print("The neighbor at " + str(neighbor_coord) + " is already in a jare\n")
-                    continue
-
-                elif (neighbor_id != -1 and
-                      (neighbor_id & (2**self.ID_SHIFT - 1) == self.current_turn)):
-                    if neighboring_ally is None:
-                        neighboring_ally = neighbor_coord
-                    else:
-                        # print("Found a jare made of the pieces at " + str(board_coord) +
-                        #  ", " + str(neighbor_coord) + ", " + str(neighboring_ally) + "\n")
-                        total_jare += 1
-
-                        # Record all the pieces that make up this jare
-                        pieces_in_jare.append(board_coord)
-                        pieces_in_jare.append(neighbor_coord)
-                        pieces_in_jare.append(neighboring_ally)
-
-                        # Reset the neighboring ally
-                        neighboring_ally = None
-
-                        # print()
-                        break
-
-            # Reset the neighboring ally
-            neighboring_ally = None
+        opponent = (self.current_turn + 1) % self.TOTAL_PLAYERS
+
+        # Goes through each of the opponent's pieces
+        return [self.board.node_pieces[node] for node in iter_bits(self.board.occupancy[opponent])]
+
+    # Updates the current player's jare count after they placed or moved a piece
+    # (previous_pieces being their pieces before that) and returns if a new jare was made or not
+    # The jare on the board are updated from the groups of pieces around the nodes that changed instead of
+    # scanning every piece again
+    def _made_new_jare(self, previous_pieces):
+        self.board_jare[self.current_turn] += jare_change(previous_pieces, self.board.occupancy[self.current_turn])
+        total_jare = self.board_jare[self.current_turn]
 
         if self.current_jare[self.current_turn] < total_jare:
             self.current_jare[self.current_turn] = total_jare
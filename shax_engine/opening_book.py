@@ -0,0 +1,98 @@
+import numpy as np
+
+from shax_engine.bitboard import NODE_INDEX, NODES, SYMMETRIES, TOTAL_NODES, iter_bits
+from shax_engine.board_manager import BoardManager, GameState
+from shax_engine.zobrist import PIECE_KEYS
+
+# Opening book for the placement stage
+# Maps the positions of the first few placements to the best node to place the next piece on, found offline
+# by a deep search (see build_opening_book.py). Positions that are rotations or reflections of each other share
+# one entry: every position is looked up by its canonical hash (the smallest position hash of its 8 symmetric
+# versions) and the entry's node is turned from the canonical version's orientation back into the position's.
+# Nobody can have a jare yet in the book's positions, so the symmetric versions really are the same position,
+# even though the jare count of a turned board can differ later in the game (see SYMMETRIES).
+# A book is only used in games with the same MIN_PIECES and MAX_PIECES as the games it was built from.
+
+# The book only holds positions with fewer than MAX_PLIES pieces placed
+# (each player has 2 pieces at most in them, and a jare takes 3)
+MAX_PLIES = 5
+
+# Entries as they're saved in the book's file
+ENTRY_DTYPE = np.dtype([("key", "<u8"), ("node", "u1")])
+
+# Symmetry -> the symmetry that undoes it
+_INVERSES: list = [[symmetry.index(node) for node in range(TOTAL_NODES)] for symmetry in SYMMETRIES]
+
+
+# Returns the position's canonical hash along with the index of the symmetry that turns it into the canonical version
+def canonical_hash(board_manager: BoardManager):
+    pieces = [(player_num, node) for player_num in range(board_manager.TOTAL_PLAYERS)
+              for node in iter_bits(board_manager.board.occupancy[player_num])]
+
+    # The turn, game state and jare parts of the hash don't change when the board is turned
+    # (as long as nobody has a jare, like in the book's positions)
+    state_key = board_manager.position_hash
+    for player_num, node in pieces:
+        state_key ^= PIECE_KEYS[player_num][node]
+
+    best = None
+    for i, symmetry in enumerate(SYMMETRIES):
+        key = state_key
+        for player_num, node in pieces:
+            key ^= PIECE_KEYS[player_num][symmetry[node]]
+
+        if best is None or key < best[0]:
+            best = (key, i)
+
+    return best
+
+
+class OpeningBook:
+    # min_pieces and max_pieces are the MIN_PIECES and MAX_PIECES of the games the book is for
+    # entries maps canonical hashes to the node the next piece goes on in the canonical version
+    def __init__(self, min_pieces: int, max_pieces: int, entries: dict = None) -> None:
+        self.min_pieces = min_pieces
+        self.max_pieces = max_pieces
+        self.entries = {} if entries is None else entries
+
+    # Loads a book saved by save()
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as book:
+            array = book["entries"]
+            min_pieces, max_pieces = book["limits"].tolist()
+
+        return cls(min_pieces, max_pieces, dict(zip(array["key"].tolist(), array["node"].tolist())))
+
+    def save(self, path):
+        array = np.array(sorted(self.entries.items()), dtype=ENTRY_DTYPE)
+        with open(path, "wb") as file:
+            np.savez(file, entries=array, limits=np.array([self.min_pieces, self.max_pieces]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Adds the placement (an (x, y) move from BoardManager.legal_moves()) as the best move in the position
+    def add(self, board_manager: BoardManager, move):
+        key, symmetry = canonical_hash(board_manager)
+        self.entries[key] = SYMMETRIES[symmetry][NODE_INDEX[(move[0], move[1])]]
+
+    # Returns the book's move for the position (None if it isn't in the book)
+    def probe(self, board_manager: BoardManager):
+        if board_manager.game_state != GameState.PLACEMENT:
+            return None
+
+        if (board_manager.MIN_PIECES, board_manager.MAX_PIECES) != (self.min_pieces, self.max_pieces):
+            return None
+
+        key, symmetry = canonical_hash(board_manager)
+        node = self.entries.get(key)
+        if node is None:
+            return None
+
+        # Don't trust an entry that points at a taken node (two positions with the same hash)
+        node = _INVERSES[symmetry][node]
+        if board_manager.board.node_pieces[node] != -1:
+            return None
+
+        return list(NODES[node])
@@ -0,0 +1,451 @@
+import functools
+import itertools
+import mmap
+import struct
+from math import comb
+
+import numpy as np
+
+from shax_engine.batch_board import count_jare
+from shax_engine.bitboard import ADJACENT_MASKS, ADJACENT_NODES, FULL_MASK, TOTAL_NODES
+from shax_engine.board_manager import BoardManager, GameState
+
+# Endgame tablebase for the movement stage
+# Holds the result of perfect play (win, loss or draw, and how many plies it takes) for every movement stage position
+# where both players have at most a few pieces more than MIN_PIECES. The tables are solved offline by retrograde
+# analysis (see build_tablebase.py) and written to a single file that's read through mmap, so every process
+# probing it shares one copy of its pages.
+#
+# A table holds every position where the player to move has a set number of pieces and so does the other player.
+# Its positions are numbered by the rank of the mover's nodes among all the sets of that many nodes, then
+# by the rank of the other player's nodes among the nodes the mover isn't on, and then by each player's jare count.
+# The jare counts are BoardManager.current_jare, which can stay above the jare on the board after a removal.
+# A player can't have more than pieces // 3 jare, so higher counts play the same as that and are stored as it.
+# Each entry is (plies << 1) | 1 if the player to move wins, plies << 1 if they lose and 0 for draws,
+# where plies counts every move and removal until the game ends.
+
+# File layout (little-endian): the header, a record for each table and then the entries of every table
+FILE_MAGIC = b"SHAXTB"
+FILE_VERSION = 2
+_HEADER = struct.Struct("<6sHBBH")          # magic, version, MIN_PIECES, bytes per entry, number of tables
+_TABLE_RECORD = struct.Struct("<BBQQ")      # pieces of the player to move, of the other player, offset, entries
+
+# Entry of a drawn position (and of positions where the player to move is stuck)
+DRAW = 0
+
+# Positions numbered per pass of the solver
+CHUNK_SIZE = 1 << 20
+
+# n (row) -> k (column) -> n choose k
+_BINOMIALS = np.array([[comb(n, k) for k in range(TOTAL_NODES + 1)] for n in range(TOTAL_NODES + 1)], dtype=np.int64)
+
+# Every way a piece can slide as (node it leaves, node it arrives at)
+_EDGES = [(node, neighbor) for node, neighbors in enumerate(ADJACENT_NODES) for neighbor in neighbors]
+
+
+# Returns the index of each position in its table
+# movers and others are the node masks of the player to move and of the other player (ints or arrays of them)
+# and mover_jare and other_jare are their jare counts, already capped by jare_cap()
+def position_index(movers, others, mover_jare, other_jare, total_movers, total_others):
+    mover_rank = 0
+    other_rank = 0
+    mover_count = 0
+    other_count = 0
+
+    for node in range(TOTAL_NODES):
+        mover_bit = (movers >> node) & 1
+        other_bit = (others >> node) & 1
+        mover_count = mover_count + mover_bit
+        other_count = other_count + other_bit
+
+        # The other player's pieces are ranked by how many of the mover's nodes come before them
+        mover_rank = mover_rank + mover_bit * _BINOMIALS[node, mover_count]
+        other_rank = other_rank + other_bit * _BINOMIALS[node - mover_count, other_count]
+
+    board_index = mover_rank * _BINOMIALS[TOTAL_NODES - total_movers, total_others] + other_rank
+    return (board_index * (jare_cap(total_movers) + 1) + mover_jare) * (jare_cap(total_others) + 1) + other_jare
+
+
+# Highest jare count that plays differently from the ones below it for a player with total_pieces pieces
+def jare_cap(total_pieces):
+    return total_pieces // 3
+
+
+# Number of positions in the table of positions where the players have these piece counts
+def _table_size(key):
+    total_movers, total_others = key
+    return int(_BINOMIALS[TOTAL_NODES, total_movers] * _BINOMIALS[TOTAL_NODES - total_movers, total_others]) * \
+        (jare_cap(total_movers) + 1) * (jare_cap(total_others) + 1)
+
+
+# Returns the masks of every set of size nodes out of the first total_nodes nodes, in order of rank
+@functools.lru_cache(maxsize=None)
+def _subsets(total_nodes, size):
+    masks = np.array([sum(1 << node for node in nodes) for nodes in itertools.combinations(range(total_nodes), size)],
+                     dtype=np.int64).reshape(-1)
+
+    ranks = 0
+    count = 0
+    for node in range(total_nodes):
+        bit = (masks >> node) & 1
+        count = count + bit
+        ranks = ranks + bit * _BINOMIALS[node, count]
+
+    return masks[np.argsort(ranks)]
+
+
+# Returns the rank of each mask among the sets of nodes of its size (its index in _subsets())
+def _subset_rank(masks):
+    ranks = 0
+    count = 0
+    for node in range(TOTAL_NODES):
+        bit = (masks >> node) & 1
+        count = count + bit
+        ranks = ranks + bit * _BINOMIALS[node, count]
+
+    return ranks
+
+
+# Returns the jare on the board for each set of size nodes (in order of rank) and a (sets, edges) array of the jare
+# on the board after a piece slides along each of the _EDGES (only meaningful for the moves that can be played)
+@functools.lru_cache(maxsize=None)
+def _jare_tables(size):
+    subsets = _subsets(TOTAL_NODES, size)
+    board_jare = count_jare(subsets)
+
+    moved_jare = np.zeros((len(subsets), len(_EDGES)), dtype=np.int8)
+    for i, (old_node, new_node) in enumerate(_EDGES):
+        legal = (((subsets >> old_node) & 1) == 1) & (((subsets >> new_node) & 1) == 0)
+        moved_jare[legal, i] = board_jare[_subset_rank(subsets[legal] ^ ((1 << old_node) | (1 << new_node)))]
+
+    return board_jare, moved_jare
+
+
+# Returns the masks and jare counts of the mover and the other player for each index in the table
+# (the reverse of position_index()) along with the rank of the mover's nodes
+def _positions(indices, total_movers, total_others):
+    other_jare = indices % (jare_cap(total_others) + 1)
+    indices = indices // (jare_cap(total_others) + 1)
+    mover_jare = indices % (jare_cap(total_movers) + 1)
+    indices = indices // (jare_cap(total_movers) + 1)
+
+    per_mover = _BINOMIALS[TOTAL_NODES - total_movers, total_others]
+    mover_ranks = indices // per_mover
+    movers = _subsets(TOTAL_NODES, total_movers)[mover_ranks]
+    other_codes = _subsets(TOTAL_NODES - total_movers, total_others)[indices % per_mover]
+
+    # Spread the other player's pieces out over the nodes the mover isn't on
+    others = np.zeros_like(movers)
+    free = np.zeros_like(movers)
+    for node in range(TOTAL_NODES):
+        is_free = 1 - ((movers >> node) & 1)
+        others |= (((other_codes >> free) & 1) * is_free) << node
+        free += is_free
+
+    return movers, others, mover_jare, other_jare, mover_ranks
+
+
+# Checks if any of the pieces is next to an empty node
+def _can_move(pieces, empty):
+    can_move = np.zeros(len(pieces), dtype=bool)
+    for node in range(TOTAL_NODES):
+        can_move |= (((pieces >> node) & 1) == 1) & ((empty & ADJACENT_MASKS[node]) != 0)
+
+    return can_move
+
+
+# Turns entries into values the player to move wants as high as possible (faster wins and slower losses first)
+def _preference(entries):
+    entries = entries.astype(np.int64)
+    plies = entries >> 1
+    return np.where(entries == DRAW, 0, np.where(entries & 1, (1 << 16) - plies, plies - (1 << 16)))
+
+
+# Solves every table where both players have more than MIN_PIECES pieces and max_total pieces at most between them
+# Returns a {(pieces of the player to move, pieces of the other player): entries} dict
+# progress is called with a description of each step
+def build_tables(min_pieces=2, max_total=8, max_pieces=12, progress=None):
+    board_manager = BoardManager(min_pieces, max_pieces)
+    min_pieces, max_pieces = board_manager.MIN_PIECES, board_manager.MAX_PIECES
+
+    # Tables only depend on tables with fewer pieces and on the table with the players swapped
+    tables = {}
+    for total in range(2 * (min_pieces + 1), max_total + 1):
+        for movers in range(min_pieces + 1, total // 2 + 1):
+            others = total - movers
+            if others > max_pieces:
+                continue
+
+            tables.update(_solve_material(movers, others, min_pieces, tables, progress))
+
+    return tables
+
+
+# Solves the tables of the positions with these piece counts (for either player to move)
+def _solve_material(movers, others, min_pieces, tables, progress):
+    keys = [(movers, others)] if movers == others else [(movers, others), (others, movers)]
+
+    # Both tables are solved together in one array
+    offsets = {}
+    total_positions = 0
+    for key in keys:
+        offsets[key] = total_positions
+        total_positions += _table_size(key)
+
+    entries = np.zeros(total_positions, dtype=np.uint16)
+
+    # Moves from each position that aren't known to lose yet
+    remaining = np.zeros(total_positions, dtype=np.uint8)
+
+    # Level (plies until the game ends) -> indices of the positions a move wins from at that level
+    # and indices of the positions where a move loses at that level
+    wins: dict = {}
+    losses: dict = {}
+
+    if progress:
+        progress(f"Solving {' and '.join(f'{a}v{b}' for a, b in keys)}: {total_positions} positions")
+
+    for key in keys:
+        end = offsets[key] + _table_size(key)
+        for start in range(offsets[key], end, CHUNK_SIZE):
+            indices = np.arange(start, min(start + CHUNK_SIZE, end))
+            remaining[indices] = _count_moves(indices, offsets[key], key, min_pieces, tables, wins, losses)
+
+    # Resolve the positions in order of how many plies the game has left, so the first win found for a position
+    # is its fastest one and its last losing move is its slowest one
+    level = 0
+    while wins or losses:
+        level = min(min(wins, default=level + 1), min(losses, default=level + 1))
+        level_wins = np.concatenate(wins.pop(level, [np.zeros(0, dtype=np.int64)]))
+        level_losses = np.concatenate(losses.pop(level, [np.zeros(0, dtype=np.int64)]))
+
+        won = np.unique(level_wins[entries[level_wins] == DRAW])
+        entries[won] = (level << 1) | 1
+
+        level_losses = level_losses[entries[level_losses] == DRAW]
+        lost_moves = np.bincount(level_losses, minlength=total_positions)
+        touched = np.flatnonzero(lost_moves)
+        remaining[touched] -= lost_moves[touched].astype(np.uint8)
+        lost = touched[remaining[touched] == 0]
+        entries[lost] = level << 1
+
+        if progress and (len(won) or len(lost)):
+            progress(f"  {level} plies: {len(won)} won, {len(lost)} lost")
+
+        for resolved, did_win in ((won, True), (lost, False)):
+            for start in range(0, len(resolved), CHUNK_SIZE):
+                _add_predecessors(resolved[start:start + CHUNK_SIZE], did_win, level + 1, offsets, wins, losses)
+
+    return {key: entries[offsets[key]:offsets[key] + _table_size(key)] for key in keys}
+
+
+# Counts the legal moves of the positions and adds the results of the moves that make a jare (and leave the table)
+# Returns the number of moves of each position
+def _count_moves(indices, offset, key, min_pieces, tables, wins, losses):
+    total_movers, total_others = key
+    movers, others, mover_jare, other_jare, mover_ranks = _positions(indices - offset, total_movers, total_others)
+    empty = FULL_MASK ^ movers ^ others
+    moved_jare = _jare_tables(total_movers)[1][mover_ranks]
+
+    # Level -> positions a jare wins from at that level (each position is only needed once per level)
+    jare_wins: dict = {}
+
+    total_moves = np.zeros(len(indices), dtype=np.uint8)
+    for i, (old_node, new_node) in enumerate(_EDGES):
+        legal = (((movers >> old_node) & 1) & ((empty >> new_node) & 1)) == 1
+        total_moves += legal
+
+        made_jare = legal & (moved_jare[:, i] > mover_jare)
+        if not made_jare.any():
+            continue
+
+        # The mover removes a piece and moves again
+        if total_others - 1 <= min_pieces:
+            jare_wins.setdefault(2, []).append(indices[made_jare])
+            continue
+
+        # The mover's count is now the jare on the board and the other player's count stays as it was
+        moved = movers[made_jare] ^ ((1 << old_node) | (1 << new_node))
+        moved_others = others[made_jare]
+        new_mover_jare = moved_jare[made_jare, i]
+        new_other_jare = np.minimum(other_jare[made_jare], jare_cap(total_others - 1))
+
+        lower_table = tables[(total_movers, total_others - 1)]
+        best = np.full(len(moved), -(1 << 20), dtype=np.int64)
+        best_entries = np.zeros(len(best), dtype=np.int64)
+        for node in range(TOTAL_NODES):
+            has_piece = ((moved_others >> node) & 1) == 1
+            if not has_piece.any():
+                continue
+
+            lower = lower_table[position_index(moved[has_piece], moved_others[has_piece] & ~(1 << node),
+                                               new_mover_jare[has_piece], new_other_jare[has_piece],
+                                               total_movers, total_others - 1)].astype(np.int64)
+            better = _preference(lower) > best[has_piece]
+            rows = np.flatnonzero(has_piece)[better]
+            best[rows] = _preference(lower[better])
+            best_entries[rows] = lower[better]
+
+        plies = (best_entries >> 1) + 2
+        won = (best_entries & 1) == 1
+        lost = (best_entries != DRAW) & ~won
+        for level in np.unique(plies[won]):
+            jare_wins.setdefault(int(level), []).append(indices[made_jare][won & (plies == level)])
+        for level in np.unique(plies[lost]):
+            losses.setdefault(int(level), []).append(indices[made_jare][lost & (plies == level)])
+
+    for level, level_wins in jare_wins.items():
+        wins.setdefault(level, []).append(np.unique(np.concatenate(level_wins)))
+
+    return total_moves
+
+
+# Finds every position whose move leads to one of the resolved positions without leaving the table
+# and records that move's result at the level
+def _add_predecessors(resolved, did_win, level, offsets, wins, losses):
+    for key, offset in offsets.items():
+        in_table = resolved[(resolved >= offset) & (resolved < offset + _table_size(key))]
+        if not len(in_table):
+            continue
+
+        total_movers, total_others = key
+        movers, others, mover_jare, other_jare, mover_ranks = _positions(in_table - offset, total_movers, total_others)
+        empty = FULL_MASK ^ movers ^ others
+        movers_can_move = _can_move(movers, empty)
+        others_can_move = _can_move(others, empty)
+
+        # A player who just moved has their count set to the jare on the board
+        mover_board_jare = _jare_tables(total_movers)[0][mover_ranks]
+        other_board_jare = _jare_tables(total_others)[0][_subset_rank(others)]
+
+        # The piece now on new_node was moved there from old_node without making a jare,
+        # so the player's count before the move was at least the jare on the board now
+        for old_node, new_node in _EDGES:
+            was_empty = ((empty >> old_node) & 1) == 1
+            move_mask = (1 << old_node) | (1 << new_node)
+
+            # The other player moved and it became the mover's turn
+            rows = was_empty & (((others >> new_node) & 1) == 1) & movers_can_move & (other_jare == other_board_jare)
+            if rows.any():
+                before = others[rows] ^ move_mask
+                for before_jare in range(jare_cap(total_others) + 1):
+                    no_jare = other_board_jare[rows] <= before_jare
+                    previous = offsets[(total_others, total_movers)] + \
+                        position_index(before[no_jare], movers[rows][no_jare], before_jare, mover_jare[rows][no_jare],
+                                       total_others, total_movers)
+
+                    # The other player won if the mover lost
+                    (losses if did_win else wins).setdefault(level, []).append(previous)
+
+            # The mover moved, but it's their turn again because the other player can't move
+            rows = was_empty & (((movers >> new_node) & 1) == 1) & ~others_can_move & \
+                (mover_jare == mover_board_jare)
+            if rows.any():
+                before = movers[rows] ^ move_mask
+                for before_jare in range(jare_cap(total_movers) + 1):
+                    no_jare = mover_board_jare[rows] <= before_jare
+                    previous = offset + position_index(before[no_jare], others[rows][no_jare], before_jare,
+                                                       other_jare[rows][no_jare], total_movers, total_others)
+
+                    (wins if did_win else losses).setdefault(level, []).append(previous)
+
+
+# Writes the tables from build_tables() to the file
+def write_tablebase(path, tables: dict, min_pieces=2):
+    min_pieces = BoardManager(min_pieces, 12).MIN_PIECES
+
+    # Use a byte per entry unless a game can take too long for it
+    largest = max((int(table.max()) for table in tables.values() if len(table)), default=0)
+    dtype = np.dtype("<u1") if largest <= 0xFF else np.dtype("<u2")
+
+    offset = _HEADER.size + _TABLE_RECORD.size * len(tables)
+    records = []
+    for (total_movers, total_others), table in sorted(tables.items()):
+        records.append(_TABLE_RECORD.pack(total_movers, total_others, offset, len(table)))
+        offset += len(table) * dtype.itemsize
+
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(FILE_MAGIC, FILE_VERSION, min_pieces, dtype.itemsize, len(tables)))
+        for record in records:
+            file.write(record)
+        for _, table in sorted(tables.items()):
+            file.write(table.astype(dtype).tobytes())
+
+
+# A tablebase file opened for probing
+class Tablebase():
+    def __init__(self, path) -> None:
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.MIN_PIECES, entry_size, total_tables = _HEADER.unpack_from(self.mmap, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path} isn't a version {FILE_VERSION} tablebase")
+
+        dtype = np.dtype("<u1") if entry_size == 1 else np.dtype("<u2")
+
+        # (pieces of the player to move, pieces of the other player) -> entries, read straight from the mapped pages
+        self.tables = {}
+        for i in range(total_tables):
+            total_movers, total_others, offset, entries = \
+                _TABLE_RECORD.unpack_from(self.mmap, _HEADER.size + i * _TABLE_RECORD.size)
+            self.tables[(total_movers, total_others)] = np.frombuffer(self.mmap, dtype, entries, offset)
+
+    # Returns (1 for a win, 0 for a draw or -1 for a loss, plies until the game ends) for the player to move
+    # None if the position isn't in the tablebase
+    def probe(self, board_manager: BoardManager):
+        if board_manager.MIN_PIECES != self.MIN_PIECES:
+            return None
+
+        player = board_manager.current_turn
+        total_movers = board_manager.total_pieces[player]
+        total_others = board_manager.total_pieces[1 - player]
+        movers = board_manager.board.occupancy[player]
+        others = board_manager.board.occupancy[1 - player]
+        mover_jare = min(board_manager.current_jare[player], jare_cap(total_movers))
+        other_jare = board_manager.current_jare[1 - player]
+
+        # The player who took the other player down to MIN_PIECES won
+        if board_manager.game_state == GameState.STOPPED:
+            return (1 if total_others <= self.MIN_PIECES else -1), 0
+
+        if board_manager.game_state == GameState.MOVEMENT:
+            return self._lookup(movers, others, mover_jare, min(other_jare, jare_cap(total_others)),
+                                total_movers, total_others)
+
+        if board_manager.game_state != GameState.REMOVAL:
+            return None
+
+        # Removing a piece leaves the mover to move again, so take the best removal
+        if total_others - 1 <= self.MIN_PIECES:
+            return 1, 1
+
+        best = None
+        other_jare = min(other_jare, jare_cap(total_others - 1))
+        for node in range(TOTAL_NODES):
+            if others >> node & 1:
+                result = self._lookup(movers, others & ~(1 << node), mover_jare, other_jare,
+                                      total_movers, total_others - 1)
+                if result is None:
+                    return None
+
+                if best is None or (result[0], -result[0] * result[1]) > (best[0], -best[0] * best[1]):
+                    best = result
+
+        return best[0], best[1] + 1
+
+    def close(self):
+        self.tables = {}
+        self.mmap.close()
+
+    # ***************************** HELPER FUNCTIONS ***************************************
+    def _lookup(self, movers, others, mover_jare, other_jare, total_movers, total_others):
+        table = self.tables.get((total_movers, total_others))
+        if table is None:
+            return None
+
+        entry = int(table[position_index(movers, others, mover_jare, other_jare, total_movers, total_others)])
+        if entry == DRAW:
+            return 0, 0
+
+        return (1 if entry & 1 else -1), entry >> 1
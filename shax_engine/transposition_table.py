@@ -0,0 +1,130 @@
+from enum import IntEnum
+import numpy as np
+
+
+# What the value stored in an entry means compared to the position's real value
+class Bound(IntEnum):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+
+# Fixed size hash table of search results, keyed by BoardManager.position_hash
+# All the entries are allocated up front as NumPy arrays, so the table never grows past its memory budget
+# Each index holds a bucket of 2 entries. When a bucket is full, entries left over from previous searches
+# are replaced first, then whichever entry was searched to the lowest depth
+class TranspositionTable:
+    # Bytes used by each entry (key + value + best move + depth + bound + age)
+    ENTRY_SIZE = 8 + 4 + 4 + 1 + 1 + 1
+
+    BUCKET_SIZE = 2
+
+    def __init__(self, memory_budget=4 * 2**20) -> None:
+        # Use the largest power of 2 number of buckets that fits in the budget
+        total_buckets = 1
+        while total_buckets * 2 * self.BUCKET_SIZE * self.ENTRY_SIZE <= memory_budget:
+            total_buckets *= 2
+
+        self.index_mask = total_buckets - 1
+        size = total_buckets * self.BUCKET_SIZE
+
+        self.keys = np.zeros(size, np.uint64)
+        self.values = np.zeros(size, np.float32)
+        self.moves = np.zeros(size, np.int32)
+        self.depths = np.full(size, -1, np.int8)
+        self.bounds = np.zeros(size, np.int8)
+        self.ages = np.zeros(size, np.uint8)
+
+        # Incremented for every new search so entries from older searches can be replaced first
+        self.age = 0
+
+        # Lookup statistics
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    # Total bytes allocated for the entries
+    @property
+    def memory_used(self):
+        return (self.keys.nbytes + self.values.nbytes + self.moves.nbytes +
+                self.depths.nbytes + self.bounds.nbytes + self.ages.nbytes)
+
+    # Marks every entry currently in the table as coming from an older search
+    def new_search(self):
+        self.age = (self.age + 1) % 256
+
+    # Empties the table and resets its statistics
+    def clear(self):
+        self.depths[:] = -1
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    # Returns the (value, depth, bound, best move) stored for the position or None if it isn't in the table
+    # The best move is packed the same way as in store()
+    def probe(self, key):
+        start = (key & self.index_mask) * self.BUCKET_SIZE
+        occupied = False
+
+        for slot in range(start, start + self.BUCKET_SIZE):
+            if self.depths[slot] < 0:
+                continue
+
+            if self.keys[slot] == key:
+                self.hits += 1
+                return float(self.values[slot]), int(self.depths[slot]), Bound(self.bounds[slot]), \
+                    int(self.moves[slot])
+
+            occupied = True
+
+        # Count the lookups that missed because the bucket is holding other positions
+        if occupied:
+            self.collisions += 1
+
+        self.misses += 1
+        return None
+
+    # Saves the result of searching the position to the given depth
+    # The best move has to be packed into a non-negative int that fits in 32 bits (0 for no move)
+    def store(self, key, value, depth, bound, best_move):
+        start = (key & self.index_mask) * self.BUCKET_SIZE
+        victim = None
+
+        for slot in range(start, start + self.BUCKET_SIZE):
+            # Overwrite the position's old entry unless it was searched deeper during this search
+            if self.depths[slot] >= 0 and self.keys[slot] == key:
+                if self.ages[slot] == self.age and self.depths[slot] > depth:
+                    return
+
+                victim = slot
+                break
+
+            # Otherwise pick the empty entry, the oldest entry or the shallowest entry, in that order
+            if victim is None or self._replace_priority(slot) < self._replace_priority(victim):
+                victim = slot
+
+        self.keys[victim] = key
+        self.values[victim] = value
+        self.moves[victim] = best_move
+        self.depths[victim] = depth
+        self.bounds[victim] = bound
+        self.ages[victim] = self.age
+
+    # Returns how much the entry is worth keeping (lowest gets replaced first)
+    def _replace_priority(self, slot):
+        depth = int(self.depths[slot])
+        if depth < 0:
+            return -1
+
+        if self.ages[slot] != self.age:
+            return depth
+
+        return 256 + depth
+
+    # Returns the lookup statistics of the table
+    def get_stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "collisions": self.collisions,
+                "memory_used": self.memory_used}
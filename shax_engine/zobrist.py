@@ -0,0 +1,30 @@
+import random
+
+from shax_engine.bitboard import TOTAL_NODES
+
+# Random 64-bit keys for Zobrist hashing the positions of a game
+# The generator is seeded with a constant so every process derives the same keys,
+# which means a position hashes to the same value no matter which process computed it
+_rng = random.Random(0x5348_4158)
+
+TOTAL_PLAYERS = 2
+
+# Number of values in the GameState enum
+TOTAL_GAME_STATES = 5
+
+# Player number -> bit index of a node -> key for that player having a piece on the node
+PIECE_KEYS: list = [[_rng.getrandbits(64) for _ in range(TOTAL_NODES)] for _ in range(TOTAL_PLAYERS)]
+
+# Player number -> key for it being that player's turn
+TURN_KEYS: list = [_rng.getrandbits(64) for _ in range(TOTAL_PLAYERS)]
+
+# GameState value -> key for the game being in that state
+STATE_KEYS: list = [_rng.getrandbits(64) for _ in range(TOTAL_GAME_STATES)]
+
+# Player number -> key for that player being the first to make a jare
+# Nothing is added to the hash while no one has made a jare yet
+FIRST_TO_JARE_KEYS: list = [_rng.getrandbits(64) for _ in range(TOTAL_PLAYERS)]
+
+# Player number -> number of jare the player has made -> key for that count
+# Two positions with the same pieces can still play out differently if a player's count went stale after a removal
+JARE_KEYS: list = [[_rng.getrandbits(64) for _ in range(TOTAL_NODES // 3 + 1)] for _ in range(TOTAL_PLAYERS)]
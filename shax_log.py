@@ -0,0 +1,103 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Structured logging that never writes to the terminal from the event loop
+# Records are put on a bounded queue as they are and a background thread formats them as JSON lines and writes them.
+# The engine logs under the "shax_engine" logger so it can be quieted separately from the API.
+
+# Name of the logger the engine's modules log under
+ENGINE_LOGGER = "shax_engine"
+
+# Fraction of the connections whose DEBUG and INFO records are kept (warnings and errors are always kept)
+sample_rate = 1.0
+
+
+# Formats a record as a single JSON object with its structured fields at the top level
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        entry = {"time": round(record.created, 6),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "event": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+# Hands the records to the writer thread without formatting them first
+# Records are dropped instead of blocking the caller if the writer falls behind
+class QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, record_queue: queue.Queue) -> None:
+        super().__init__(record_queue)
+
+        # Number of records dropped because the queue was full
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord):
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Handler of the process' records (None until setup_logging() is called)
+queue_handler: QueueHandler = None
+
+
+# Sends every record to a background thread that writes them to the stream
+# Returns the listener running the thread, which has to be stopped to write the last records
+def setup_logging(level=logging.INFO, engine_level=logging.WARNING, connection_sample_rate=1.0,
+                  stream=sys.stdout, max_queue=10000):
+    global queue_handler, sample_rate
+
+    record_queue = queue.Queue(max_queue)
+    queue_handler = QueueHandler(record_queue)
+    sample_rate = connection_sample_rate
+
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JSONFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    logging.getLogger(ENGINE_LOGGER).setLevel(engine_level)
+
+    listener = logging.handlers.QueueListener(record_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+# Returns how many records were dropped because the writer thread fell behind
+def dropped_records():
+    return 0 if queue_handler is None else queue_handler.dropped
+
+
+# Returns whether the DEBUG and INFO records of the connection are kept
+# Every connection is sampled in or out as a whole, so a sampled connection's records can be followed from start to end
+def is_sampled(conn_ID: int):
+    # Spread the IDs out before comparing them with the rate
+    return (conn_ID * 0x9E3779B1) & 0xFFFFFFFF < sample_rate * 2**32
+
+
+# Logs an event along with its structured fields
+# Events about a connection are sampled with the rest of its events
+def log_event(logger: logging.Logger, level: int, event: str, conn_ID: int = None, exc_info=None, **fields):
+    if not logger.isEnabledFor(level):
+        return
+
+    if conn_ID is not None:
+        if level < logging.WARNING and not is_sampled(conn_ID):
+            return
+
+        fields["conn"] = conn_ID
+
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
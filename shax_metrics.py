@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+
+# Metrics kept in memory by a server process and served over HTTP in the Prometheus text format
+# Every metric can have labels. Each combination of label values gets its own series the first time it's used.
+
+# Default histogram buckets (in seconds) for the latency of the API's actions
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+# Escapes a label value the way the text format expects
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, label_values: tuple):
+    if not label_names:
+        return ""
+
+    return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in zip(label_names, label_values)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+
+        # Label values (key) -> Value of the series (value)
+        self.series: dict = {}
+
+    # Returns the lines of the metric in the text format
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in self.series.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+
+        return lines
+
+
+# A value that only goes up
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+
+# A value that can go up and down
+# Gauges without labels can be given a function that's called for their value every time they're collected
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), function=None) -> None:
+        super().__init__(name, help_text, label_names)
+        self.function = function
+
+    def set(self, value, *label_values):
+        self.series[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def collect(self):
+        if self.function is not None:
+            self.series[()] = self.function()
+
+        return super().collect()
+
+
+# Counts the observed values in cumulative buckets
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        # Each series is [count in each bucket (not cumulative) + the +Inf bucket, sum of the values]
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        label_names = self.label_names + ("le",)
+
+        for label_values, (counts, total) in self.series.items():
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                count += bucket_count
+                labels = _format_labels(label_names, label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+# Every metric the process serves
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: tuple = (), function=None):
+        return self.register(Gauge(name, help_text, label_names, function))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Returns every metric in the text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+    # Serves the metrics at /metrics on a plain HTTP server
+    async def serve(self, address: str, port: int):
+        return await asyncio.start_server(self.handle_request, address, port)
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+
+            # Skip the headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         "Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
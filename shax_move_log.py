@@ -0,0 +1,214 @@
+import asyncio
+import glob
+import os
+import struct
+
+from shax_engine.bitboard import TOTAL_NODES
+from shax_engine.board_manager import BoardManager
+
+# Append-only log of the games hosted by a server process, used to rebuild them after a crash
+# Every record is a fixed layout of little-endian fields that starts with its type, the game's ID
+# and the sequence number of the game's last move. Records are written in groups: every record appended
+# while a write is in progress goes out in the next write, with a single fsync for the whole group.
+
+# Record types
+START_RECORD = 0
+SNAPSHOT_RECORD = 1
+PLACE_RECORD = 2
+REMOVE_RECORD = 3
+MOVE_RECORD = 4
+END_RECORD = 5
+
+# Type, game ID, sequence number
+RECORD_HEADER = struct.Struct("<BqI")
+
+# Record type -> layout of the fields after the header
+RECORD_BODIES: dict = {
+    # Player 1's key, player 2's key, player number of the CPU (-1 if there's no CPU)
+    START_RECORD: struct.Struct("<qqb"),
+    # BoardManager.export_position()
+    SNAPSHOT_RECORD: struct.Struct("<" + "b" * (7 + TOTAL_NODES)),
+    # x, y
+    PLACE_RECORD: struct.Struct("<BB"),
+    # Piece ID
+    REMOVE_RECORD: struct.Struct("<b"),
+    # New x, new y, piece ID
+    MOVE_RECORD: struct.Struct("<BBb"),
+    END_RECORD: struct.Struct("<"),
+}
+
+# Name of the log holding the games recovered by compact_logs() until a server process takes them over
+RECOVERED_LOG = "recovered.log"
+
+
+def pack_record(record_type: int, game_ID: int, seq: int, *fields):
+    return RECORD_HEADER.pack(record_type, game_ID, seq) + RECORD_BODIES[record_type].pack(*fields)
+
+
+# Packs a successful game action the same way the API receives it
+# The coordinates are rounded to the node the board manager played the piece on, like BoardManager._is_empty_spot()
+def pack_action(game_ID: int, seq: int, action: str, params: dict):
+    if action == "place_piece":
+        return pack_record(PLACE_RECORD, game_ID, seq, round(params["x"]), round(params["y"]))
+
+    elif action == "remove_piece":
+        return pack_record(REMOVE_RECORD, game_ID, seq, int(params["piece_ID"]))
+
+    return pack_record(MOVE_RECORD, game_ID, seq, round(params["new_x"]), round(params["new_y"]),
+                       int(params["piece_ID"]))
+
+
+# A log file that a single server process appends to
+class MoveLog:
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        # Unbuffered so that a failed write can be cut back off the file without any of it being flushed later
+        self.file = open(path, "ab", buffering=0)
+
+        # Records waiting for the next write
+        self.pending: list = []
+
+        # Number of records appended and number of those that are on disk
+        self.appended = 0
+        self.committed = 0
+
+        # Task writing the current group of records
+        self.writer: asyncio.Task = None
+
+    def append(self, record: bytes):
+        self.pending.append(record)
+        self.appended += 1
+
+    # Waits until every record appended so far is on disk
+    # Raises the error if writing them failed (the records stay pending, so the next commit tries again)
+    async def commit(self):
+        target = self.appended
+
+        while self.committed < target:
+            if self.writer is None or self.writer.done():
+                self.writer = asyncio.ensure_future(self._write_group())
+
+            await asyncio.shield(self.writer)
+
+    async def _write_group(self):
+        records, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._write, b"".join(records))
+        except Exception:
+            # Put the records back in front of the ones appended during the write
+            self.pending[:0] = records
+            raise
+
+        self.committed += len(records)
+
+    def _write(self, data: bytes):
+        size = self.file.tell()
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[self.file.write(view):]
+
+            os.fsync(self.file.fileno())
+
+        except Exception:
+            # Cut off the part of the group that made it to the file since the whole group is written again
+            self.file.truncate(size)
+            raise
+
+    def close(self):
+        self._write(b"".join(self.pending))
+        self.committed += len(self.pending)
+        self.pending = []
+        self.file.close()
+
+
+# Rebuilds the games in a log file without going through the API
+# Returns the game ID (key) -> [BoardManager, sequence number, player keys, CPU player number] (value) of every
+# game that didn't end and the set of IDs of the games that ended
+def replay_log(path: str):
+    games = {}
+    ended = set()
+
+    with open(path, "rb") as log:
+        data = log.read()
+
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        record_type, game_ID, seq = RECORD_HEADER.unpack_from(data, offset)
+        body = RECORD_BODIES.get(record_type)
+
+        # Stop at a record that was only partly written
+        if body is None or offset + RECORD_HEADER.size + body.size > len(data):
+            break
+
+        fields = body.unpack_from(data, offset + RECORD_HEADER.size)
+        offset += RECORD_HEADER.size + body.size
+
+        if record_type == START_RECORD:
+            board_manager = BoardManager(min_pieces=2, max_pieces=12)
+            board_manager.start_game()
+            games[game_ID] = [board_manager, 0, fields[:2], fields[2]]
+
+        elif record_type == END_RECORD:
+            games.pop(game_ID, None)
+            ended.add(game_ID)
+
+        elif game_ID not in games:
+            continue
+
+        elif record_type == SNAPSHOT_RECORD:
+            games[game_ID][0] = BoardManager.from_position(fields)
+            games[game_ID][1] = seq
+
+        # Only replay each game's moves in order
+        elif seq == games[game_ID][1] + 1:
+            board_manager = games[game_ID][0]
+            board_manager.apply(fields)
+            games[game_ID][1] = seq
+
+    # The moves don't need to be undone
+    for board_manager, _, _, _ in games.values():
+        board_manager.undo_stack.clear()
+
+    return games, ended
+
+
+# Merges every log in the directory into a single log of the games that are still in progress
+# Returns the path of the merged log (None if there are no games left)
+def compact_logs(log_dir: str):
+    games = {}
+    ended = set()
+
+    paths = glob.glob(os.path.join(log_dir, "*.log"))
+    for path in paths:
+        log_games, log_ended = replay_log(path)
+        ended |= log_ended
+
+        # A game can show up in several logs if the server crashed while taking it over,
+        # so keep the copy with the most moves
+        for game_ID, game in log_games.items():
+            if game_ID not in games or game[1] > games[game_ID][1]:
+                games[game_ID] = game
+
+    for game_ID in ended:
+        games.pop(game_ID, None)
+
+    # Write the merged log next to the old ones and swap it in before deleting them
+    recovered_path = os.path.join(log_dir, RECOVERED_LOG)
+    if games:
+        with open(recovered_path + ".tmp", "wb") as log:
+            for game_ID, (board_manager, seq, keys, cpu_num) in games.items():
+                log.write(pack_record(START_RECORD, game_ID, 0, *keys, cpu_num))
+                log.write(pack_record(SNAPSHOT_RECORD, game_ID, seq, *board_manager.export_position()))
+
+            log.flush()
+            os.fsync(log.fileno())
+
+        os.replace(recovered_path + ".tmp", recovered_path)
+
+    for path in paths:
+        if path != recovered_path or not games:
+            os.remove(path)
+
+    return recovered_path if games else None
@@ -0,0 +1,352 @@
+import struct
+
+from shax_engine.bitboard import ADJACENT_PIECES, BOARD_SIZE, NODES
+from shax_engine.board_manager import GameState
+
+# Compact binary alternative to the JSON messages sent between the API and its clients
+# A client picks it by offering this subprotocol during the websocket handshake
+# Every frame is a fixed layout of little-endian fields that starts with a one-byte opcode
+BINARY_SUBPROTOCOL = "shax.binary.v1"
+
+# Opcodes for each action (OP_ERROR is only sent for responses that don't belong to an action)
+OP_ERROR = 0
+OP_JOIN_GAME = 1
+OP_QUIT_GAME = 2
+OP_PLACE_PIECE = 3
+OP_REMOVE_PIECE = 4
+OP_MOVE_PIECE = 5
+OP_GET_SNAPSHOT = 6
+OP_REJOIN_GAME = 7
+OP_SPECTATE_GAME = 8
+
+# Action name -> opcode
+ACTION_OPCODES: dict = {"join_game": OP_JOIN_GAME,
+                        "quit_game": OP_QUIT_GAME,
+                        "place_piece": OP_PLACE_PIECE,
+                        "remove_piece": OP_REMOVE_PIECE,
+                        "move_piece": OP_MOVE_PIECE,
+                        "get_snapshot": OP_GET_SNAPSHOT,
+                        "rejoin_game": OP_REJOIN_GAME,
+                        "spectate_game": OP_SPECTATE_GAME}
+
+# Opcode -> action name
+OPCODE_ACTIONS: dict = {opcode: action for action, opcode in ACTION_OPCODES.items()}
+
+# Bits of the flags byte in the response header
+SUCCESS_FLAG = 0b1
+BOARD_FLAG = 0b10
+WAITING_FLAG = 0b100
+DELTA_FLAG = 0b1000
+
+# Coordinates are packed into a single byte as (x << 4) | y
+NO_COORD = 0xFF
+
+# Piece IDs are sent as signed bytes and active pieces as a 64-bit mask of piece IDs,
+# so games can have at most 32 pieces per player
+NO_PIECE = -1
+
+# Request layouts (after the opcode)
+# join_game: game type, flags (bit 0 asks for delta updates)
+JOIN_REQUEST = struct.Struct("<BQB")
+OPCODE_ONLY = struct.Struct("<B")
+# place_piece: coordinate
+PLACE_REQUEST = struct.Struct("<BB")
+# remove_piece: piece ID
+REMOVE_REQUEST = struct.Struct("<Bb")
+# move_piece: new coordinate, piece ID
+MOVE_REQUEST = struct.Struct("<BBb")
+# rejoin_game: player key, flags (bit 0 asks for delta updates)
+REJOIN_REQUEST = struct.Struct("<BQB")
+# spectate_game: game ID, flags (bit 0 asks for delta updates)
+SPECTATE_REQUEST = struct.Struct("<BQB")
+
+# Response header: opcode, flags, next player, next game state, sequence number
+RESPONSE_HEADER = struct.Struct("<BBBBI")
+
+# Response bodies (after the header)
+# join_game: player number, lobby key, player 1 key, player 2 key, game ID
+JOIN_BODY = struct.Struct("<BQQQQ")
+# quit_game: end flag, winner
+QUIT_BODY = struct.Struct("<BB")
+# place_piece: new piece ID, new coordinate, active pieces
+PLACE_BODY = struct.Struct("<bBQ")
+# remove_piece: removed piece ID, active pieces
+REMOVE_BODY = struct.Struct("<bQ")
+# move_piece: moved piece ID, old coordinate, new coordinate, active pieces
+MOVE_BODY = struct.Struct("<bBBQ")
+# get_snapshot: active pieces
+SNAPSHOT_BODY = struct.Struct("<Q")
+# rejoin_game: player number, player 1 key, player 2 key, game ID, active pieces
+REJOIN_BODY = struct.Struct("<BQQQQ")
+# spectate_game: game ID, active pieces
+SPECTATE_BODY = struct.Struct("<QQ")
+
+# Optional board that follows the body: the ID of the piece on each node in NODES order (-1 if empty)
+BOARD_BODY = struct.Struct("<" + "b" * len(NODES))
+
+# Length of the UTF-8 strings (error and quit messages) that end a frame
+STRING_LENGTH = struct.Struct("<H")
+
+# The board layout sent with join_game, rejoin_game and spectate_game responses, in the same format as the JSON API
+ADJACENT_PIECES_JSON: list = [{"x": node[0], "y": node[1],
+                               "neighbors": [{"x": x, "y": y} for x, y in neighbors]}
+                              for node, neighbors in ADJACENT_PIECES.items()]
+
+
+def _pack_coord(x, y):
+    if x is None or y is None:
+        return NO_COORD
+
+    return (x << 4) | y
+
+
+def _unpack_coord(coord):
+    if coord == NO_COORD:
+        return None, None
+
+    return coord >> 4, coord & 0xF
+
+
+def _pack_piece(piece_ID):
+    return NO_PIECE if piece_ID is None else piece_ID
+
+
+def _unpack_piece(piece_ID):
+    return None if piece_ID == NO_PIECE else piece_ID
+
+
+def _pack_pieces(pieces):
+    mask = 0
+    for piece_ID in pieces:
+        mask |= 1 << piece_ID
+
+    return mask
+
+
+# Active pieces come back ordered by piece ID
+def _unpack_pieces(mask):
+    pieces = []
+    while mask:
+        low_bit = mask & -mask
+        pieces.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+
+    return pieces
+
+
+def _pack_string(text):
+    data = text.encode()
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(frame, offset):
+    length, = STRING_LENGTH.unpack_from(frame, offset)
+    offset += STRING_LENGTH.size
+    return frame[offset:offset + length].decode(), offset + length
+
+
+# Converts a JSON request into a binary frame
+def encode_request(request: dict):
+    opcode = ACTION_OPCODES[request["action"]]
+
+    if opcode == OP_JOIN_GAME:
+        return JOIN_REQUEST.pack(opcode, request["game_type"], int(bool(request.get("delta_updates", False))))
+
+    elif opcode == OP_PLACE_PIECE:
+        return PLACE_REQUEST.pack(opcode, _pack_coord(request["x"], request["y"]))
+
+    elif opcode == OP_REMOVE_PIECE:
+        return REMOVE_REQUEST.pack(opcode, request["piece_ID"])
+
+    elif opcode == OP_MOVE_PIECE:
+        return MOVE_REQUEST.pack(opcode, _pack_coord(request["new_x"], request["new_y"]), request["piece_ID"])
+
+    elif opcode == OP_REJOIN_GAME:
+        return REJOIN_REQUEST.pack(opcode, request["player_key"], int(bool(request.get("delta_updates", False))))
+
+    elif opcode == OP_SPECTATE_GAME:
+        return SPECTATE_REQUEST.pack(opcode, request["game_ID"], int(bool(request.get("delta_updates", False))))
+
+    return OPCODE_ONLY.pack(opcode)
+
+
+# Converts a binary frame back into the same request dict the JSON API receives
+def decode_request(frame: bytes):
+    opcode = frame[0]
+    request = {"action": OPCODE_ACTIONS.get(opcode, "")}
+
+    if opcode == OP_JOIN_GAME:
+        _, request["game_type"], flags = JOIN_REQUEST.unpack(frame)
+        request["delta_updates"] = bool(flags & 1)
+
+    elif opcode == OP_PLACE_PIECE:
+        _, coord = PLACE_REQUEST.unpack(frame)
+        request["x"], request["y"] = _unpack_coord(coord)
+
+    elif opcode == OP_REMOVE_PIECE:
+        _, request["piece_ID"] = REMOVE_REQUEST.unpack(frame)
+
+    elif opcode == OP_MOVE_PIECE:
+        _, coord, request["piece_ID"] = MOVE_REQUEST.unpack(frame)
+        request["new_x"], request["new_y"] = _unpack_coord(coord)
+
+    elif opcode == OP_REJOIN_GAME:
+        _, request["player_key"], flags = REJOIN_REQUEST.unpack(frame)
+        request["delta_updates"] = bool(flags & 1)
+
+    elif opcode == OP_SPECTATE_GAME:
+        _, request["game_ID"], flags = SPECTATE_REQUEST.unpack(frame)
+        request["delta_updates"] = bool(flags & 1)
+
+    return request
+
+
+# Converts a JSON response into a binary frame
+# The board is only included if the response has a board_state (delta updates leave it out)
+def encode_response(response: dict):
+    opcode = ACTION_OPCODES.get(response.get("action"), OP_ERROR)
+
+    flags = 0
+    if response.get("success"):
+        flags |= SUCCESS_FLAG
+    if "board_state" in response:
+        flags |= BOARD_FLAG
+    if response.get("waiting"):
+        flags |= WAITING_FLAG
+    if response.get("delta_updates"):
+        flags |= DELTA_FLAG
+
+    next_state = response.get("next_state", GameState.STOPPED.name)
+    frame = [RESPONSE_HEADER.pack(opcode, flags, response.get("next_player", 0),
+                                  GameState[next_state].value, response.get("seq", 0))]
+
+    if opcode == OP_JOIN_GAME:
+        frame.append(JOIN_BODY.pack(response["player_num"], response["lobby_key"],
+                                    response["player1_key"], response["player2_key"], response["game_ID"]))
+
+    elif opcode == OP_QUIT_GAME:
+        # EndFlags values are stored as 1-tuples
+        flag = response["flag"]
+        if isinstance(flag, (tuple, list)):
+            flag = flag[0]
+
+        frame.append(QUIT_BODY.pack(flag, response["winner"]))
+        frame.append(_pack_string(response.get("msg", "")))
+
+    # Errors that come from outside the game (like a spectator trying to move) have no move to describe
+    elif opcode == OP_PLACE_PIECE:
+        frame.append(PLACE_BODY.pack(_pack_piece(response.get("new_piece_ID")),
+                                     _pack_coord(response.get("new_x"), response.get("new_y")),
+                                     _pack_pieces(response.get("active_pieces", ()))))
+
+    elif opcode == OP_REMOVE_PIECE:
+        frame.append(REMOVE_BODY.pack(_pack_piece(response.get("removed_piece")),
+                                      _pack_pieces(response.get("active_pieces", ()))))
+
+    elif opcode == OP_MOVE_PIECE:
+        frame.append(MOVE_BODY.pack(_pack_piece(response.get("moved_piece")),
+                                    _pack_coord(response.get("old_x"), response.get("old_y")),
+                                    _pack_coord(response.get("new_x"), response.get("new_y")),
+                                    _pack_pieces(response.get("active_pieces", ()))))
+
+    elif opcode == OP_GET_SNAPSHOT:
+        frame.append(SNAPSHOT_BODY.pack(_pack_pieces(response.get("active_pieces", ()))))
+
+    elif opcode == OP_REJOIN_GAME:
+        frame.append(REJOIN_BODY.pack(response["player_num"], response["player1_key"], response["player2_key"],
+                                      response["game_ID"], _pack_pieces(response["active_pieces"])))
+
+    elif opcode == OP_SPECTATE_GAME:
+        frame.append(SPECTATE_BODY.pack(response["game_ID"], _pack_pieces(response["active_pieces"])))
+
+    if flags & BOARD_FLAG:
+        board_state = response["board_state"]
+        frame.append(BOARD_BODY.pack(*(board_state[y][x] for x, y in NODES)))
+
+    frame.append(_pack_string(response.get("error", "")))
+
+    return b"".join(frame)
+
+
+# Converts a binary frame back into the same response dict the JSON API sends
+def decode_response(frame: bytes):
+    opcode, flags, next_player, next_state, seq = RESPONSE_HEADER.unpack_from(frame)
+    offset = RESPONSE_HEADER.size
+
+    response = {"success": bool(flags & SUCCESS_FLAG),
+                "action": OPCODE_ACTIONS.get(opcode, ""),
+                "next_player": next_player,
+                "next_state": GameState(next_state).name,
+                "seq": seq}
+
+    if opcode == OP_JOIN_GAME:
+        response["player_num"], response["lobby_key"], response["player1_key"], response["player2_key"], \
+            response["game_ID"] = JOIN_BODY.unpack_from(frame, offset)
+        offset += JOIN_BODY.size
+
+        response["waiting"] = bool(flags & WAITING_FLAG)
+        response["delta_updates"] = bool(flags & DELTA_FLAG)
+        response["adjacent_pieces"] = ADJACENT_PIECES_JSON if response["success"] and not response["waiting"] else {}
+
+    elif opcode == OP_QUIT_GAME:
+        response["flag"], response["winner"] = QUIT_BODY.unpack_from(frame, offset)
+        response["msg"], offset = _unpack_string(frame, offset + QUIT_BODY.size)
+
+    elif opcode == OP_PLACE_PIECE:
+        new_ID, coord, active = PLACE_BODY.unpack_from(frame, offset)
+        offset += PLACE_BODY.size
+
+        response["new_piece_ID"] = _unpack_piece(new_ID)
+        response["new_x"], response["new_y"] = _unpack_coord(coord)
+        response["active_pieces"] = _unpack_pieces(active)
+
+    elif opcode == OP_REMOVE_PIECE:
+        removed_ID, active = REMOVE_BODY.unpack_from(frame, offset)
+        offset += REMOVE_BODY.size
+
+        response["removed_piece"] = _unpack_piece(removed_ID)
+        response["active_pieces"] = _unpack_pieces(active)
+
+    elif opcode == OP_MOVE_PIECE:
+        moved_ID, old_coord, new_coord, active = MOVE_BODY.unpack_from(frame, offset)
+        offset += MOVE_BODY.size
+
+        response["moved_piece"] = _unpack_piece(moved_ID)
+        response["old_x"], response["old_y"] = _unpack_coord(old_coord)
+        response["new_x"], response["new_y"] = _unpack_coord(new_coord)
+        response["active_pieces"] = _unpack_pieces(active)
+
+    elif opcode == OP_GET_SNAPSHOT:
+        active, = SNAPSHOT_BODY.unpack_from(frame, offset)
+        offset += SNAPSHOT_BODY.size
+
+        response["active_pieces"] = _unpack_pieces(active)
+
+    elif opcode == OP_REJOIN_GAME:
+        response["player_num"], response["player1_key"], response["player2_key"], response["game_ID"], active = \
+            REJOIN_BODY.unpack_from(frame, offset)
+        offset += REJOIN_BODY.size
+
+        response["active_pieces"] = _unpack_pieces(active)
+        response["delta_updates"] = bool(flags & DELTA_FLAG)
+        response["adjacent_pieces"] = ADJACENT_PIECES_JSON if response["success"] else {}
+
+    elif opcode == OP_SPECTATE_GAME:
+        response["game_ID"], active = SPECTATE_BODY.unpack_from(frame, offset)
+        offset += SPECTATE_BODY.size
+
+        response["active_pieces"] = _unpack_pieces(active)
+        response["delta_updates"] = bool(flags & DELTA_FLAG)
+        response["adjacent_pieces"] = ADJACENT_PIECES_JSON if response["success"] else {}
+
+    if flags & BOARD_FLAG:
+        board_state = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+        for (x, y), piece_ID in zip(NODES, BOARD_BODY.unpack_from(frame, offset)):
+            board_state[y][x] = piece_ID
+
+        response["board_state"] = board_state
+        offset += BOARD_BODY.size
+
+    response["error"], offset = _unpack_string(frame, offset)
+
+    return response
@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+import json
+import sqlite3
+import threading
+
+# Storage for the state the API needs to share between processes or keep across restarts:
+# the lobbies players are waiting in and a snapshot of every game in progress.
+# Games are stored as their sequence number, the flat tuple returned by BoardManager.export_position()
+# and the game's players: (player 1's key, player 2's key, player number of the CPU or -1 if there's no CPU)
+class GameStore(ABC):
+    # Saves the player waiting in the lobby for the game type
+    # The player is whatever string the caller uses to find them again
+    @abstractmethod
+    def add_lobby(self, game_type: int, player: str):
+        pass
+
+    # Removes the lobby and returns the player waiting in it (None if there's no lobby for the game type)
+    @abstractmethod
+    def take_lobby(self, game_type: int):
+        pass
+
+    @abstractmethod
+    def remove_lobby(self, game_type: int):
+        pass
+
+    # Removes every lobby (the players waiting in them are gone once the server restarts)
+    @abstractmethod
+    def clear_lobbies(self):
+        pass
+
+    # Saves the game's position after its latest move
+    @abstractmethod
+    def save_game(self, game_ID: int, seq: int, position: tuple, game_players: tuple):
+        pass
+
+    @abstractmethod
+    def delete_game(self, game_ID: int):
+        pass
+
+    # Returns (game ID, sequence number, position, players) for every saved game
+    @abstractmethod
+    def load_games(self):
+        pass
+
+    # Writes any buffered changes
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# Keeps everything in dicts (nothing survives a restart or is shared between processes)
+class MemoryStore(GameStore):
+    def __init__(self) -> None:
+        # Game type (key) -> Waiting player (value)
+        self.lobbies: dict = {}
+
+        # Game ID (key) -> (Sequence number, position, players) (value)
+        self.games: dict = {}
+
+    def add_lobby(self, game_type: int, player: str):
+        self.lobbies[game_type] = player
+
+    def take_lobby(self, game_type: int):
+        return self.lobbies.pop(game_type, None)
+
+    def remove_lobby(self, game_type: int):
+        self.lobbies.pop(game_type, None)
+
+    def clear_lobbies(self):
+        self.lobbies.clear()
+
+    def save_game(self, game_ID: int, seq: int, position: tuple, game_players: tuple):
+        self.games[game_ID] = (seq, position, game_players)
+
+    def delete_game(self, game_ID: int):
+        self.games.pop(game_ID, None)
+
+    def load_games(self):
+        return [(game_ID, *game) for game_ID, game in self.games.items()]
+
+
+# Keeps everything in a SQLite database in WAL mode, so several processes can share it
+# and the games can be recovered after a restart
+# Lobby changes are written right away since other processes might be looking for them.
+# Game saves are buffered and written in a single transaction by flush(), and only the latest
+# save of each game is kept until then
+class SQLiteStore(GameStore):
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        # flush() is run in a separate thread so the event loop doesn't wait on the disk
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS lobbies (game_type INTEGER PRIMARY KEY, player TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS games (game_ID INTEGER PRIMARY KEY, seq INTEGER NOT NULL, "
+                        "position TEXT NOT NULL, players TEXT NOT NULL)")
+
+        # Game ID (key) -> (Sequence number, position, players) of its latest save, or None if it was deleted (value)
+        self.pending_games: dict = {}
+        self.pending_lock = threading.Lock()
+
+    def add_lobby(self, game_type: int, player: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO lobbies VALUES (?, ?)", (game_type, player))
+
+    def take_lobby(self, game_type: int):
+        with self.lock:
+            row = self.db.execute("DELETE FROM lobbies WHERE game_type = ? RETURNING player", (game_type,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def remove_lobby(self, game_type: int):
+        with self.lock:
+            self.db.execute("DELETE FROM lobbies WHERE game_type = ?", (game_type,))
+
+    def clear_lobbies(self):
+        with self.lock:
+            self.db.execute("DELETE FROM lobbies")
+
+    def save_game(self, game_ID: int, seq: int, position: tuple, game_players: tuple):
+        with self.pending_lock:
+            self.pending_games[game_ID] = (seq, position, game_players)
+
+    def delete_game(self, game_ID: int):
+        with self.pending_lock:
+            self.pending_games[game_ID] = None
+
+    def load_games(self):
+        self.flush()
+
+        with self.lock:
+            rows = self.db.execute("SELECT game_ID, seq, position, players FROM games").fetchall()
+
+        return [(game_ID, seq, tuple(json.loads(position)), tuple(json.loads(game_players)))
+                for game_ID, seq, position, game_players in rows]
+
+    def flush(self):
+        # Swap out the buffer first so new saves can keep coming in while it's written
+        with self.pending_lock:
+            pending, self.pending_games = self.pending_games, {}
+
+        if not pending:
+            return
+
+        saved = [(game_ID, save[0], json.dumps(save[1]), json.dumps(save[2]))
+                 for game_ID, save in pending.items() if save is not None]
+        deleted = [(game_ID,) for game_ID, save in pending.items() if save is None]
+
+        try:
+            with self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self.db.executemany("INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?)", saved)
+                    self.db.executemany("DELETE FROM games WHERE game_ID = ?", deleted)
+                    self.db.execute("COMMIT")
+                except Exception:
+                    if self.db.in_transaction:
+                        self.db.execute("ROLLBACK")
+                    raise
+
+        except Exception:
+            # Put the batch back so the next flush writes it, under the saves that came in since (they're newer)
+            with self.pending_lock:
+                self.pending_games = {**pending, **self.pending_games}
+            raise
+
+    def close(self):
+        self.flush()
+
+        with self.lock:
+            self.db.close()
+
+
+# Opens the SQLite store at the path or a new in-memory store if there's no path
+def open_store(path: str = None):
+    if path is None:
+        return MemoryStore()
+
+    return SQLiteStore(path)
@@ -0,0 +1,139 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import json
+import random
+
+import shax_api
+from shax_engine.board_manager import GameState
+from shax_move_log import MoveLog, replay_log
+
+
+# Stands in for a player's websocket and keeps every message sent to it
+class FakeConnection:
+    def __init__(self) -> None:
+        self.remote_address = ("127.0.0.1", 0)
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(json.loads(message))
+
+
+# Waits until the connection gets another message
+async def wait_for_message(connection, total_messages):
+    while len(connection.messages) == total_messages:
+        await asyncio.sleep(0)
+
+
+# Plays random moves (the CPU's seat plays the moves that make a jare first) until the game ends
+# and waits for the game's actor to finish. Returns the game's board manager
+async def play_to_end(connection, rng: random.Random, cpu=None):
+    game_manager = shax_api.players[connection][0]
+    actor = shax_api.game_actors[game_manager]
+    for _ in range(2000):
+        if game_manager.game_state == GameState.STOPPED:
+            break
+
+        total_messages = len(connection.messages)
+        info = game_manager.legal_moves_info()
+        if cpu is not None and game_manager.current_turn == cpu.player_num:
+            best = [move for move, _, makes_jare in info if makes_jare] or [move for move, _, _ in info]
+            action, params = shax_api.get_cpu_action(game_manager, rng.choice(best))
+            actor.submit(shax_api.GameRequest(cpu, action, params, timed=False))
+        else:
+            action, params = shax_api.get_cpu_action(game_manager, rng.choice(info)[0])
+            await shax_api.handle_message(connection, {"action": action, **params})
+
+        await asyncio.wait_for(wait_for_message(connection, total_messages), 5)
+
+    await asyncio.wait_for(actor.task, 5)
+    return game_manager
+
+
+def test_local_game_ends(tmp_path, monkeypatch):
+    monkeypatch.setattr(shax_api, "move_log", MoveLog(str(tmp_path / "0.log")))
+
+    async def run():
+        connection = FakeConnection()
+        await shax_api.handle_message(connection, {"action": "join_game", "game_type": shax_api.LOCAL_GAME_MASK})
+        game_ID = connection.messages[-1]["game_ID"]
+
+        game_manager = await play_to_end(connection, random.Random(1))
+        assert game_manager.game_state == GameState.STOPPED
+
+        # Every update has the board as it was right after its move
+        updates = [message for message in connection.messages if message["action"] == "remove_piece"]
+        assert updates[-1]["board_state"] == game_manager.board_state.tolist()
+
+        # The players hear who won and are taken out of the game
+        end = connection.messages[-1]
+        assert end["action"] == "quit_game"
+        assert end["flag"] == list(shax_api.EndFlags.PLAYER_WON.value)
+        assert end["winner"] == game_manager.current_turn
+        assert connection not in shax_api.players
+        assert game_manager not in shax_api.game_actors
+
+        # The game is no longer counted, saved or restored from the move log
+        assert "shax_active_games 0" in shax_api.metrics.render()
+        assert shax_api.game_store.load_games() == []
+        games, ended = replay_log(shax_api.move_log.path)
+        assert game_ID in ended and game_ID not in games
+
+        # The player can start a new game
+        await shax_api.handle_message(connection, {"action": "join_game", "game_type": shax_api.LOCAL_GAME_MASK})
+        assert connection.messages[-1]["success"]
+        await shax_api.leave_game(connection, shax_api.EndFlags.PLAYER_QUIT)
+
+    asyncio.run(run())
+    shax_api.move_log.close()
+
+
+def test_cpu_win_ends_game(monkeypatch):
+    # The CPU's moves are played by the test instead of the search
+    monkeypatch.setattr(shax_api.CPUPlayer, "start_turn", lambda self, game_manager: None)
+
+    async def run():
+        connection = FakeConnection()
+        await shax_api.handle_message(connection, {"action": "join_game", "game_type": shax_api.CPU_GAME_MASK})
+        cpu = shax_api.players[connection][1]
+
+        game_manager = await play_to_end(connection, random.Random(2), cpu)
+        assert game_manager.game_state == GameState.STOPPED
+        assert game_manager.current_turn == cpu.player_num
+
+        end = connection.messages[-1]
+        assert end["action"] == "quit_game"
+        assert end["winner"] == cpu.player_num
+        assert connection not in shax_api.players
+        assert game_manager not in shax_api.game_IDs
+
+    asyncio.run(run())
+
+
+def test_cpu_failure_ends_game(monkeypatch):
+    # The CPU's worker process dies while searching its first move
+    def broken_search(position):
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+    monkeypatch.setattr(shax_api, "search_position", broken_search)
+
+    async def run():
+        connection = FakeConnection()
+        await shax_api.handle_message(connection, {"action": "join_game", "game_type": shax_api.CPU_GAME_MASK})
+        game_manager, cpu, _ = shax_api.players[connection]
+
+        # Give the CPU the first move
+        if game_manager.current_turn != cpu.player_num:
+            action, params = shax_api.get_cpu_action(game_manager, game_manager.legal_moves()[0])
+            await shax_api.handle_message(connection, {"action": action, **params})
+
+        async def wait_for_end():
+            while connection.messages[-1]["action"] != "quit_game":
+                await asyncio.sleep(0)
+
+        await asyncio.wait_for(wait_for_end(), 5)
+
+        assert connection.messages[-1]["msg"] == "The CPU opponent stopped working."
+        assert connection not in shax_api.players
+        assert game_manager not in shax_api.game_IDs
+
+    asyncio.run(run())
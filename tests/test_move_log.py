@@ -0,0 +1,81 @@
+import asyncio
+import os
+import random
+
+import shax_move_log
+from shax_engine.board_manager import BoardManager, GameState
+from shax_move_log import START_RECORD, MoveLog, pack_action, pack_record, replay_log
+
+
+# Turns a move from BoardManager.legal_moves() into the action and parameters a client would send,
+# with the coordinates a little off the node like a player's tap
+def get_action(board_manager: BoardManager, move, rng: random.Random):
+    if board_manager.game_state == GameState.PLACEMENT:
+        return "place_piece", {"x": move[0] + rng.uniform(-0.2, 0.2), "y": move[1]}
+    elif board_manager.game_state == GameState.MOVEMENT:
+        return "move_piece", {"new_x": move[0], "new_y": move[1] + rng.uniform(-0.2, 0.2), "piece_ID": move[2]}
+    else:
+        return "remove_piece", {"piece_ID": move[0]}
+
+
+def test_replay_matches_live_game(tmp_path):
+    rng = random.Random(3)
+    log = MoveLog(str(tmp_path / "0.log"))
+    log.append(pack_record(START_RECORD, 1, 0, 10, 20, -1))
+
+    board_manager = BoardManager(min_pieces=2, max_pieces=12)
+    board_manager.start_game()
+    for seq in range(1, 120):
+        if board_manager.game_state == GameState.STOPPED:
+            break
+
+        action, params = get_action(board_manager, rng.choice(board_manager.legal_moves()), rng)
+        player_num = board_manager.current_turn
+        if action == "place_piece":
+            error = board_manager.place_piece(params["x"], params["y"], player_num)[-1]
+        elif action == "move_piece":
+            error = board_manager.move_piece(params["new_x"], params["new_y"], params["piece_ID"], player_num)[-1]
+        else:
+            error = board_manager.remove_piece(params["piece_ID"], player_num)[-1]
+
+        assert error == ""
+        log.append(pack_action(1, seq, action, params))
+
+    log.close()
+    games, _ = replay_log(log.path)
+    assert games[1][0].export_position() == board_manager.export_position()
+
+
+def test_failed_commit_is_retried(tmp_path, monkeypatch):
+    log = MoveLog(str(tmp_path / "0.log"))
+    records = [pack_record(START_RECORD, game_ID, 0, 10, 20, -1) for game_ID in range(1, 4)]
+
+    # The first write reaches the file but never makes it to disk
+    fsync = os.fsync
+    failures = [OSError("disk full")]
+
+    def failing_fsync(fd):
+        if failures:
+            raise failures.pop()
+        fsync(fd)
+
+    monkeypatch.setattr(shax_move_log.os, "fsync", failing_fsync)
+
+    async def commit_twice():
+        log.append(records[0])
+        log.append(records[1])
+        results = await asyncio.gather(log.commit(), log.commit(), return_exceptions=True)
+        assert all(isinstance(result, OSError) for result in results)
+        assert log.committed == 0
+
+        log.append(records[2])
+        await asyncio.wait_for(log.commit(), 5)
+
+    asyncio.run(commit_twice())
+    log.close()
+
+    with open(log.path, "rb") as file:
+        assert file.read() == b"".join(records)
+
+    games, _ = replay_log(log.path)
+    assert sorted(games) == [1, 2, 3]
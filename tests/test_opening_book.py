@@ -0,0 +1,25 @@
+from shax_engine.board_manager import BoardManager
+from shax_engine.opening_book import OpeningBook
+
+
+def test_book_is_only_used_with_its_piece_limits(tmp_path):
+    board_manager = BoardManager(min_pieces=2, max_pieces=12)
+    board_manager.start_game()
+    board_manager.apply((0, 0))
+
+    book = OpeningBook(board_manager.MIN_PIECES, board_manager.MAX_PIECES)
+    book.add(board_manager, (6, 6))
+    book.save(str(tmp_path / "book.npy"))
+    book = OpeningBook.load(str(tmp_path / "book.npy"))
+    assert book.probe(board_manager) == [6, 6]
+
+    # The turned version of the position gets the turned move
+    turned = BoardManager(min_pieces=2, max_pieces=12)
+    turned.start_game()
+    turned.apply((6, 0))
+    assert book.probe(turned) == [0, 6]
+
+    other_limits = BoardManager(min_pieces=2, max_pieces=9)
+    other_limits.start_game()
+    other_limits.apply((0, 0))
+    assert book.probe(other_limits) is None
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import shax_api
+from shax_protocol import decode_response
+
+
+# Stands in for a player's websocket and keeps every message sent to it, decoded from either protocol
+class FakeConnection:
+    def __init__(self, binary=False) -> None:
+        self.remote_address = ("127.0.0.1", 0)
+        self.messages = []
+
+        if binary:
+            shax_api.binary_connections.add(self)
+
+    async def send(self, message):
+        self.messages.append(decode_response(message) if isinstance(message, bytes) else json.loads(message))
+
+
+# Waits until the connection gets a message about the action and returns it
+async def wait_for_action(connection, action: str):
+    while not any(message.get("action") == action for message in connection.messages):
+        await asyncio.sleep(0)
+
+    return next(message for message in connection.messages if message.get("action") == action)
+
+
+# The JSON player takes delta updates and the binary player full ones
+def test_binary_player_gets_json_players_tap():
+    async def run():
+        json_player = FakeConnection()
+        binary_player = FakeConnection(binary=True)
+        await shax_api.handle_message(json_player, {"action": "join_game", "game_type": 0, "delta_updates": True})
+        await shax_api.handle_message(binary_player, {"action": "join_game", "game_type": 0})
+
+        game_manager = shax_api.players[json_player][0]
+        if game_manager.current_turn != shax_api.players[json_player][2]:
+            await shax_api.handle_message(binary_player, {"action": "place_piece", "x": 0, "y": 0})
+            await wait_for_action(json_player, "place_piece")
+            json_player.messages.clear()
+            binary_player.messages.clear()
+
+        # A tap next to the node at (3, 2)
+        await shax_api.handle_message(json_player, {"action": "place_piece", "x": 2.9, "y": 2.1})
+
+        # Both players hear about the piece on the node it went on
+        for connection in (json_player, binary_player):
+            update = await asyncio.wait_for(wait_for_action(connection, "place_piece"), 5)
+            assert update["success"]
+            assert (update["new_x"], update["new_y"]) == (3, 2)
+            if connection is binary_player:
+                assert update["board_state"][2][3] == update["new_piece_ID"]
+            else:
+                assert "board_state" not in update
+
+        await shax_api.leave_game(json_player, shax_api.EndFlags.PLAYER_QUIT)
+        shax_api.binary_connections.discard(binary_player)
+
+    asyncio.run(run())
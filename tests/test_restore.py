@@ -0,0 +1,62 @@
+import asyncio
+import random
+
+import shax_api
+from shax_engine.board_manager import BoardManager, GameState
+from shax_move_log import SNAPSHOT_RECORD, START_RECORD, MoveLog, pack_record, replay_log
+
+
+# Plays random moves from the start of a game until it's over or max_plies moves were played
+def play_randomly(rng: random.Random, max_plies: int):
+    board_manager = BoardManager(min_pieces=2, max_pieces=12)
+    board_manager.start_game()
+    plies = 0
+    while board_manager.game_state != GameState.STOPPED and plies < max_plies:
+        board_manager.apply(rng.choice(board_manager.legal_moves()))
+        plies += 1
+
+    return board_manager, plies
+
+
+def test_restore_closes_finished_and_abandoned_games(tmp_path, monkeypatch):
+    rng = random.Random(4)
+    finished, finished_plies = play_randomly(rng, 2000)
+    in_progress, in_progress_plies = play_randomly(rng, 10)
+    assert finished.game_state == GameState.STOPPED
+    assert in_progress.game_state != GameState.STOPPED
+
+    # A recovered log like the one left by a server that stopped before the first game's end was recorded
+    recovered_path = str(tmp_path / "recovered.log")
+    recovered = MoveLog(recovered_path)
+    for game_ID, board_manager, plies in ((1, finished, finished_plies), (2, in_progress, in_progress_plies)):
+        recovered.append(pack_record(START_RECORD, game_ID, 0, 10 * game_ID, 10 * game_ID + 1, -1))
+        recovered.append(pack_record(SNAPSHOT_RECORD, game_ID, plies, *board_manager.export_position()))
+    recovered.close()
+
+    monkeypatch.setattr(shax_api, "move_log", MoveLog(str(tmp_path / "0.log")))
+    monkeypatch.setattr(shax_api, "rejoin_timeout", 0)
+
+    async def run():
+        await shax_api.restore_games(recovered_path)
+
+        # Only the game in progress is hosted, and the finished one won't be restored again
+        assert list(shax_api.game_IDs.values()) == [2]
+        assert sorted(shax_api.rejoin_seats) == [20, 21]
+        games, ended = replay_log(shax_api.move_log.path)
+        assert list(games) == [2] and ended == {1}
+
+        # Nobody comes back for the game in progress
+        game_manager = next(iter(shax_api.game_IDs))
+        actor = shax_api.game_actors[game_manager]
+        await shax_api.expire_seats(list(shax_api.rejoin_seats.values()))
+        await asyncio.wait_for(actor.task, 5)
+
+        assert shax_api.game_IDs == {}
+        assert shax_api.players == {}
+        assert shax_api.rejoin_seats == {}
+        assert shax_api.game_store.load_games() == []
+        games, ended = replay_log(shax_api.move_log.path)
+        assert games == {} and ended == {1, 2}
+
+    asyncio.run(run())
+    shax_api.move_log.close()
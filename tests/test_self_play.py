@@ -0,0 +1,17 @@
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+from self_play import check_games, play_batch
+
+
+# Plays a batch of seeded random games on the batch engine and replays them on BoardManager (like --check)
+@pytest.mark.parametrize("seed, min_pieces, max_pieces", [(1, 2, 12), (2, 2, 12), (3, 3, 8)])
+def test_batch_board_matches_board_manager(seed, min_pieces, max_pieces):
+    args = Namespace(min_pieces=min_pieces, max_pieces=max_pieces, max_plies=300)
+    _, codes = play_batch(20, args, np.random.default_rng(seed))
+
+    # The games should get far enough to move pieces and make jare
+    assert len(codes) > 30
+    assert check_games(codes, args) == ""
@@ -0,0 +1,37 @@
+import sqlite3
+
+import pytest
+
+from shax_store import SQLiteStore
+
+
+# Wraps a connection to the database so that writing a batch of games fails
+class FailingDatabase:
+    def __init__(self, db) -> None:
+        self.db = db
+
+    def executemany(self, sql, rows):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def test_failed_flush_is_retried(tmp_path):
+    store = SQLiteStore(str(tmp_path / "games.db"))
+    store.save_game(1, 5, (2, 12, 0), (10, 11, -1))
+    store.flush()
+
+    # The game ends and another one starts, but the write fails
+    store.delete_game(1)
+    store.save_game(2, 1, (2, 12, 1), (20, 21, -1))
+    db = store.db
+    store.db = FailingDatabase(db)
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+
+    # A save that comes in before the retry is newer than the one that failed
+    store.db = db
+    store.save_game(2, 2, (2, 12, 0), (20, 21, -1))
+    assert store.load_games() == [(2, 2, (2, 12, 0), (20, 21, -1))]
+    store.close()